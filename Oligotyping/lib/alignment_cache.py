@@ -0,0 +1,336 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2010 - 2012, A. Murat Eren
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# Please read the COPYING file.
+
+"""A compact binary copy of an alignment that lives next to the FASTA file.
+
+   Converting an alignment into the cache takes one pass over the FASTA file. The
+   cache directory (alignment path + CACHE_SUFFIX) holds:
+
+       matrix.npy      : N x L uint8 matrix of (upper case) ASCII codes of bases,
+       ids.bin         : read IDs, separated by new line characters,
+       id_offsets.npy  : N + 1 byte offsets of read IDs in ids.bin,
+       samples-*.npy   : sample index of every read for a given sample name separator,
+       samples-*.txt   : sample names for these indices,
+       signature       : size and modification time of the FASTA file.
+
+   Everything is memory-mapped when the cache is loaded, so repeated runs on the same
+   alignment (entropy-analysis, oligotype, decompose, or parameter sweeps) do not
+   have to parse the text file again. The cache is rebuilt when the FASTA file changes."""
+
+import os
+import shutil
+import hashlib
+import tempfile
+
+import numpy
+
+import Oligotyping.lib.fastalib as u
+from Oligotyping.utils.utils import UniqueFASTAEntry
+from Oligotyping.utils.utils import get_sample_codes
+from Oligotyping.utils.utils import pretty_print
+
+
+CACHE_SUFFIX = '.cache'
+CACHE_VERSION = 1
+
+# number of reads that are encoded (or decoded) at once.
+CHUNK_SIZE = 10000
+
+
+class AlignmentCacheError(Exception):
+    def __init__(self, e = None):
+        Exception.__init__(self)
+        self.e = e
+        return
+    def __str__(self):
+        return 'Alignment Cache Error: %s' % self.e
+
+
+class AlignmentCache:
+    def __init__(self, alignment_path, progress = None):
+        self.alignment_path = alignment_path
+        self.cache_path = alignment_path + CACHE_SUFFIX
+        self.progress = progress
+
+        self.num_reads = None
+        self.alignment_length = None
+
+        self.matrix = None
+        self.ids = None
+        self.id_offsets = None
+
+        alignment_stat = os.stat(self.alignment_path)
+        self.signature = '%d\t%d\t%d' % (CACHE_VERSION, alignment_stat.st_size, alignment_stat.st_mtime_ns)
+
+        if not self.load():
+            self.build()
+            if not self.load():
+                raise AlignmentCacheError("Cache for '%s' could not be loaded after it was built." % self.alignment_path)
+
+
+    def load(self):
+        signature_path = os.path.join(self.cache_path, 'signature')
+        if not os.path.exists(signature_path):
+            return False
+
+        signature = open(signature_path).read().split('\n')
+        if signature[0] != self.signature:
+            return False
+
+        self.num_reads, self.alignment_length = [int(x) for x in signature[1].split('\t')]
+
+        self.matrix = numpy.load(os.path.join(self.cache_path, 'matrix.npy'), mmap_mode = 'r')
+        self.id_offsets = numpy.load(os.path.join(self.cache_path, 'id_offsets.npy'), mmap_mode = 'r')
+
+        ids_path = os.path.join(self.cache_path, 'ids.bin')
+        if os.path.getsize(ids_path):
+            self.ids = numpy.memmap(ids_path, dtype = numpy.uint8, mode = 'r')
+        else:
+            self.ids = numpy.zeros(0, dtype = numpy.uint8)
+
+        return True
+
+
+    def build(self):
+        fasta = u.SequenceSource(self.alignment_path, lazy_init = False)
+        num_reads = fasta.total_seq
+
+        if not next(fasta):
+            fasta.close()
+            raise AlignmentCacheError("There are no reads in '%s'." % self.alignment_path)
+
+        alignment_length = len(fasta.seq)
+        if not alignment_length:
+            fasta.close()
+            raise AlignmentCacheError("Reads in '%s' are empty." % self.alignment_path)
+
+        try:
+            tmp_path = tempfile.mkdtemp(dir = os.path.dirname(os.path.abspath(self.alignment_path)),
+                                        prefix = os.path.basename(self.alignment_path) + CACHE_SUFFIX + '-')
+        except (IOError, OSError) as e:
+            fasta.close()
+            raise AlignmentCacheError("Cache directory could not be created: '%s'" % e)
+
+        if self.progress:
+            self.progress.new('Caching the alignment')
+
+        try:
+            matrix = numpy.lib.format.open_memmap(os.path.join(tmp_path, 'matrix.npy'), mode = 'w+',
+                                                  dtype = numpy.uint8, shape = (num_reads, alignment_length))
+            ids_file = open(os.path.join(tmp_path, 'ids.bin'), 'wb')
+            id_offsets = numpy.zeros(num_reads + 1, dtype = numpy.int64)
+
+            seqs, ids = [fasta.seq], [fasta.id]
+            num_reads_stored = 0
+            while 1:
+                more_reads = next(fasta)
+
+                if more_reads:
+                    if len(fasta.seq) != alignment_length:
+                        raise AlignmentCacheError("Not all reads have the same length.")
+                    seqs.append(fasta.seq)
+                    ids.append(fasta.id)
+
+                if len(seqs) == CHUNK_SIZE or (seqs and not more_reads):
+                    try:
+                        block = ''.join(seqs).encode('ascii')
+                    except UnicodeEncodeError:
+                        raise AlignmentCacheError("Reads contain non-ASCII characters.")
+
+                    chunk_end = num_reads_stored + len(seqs)
+                    matrix[num_reads_stored:chunk_end] = numpy.frombuffer(block, dtype = numpy.uint8).reshape(len(seqs), alignment_length)
+
+                    encoded_ids = [('%s\n' % read_id).encode('utf-8') for read_id in ids]
+                    id_offsets[num_reads_stored + 1:chunk_end + 1] = id_offsets[num_reads_stored] + numpy.cumsum([len(i) for i in encoded_ids])
+                    ids_file.write(b''.join(encoded_ids))
+
+                    num_reads_stored = chunk_end
+                    seqs, ids = [], []
+
+                    if self.progress:
+                        self.progress.update('%s of %s reads encoded' % (pretty_print(num_reads_stored), pretty_print(num_reads)))
+
+                if not more_reads:
+                    break
+
+            if num_reads_stored != num_reads:
+                raise AlignmentCacheError("Number of reads in '%s' could not be determined." % self.alignment_path)
+
+            matrix.flush()
+            del matrix
+            ids_file.close()
+            numpy.save(os.path.join(tmp_path, 'id_offsets.npy'), id_offsets)
+
+            signature_file = open(os.path.join(tmp_path, 'signature'), 'w')
+            signature_file.write('%s\n%d\t%d\n' % (self.signature, num_reads, alignment_length))
+            signature_file.close()
+
+            if os.path.exists(self.cache_path):
+                shutil.rmtree(self.cache_path)
+            os.rename(tmp_path, self.cache_path)
+        except (IOError, OSError) as e:
+            raise AlignmentCacheError("Cache could not be stored: '%s'" % e)
+        finally:
+            fasta.close()
+            if os.path.exists(tmp_path):
+                shutil.rmtree(tmp_path)
+            if self.progress:
+                self.progress.end()
+
+
+    def get_id(self, index):
+        return self.ids[self.id_offsets[index]:self.id_offsets[index + 1] - 1].tobytes().decode('utf-8')
+
+
+    def get_ids(self, start = 0, end = None):
+        """Returns read IDs of reads from `start` to `end`"""
+        if end is None:
+            end = self.num_reads
+
+        if start >= end:
+            return []
+
+        return self.ids[self.id_offsets[start]:self.id_offsets[end] - 1].tobytes().decode('utf-8').split('\n')
+
+
+    def get_seq(self, index):
+        return self.matrix[index].tobytes().decode('ascii')
+
+
+    def get_seqs(self, start = 0, end = None):
+        """Returns sequences of reads from `start` to `end`"""
+        if end is None:
+            end = self.num_reads
+
+        block = self.matrix[start:end].tobytes().decode('ascii')
+        L = self.alignment_length
+        return [block[i:i + L] for i in range(0, len(block), L)]
+
+
+    def get_sample_codes(self, sample_name_separator = '_'):
+        """Returns a tuple of (sample index of every read, sample names)."""
+        file_name = 'samples-%s' % sample_name_separator.encode('utf-8').hex()
+        codes_path = os.path.join(self.cache_path, file_name + '.npy')
+        names_path = os.path.join(self.cache_path, file_name + '.txt')
+
+        if os.path.exists(codes_path) and os.path.exists(names_path):
+            sample_names = [l.rstrip('\n') for l in open(names_path)]
+            return (numpy.load(codes_path, mmap_mode = 'r'), sample_names)
+
+        read_ids = (read_id for start in range(0, self.num_reads, CHUNK_SIZE) \
+                                for read_id in self.get_ids(start, min(start + CHUNK_SIZE, self.num_reads)))
+        sample_codes, sample_names = get_sample_codes(read_ids, sample_name_separator)
+
+        try:
+            numpy.save(codes_path, sample_codes)
+            names_file = open(names_path, 'w')
+            names_file.write(''.join(['%s\n' % sample for sample in sample_names]))
+            names_file.close()
+        except (IOError, OSError):
+            pass
+
+        return (sample_codes, sample_names)
+
+
+    def get_unique_read_objects(self):
+        """Returns UniqueFASTAEntry objects in the same order of SequenceSource(unique = True)"""
+        matrix = numpy.ascontiguousarray(self.matrix)
+        rows = matrix.view(numpy.dtype((numpy.void, self.alignment_length))).ravel()
+        _, first_indices, inverse, counts = numpy.unique(rows, return_index = True, return_inverse = True, return_counts = True)
+
+        # read indices grouped by unique sequences, each group in the order of the file
+        read_indices = numpy.argsort(inverse.ravel(), kind = 'stable')
+        boundaries = numpy.concatenate(([0], numpy.cumsum(counts)))
+        ids = self.get_ids()
+
+        unique_entries = []
+        for i in range(0, len(counts)):
+            seq = matrix[first_indices[i]].tobytes().decode('ascii')
+            hash = hashlib.sha1(seq.encode('utf-8')).hexdigest()
+            unique_entries.append((int(counts[i]), hash, seq, read_indices[boundaries[i]:boundaries[i + 1]]))
+
+        unique_entries.sort(key = lambda x: (x[0], x[1]), reverse = True)
+
+        return [UniqueFASTAEntry(seq, [ids[j] for j in indices]) for (count, hash, seq, indices) in unique_entries]
+
+
+class CachedSequenceSource:
+    """Iterates through reads in an AlignmentCache with the same interface of
+       fastalib.SequenceSource (id, seq, pos, total_seq, next, reset and close)"""
+    def __init__(self, alignment_cache):
+        self.cache = alignment_cache
+        self.fasta_file_path = alignment_cache.alignment_path
+        self.total_seq = alignment_cache.num_reads
+        self.unique = False
+
+        self.pos = 0
+        self.id  = None
+        self.seq = None
+        self.ids = []
+
+        self.chunk_start = 0
+        self.chunk_ids = []
+        self.chunk_seqs = []
+
+        self.index = None
+
+    def __next__(self):
+        if self.pos >= self.total_seq:
+            return False
+
+        chunk_index = self.pos - self.chunk_start
+        if chunk_index >= len(self.chunk_seqs):
+            self.chunk_start = self.pos
+            chunk_end = min(self.pos + CHUNK_SIZE, self.total_seq)
+            self.chunk_ids = self.cache.get_ids(self.pos, chunk_end)
+            self.chunk_seqs = self.cache.get_seqs(self.pos, chunk_end)
+            chunk_index = 0
+
+        self.id = self.chunk_ids[chunk_index]
+        self.seq = self.chunk_seqs[chunk_index]
+        self.pos += 1
+
+        return True
+
+    def get_seq_by_read_id(self, read_id):
+        if not self.index:
+            self.index = u.FastaIndex(self.fasta_file_path)
+
+        return self.index.get_seq(read_id)
+
+    def reset(self):
+        self.pos = 0
+        self.id  = None
+        self.seq = None
+        self.ids = []
+        self.chunk_start = 0
+        self.chunk_ids = []
+        self.chunk_seqs = []
+
+    def close(self):
+        if self.index:
+            self.index.close()
+
+
+def get_alignment_cache(alignment_path, progress = None):
+    """Returns an AlignmentCache for the alignment, or None if the alignment can't be cached
+       (i.e., reads are not of the same length, or the cache can't be stored)."""
+    try:
+        return AlignmentCache(alignment_path, progress)
+    except AlignmentCacheError:
+        return None
+
+
+def get_alignment_source(alignment_path, alignment_cache = None, lazy_init = True):
+    if alignment_cache:
+        return CachedSequenceSource(alignment_cache)
+    else:
+        return u.SequenceSource(alignment_path, lazy_init = lazy_init)
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2010 - 2012, A. Murat Eren
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# Please read the COPYING file.
+
+"""Everything oligotyping needs from the alignment before the noise filters.
+
+   A checkpoint keeps the number of reads of every oligotype in every sample, and the
+   frequency of the most abundant unique sequence of every oligotype (for -M). Every
+   oligotyping run stores its checkpoint in its output directory, and a later run on
+   the same alignment with the same components can apply different -s, -a, -A and -M
+   values to it without reading the alignment again (see --reuse-checkpoint)."""
+
+import os
+import zipfile
+
+import numpy
+
+from Oligotyping.lib.oligo_codec import OligoCodec
+from Oligotyping.lib.unique_reads import get_file_signature
+
+
+CHECKPOINT_FILE_NAME = 'CHECKPOINT.npz'
+
+# version of the file format of Checkpoint.save
+CHECKPOINT_VERSION = 1
+
+
+class CheckpointError(Exception):
+    def __init__(self, e = None):
+        Exception.__init__(self)
+        self.e = e
+        return
+    def __str__(self):
+        return 'Checkpoint Error: %s' % self.e
+
+
+class Checkpoint:
+    def __init__(self, alignment_signature, bases_of_interest_locs, sample_name_separator, min_base_quality,
+                 num_reads, alignment_length, num_reads_eliminated_due_to_min_base_quality, sample_names,
+                 oligo_codec, oligos, pair_sample_codes, pair_oligo_indices, pair_counts,
+                 most_abundant_unique_frequencies):
+        # what the checkpoint was computed from. min_base_quality is None if there were no quals.
+        self.alignment_signature = alignment_signature
+        self.bases_of_interest_locs = list(bases_of_interest_locs)
+        self.sample_name_separator = sample_name_separator
+        self.min_base_quality = min_base_quality
+
+        self.num_reads = num_reads
+        self.alignment_length = alignment_length
+        self.num_reads_eliminated_due_to_min_base_quality = num_reads_eliminated_due_to_min_base_quality
+        self.sample_names = sample_names
+
+        # oligo codes (see oligo_codec.py), sorted
+        self.oligo_codec = oligo_codec
+        self.oligos = oligos
+
+        # number of reads of (sample, oligo) pairs, in the order pairs are first seen in the alignment
+        self.pair_sample_codes = pair_sample_codes
+        self.pair_oligo_indices = pair_oligo_indices
+        self.pair_counts = pair_counts
+
+        self.most_abundant_unique_frequencies = most_abundant_unique_frequencies
+
+
+    @classmethod
+    def from_read_table(cls, read_table, alignment_length, min_base_quality = None):
+        """Counts reads of every oligo in every sample, except the ones that failed --min-base-quality"""
+        num_oligos = max(len(read_table.oligos), 1)
+        pair_codes = numpy.asarray(read_table.sample_codes)[read_table.kept].astype(numpy.int64) * num_oligos \
+                                        + read_table.oligo_indices[read_table.kept]
+        pairs, first_indices, counts = numpy.unique(pair_codes, return_index = True, return_counts = True)
+        order = numpy.argsort(first_indices)
+
+        return cls(get_file_signature(read_table.alignment_path), read_table.bases_of_interest_locs,
+                   read_table.sample_name_separator, min_base_quality, read_table.num_reads,
+                   alignment_length, read_table.num_reads_eliminated_due_to_min_base_quality,
+                   list(read_table.sample_names), read_table.oligo_codec, read_table.oligos,
+                   pairs[order] // num_oligos, pairs[order] % num_oligos, counts[order],
+                   read_table.get_frequencies_of_most_abundant_unique_sequences())
+
+
+    def is_from(self, alignment_path):
+        """True if the checkpoint was computed from the alignment as it is now (a checkpoint
+           is not valid anymore once the size or the modification time of the alignment
+           change)"""
+        return self.alignment_signature == get_file_signature(alignment_path)
+
+
+    def matches(self, bases_of_interest_locs, sample_name_separator, min_base_quality = None):
+        return self.bases_of_interest_locs == list(bases_of_interest_locs) \
+                    and self.sample_name_separator == sample_name_separator \
+                    and self.min_base_quality == min_base_quality
+
+
+    def save(self, file_path):
+        # the file is written next to its final destination first, so a partially written
+        # checkpoint is never found by later runs.
+        tmp_file_path = file_path + '.tmp.npz'
+        numpy.savez(tmp_file_path,
+                    version = numpy.array(CHECKPOINT_VERSION),
+                    alignment_signature = numpy.array(self.alignment_signature),
+                    bases_of_interest_locs = numpy.array(self.bases_of_interest_locs, dtype = numpy.int64),
+                    sample_name_separator = numpy.array(self.sample_name_separator),
+                    min_base_quality = numpy.array(-1 if self.min_base_quality is None else self.min_base_quality),
+                    num_reads = numpy.array(self.num_reads),
+                    alignment_length = numpy.array(self.alignment_length),
+                    num_reads_eliminated_due_to_min_base_quality = numpy.array(self.num_reads_eliminated_due_to_min_base_quality),
+                    sample_names = numpy.array(self.sample_names, dtype = str),
+                    oligo_alphabet = numpy.array(''.join(self.oligo_codec.alphabet)),
+                    oligo_columns = self.oligo_codec.decode_columns(self.oligos),
+                    pair_sample_codes = numpy.asarray(self.pair_sample_codes, dtype = numpy.int64),
+                    pair_oligo_indices = numpy.asarray(self.pair_oligo_indices, dtype = numpy.int64),
+                    pair_counts = numpy.asarray(self.pair_counts, dtype = numpy.int64),
+                    most_abundant_unique_frequencies = numpy.asarray(self.most_abundant_unique_frequencies, dtype = numpy.int64))
+        os.replace(tmp_file_path, file_path)
+
+
+    @classmethod
+    def load(cls, file_path):
+        try:
+            data = numpy.load(file_path)
+            if int(data['version']) != CHECKPOINT_VERSION:
+                raise CheckpointError("'%s' was stored by a different version of the program." % file_path)
+
+            bases_of_interest_locs = [int(l) for l in data['bases_of_interest_locs']]
+            oligo_codec = OligoCodec(len(bases_of_interest_locs), str(data['oligo_alphabet']))
+            oligos = oligo_codec.encode_columns(data['oligo_columns'])[0]
+            min_base_quality = int(data['min_base_quality'])
+
+            checkpoint = cls(str(data['alignment_signature']), bases_of_interest_locs, str(data['sample_name_separator']),
+                             None if min_base_quality < 0 else min_base_quality, int(data['num_reads']),
+                             int(data['alignment_length']), int(data['num_reads_eliminated_due_to_min_base_quality']),
+                             [str(s) for s in data['sample_names']], oligo_codec, oligos, data['pair_sample_codes'],
+                             data['pair_oligo_indices'], data['pair_counts'], data['most_abundant_unique_frequencies'])
+            data.close()
+        except (IOError, OSError, KeyError, ValueError, zipfile.BadZipFile) as e:
+            raise CheckpointError("'%s' is not an oligotyping checkpoint: %s" % (file_path, e))
+
+        return checkpoint
@@ -13,15 +13,27 @@
 import os
 import sys
 import copy
-import time
 import numpy
 import shutil
 import pickle
 import logging
+import itertools
 
 import Oligotyping as o
 from Oligotyping.lib import fastalib as u
+from Oligotyping.lib.topology import Node
 from Oligotyping.lib.topology import Topology
+from Oligotyping.lib.topology import RepresentativeIndex
+from Oligotyping.lib.topology import get_percent_identities_to_representatives
+from Oligotyping.lib.entropy import get_partition
+from Oligotyping.lib.entropy import get_oligo_codes
+from Oligotyping.lib.alignment_cache import get_alignment_cache
+from Oligotyping.lib.dereplication import DEFAULT_MEMORY_BUDGET
+from Oligotyping.lib.unique_reads import UniqueReadStore
+from Oligotyping.lib.unique_reads import UniqueReadStoreError
+from Oligotyping.lib.unique_reads import CACHE_SUFFIX as UNIQUE_READS_CACHE_SUFFIX
+from Oligotyping.lib.unique_reads import get_unique_read_store_from_cache
+from Oligotyping.lib.unique_reads import store_unique_read_store_cache
 from Oligotyping.lib.shared import generate_default_figures
 from Oligotyping.lib.shared import generate_exclusive_figures
 
@@ -30,6 +42,16 @@ from Oligotyping.utils import utils
 from Oligotyping.visualization.frequency_curve_and_entropy import vis_freq_curve
 
 
+# options settings of a parameter sweep get from the decomposer that runs the sweep
+SWEEP_OPTIONS = ['alignment', 'normalize_m', 'min_actual_abundance', 'project', 'sample_name_separator',
+                 'generate_sets', 'generate_frequency_curves', 'skip_refining_topology', 'skip_removing_outliers',
+                 'remove_outliers_with_blast', 'relocate_outliers', 'relocate_outliers_with_blast',
+                 'maximum_variation_allowed', 'store_topology_dict', 'merge_homopolymer_splits', 'no_threading',
+                 'number_of_threads', 'memory_budget', 'keep_tmp', 'skip_gen_html', 'skip_gen_figures', 'skip_alignment_cache',
+                 'unique_reads_cache', 'skip_storing_final_nodes', 'sample_mapping', 'skip_gexf_files',
+                 'skip_basic_analyses', 'quick']
+
+
 class Decomposer:
     def __init__(self, args = None):
         self.analysis = 'decomposition'
@@ -46,22 +68,30 @@ class Decomposer:
         self.generate_frequency_curves = False
         self.skip_refining_topology = False # FIXME: ADD THIS IN PARSERS!
         self.skip_removing_outliers = False
+        self.remove_outliers_with_blast = False
         self.relocate_outliers = False
+        self.relocate_outliers_with_blast = False
         self.maximum_variation_allowed = None
         self.store_topology_dict = False
         self.merge_homopolymer_splits = False
         self.no_threading = False
         self.number_of_threads = None
+        self.memory_budget = None
         self.log_file_path = None
         self.keep_tmp = False
         self.skip_gen_html = True
         self.skip_gen_figures = False
         self.skip_check_input_file = False
+        self.skip_alignment_cache = False
+        self.unique_reads_cache = None
         self.skip_storing_final_nodes = False
         self.sample_mapping = None
         self.skip_gexf_files = False
         self.skip_basic_analyses = False
         self.quick = False
+
+        # (m, M, d) settings of a parameter sweep (see sweep)
+        self.parameter_grid = None
          
         if args:
             self.alignment = args.alignment
@@ -75,22 +105,33 @@ class Decomposer:
             self.sample_name_separator = args.sample_name_separator
             self.generate_frequency_curves = args.generate_frequency_curves
             self.skip_removing_outliers = args.skip_removing_outliers
+            self.remove_outliers_with_blast = args.remove_outliers_with_blast
             self.relocate_outliers = args.relocate_outliers
+            self.relocate_outliers_with_blast = args.relocate_outliers_with_blast
             self.store_topology_dict = args.store_topology_dict
             self.merge_homopolymer_splits = args.merge_homopolymer_splits
             self.maximum_variation_allowed = args.maximum_variation_allowed
             self.no_threading = args.no_threading
             self.number_of_threads = args.number_of_threads
+            self.memory_budget = args.memory_budget * 1024 * 1024 if args.memory_budget else None
             self.keep_tmp = args.keep_tmp
             self.skip_gen_figures = args.skip_gen_figures
             self.skip_basic_analyses = args.skip_gen_figures
             self.skip_check_input_file = args.skip_check_input_file
+            self.skip_alignment_cache = args.skip_alignment_cache
+            self.unique_reads_cache = args.unique_reads_cache
             self.sample_mapping = args.sample_mapping
             self.skip_gen_html = args.skip_gen_html
             self.skip_gexf_files = args.skip_gexf_files
             self.quick = args.quick
 
+            if args.sweep_m or args.sweep_M or args.sweep_d:
+                self.parameter_grid = list(itertools.product(args.sweep_m or [self.min_entropy],
+                                                             args.sweep_M or [self.min_substantive_abundance],
+                                                             args.sweep_d or [self.number_of_discriminants]))
+
         self.decomposition_depth = -1
+        self.num_raw_nodes = None
 
         if self.quick:
             self.skip_gexf_files = True
@@ -114,8 +155,21 @@ class Decomposer:
         self.progress = utils.Progress()
         self.logger = None
 
+        self.alignment_cache = None
+        self.read_store = None
+
+        # sample names are resolved once, while reads are loaded: sample index of every read
+        # in the alignment (in the order of the alignment), and sample names for these indices.
+        self.sample_codes = None
+        self.sample_names = []
+
         self.root = None
         self.topology = Topology()
+
+        # settings of a parameter sweep share the root node, and partitions of the root node
+        # by discriminants (discriminants -> (partition, base counts of parts)), see sweep.
+        self.shared_root = None
+        self.shared_root_partitions = None
         
         # A recursive method could have solved the puzzle entirely in a sample,
         # however there are a couple of reasons to not approach this problem with
@@ -137,6 +191,11 @@ class Decomposer:
             self.no_threading = False
 
     def check_apps(self):
+        # outliers are removed and relocated without BLAST, unless it is asked for.
+        if not ((self.remove_outliers_with_blast and not self.skip_removing_outliers) \
+                    or (self.relocate_outliers and self.relocate_outliers_with_blast)):
+            return
+
         try:
             blast.LocalBLAST(None, None, None)
         except blast.ModuleVersionError:
@@ -148,9 +207,18 @@ class Decomposer:
 
 
     def check_dirs(self):
+        self.check_output_directory(self.get_prefix())
+
+        self.tmp_directory = self.generate_output_destination('TMP', directory = True)
+        self.nodes_directory = self.generate_output_destination('NODES', directory = True)
+        self.figures_directory = self.generate_output_destination('FIGURES', directory = True)
+        self.outliers_directory = self.generate_output_destination('OUTLIERS', directory = True)
+
+
+    def check_output_directory(self, postfix):
         # check output associated stuff
         if not self.output_directory:
-            self.output_directory = os.path.join(os.getcwd(), '-'.join([self.project.replace(' ', '_'), self.get_prefix()]))
+            self.output_directory = os.path.join(os.getcwd(), '-'.join([self.project.replace(' ', '_'), postfix]))
         
         if not os.path.exists(self.output_directory):
             try:
@@ -161,11 +229,6 @@ class Decomposer:
         if not os.access(self.output_directory, os.W_OK):
             raise utils.ConfigError("You do not have write permission for the output directory: '%s'" % self.output_directory)
 
-        self.tmp_directory = self.generate_output_destination('TMP', directory = True)
-        self.nodes_directory = self.generate_output_destination('NODES', directory = True)
-        self.figures_directory = self.generate_output_destination('FIGURES', directory = True)
-        self.outliers_directory = self.generate_output_destination('OUTLIERS', directory = True)
-
 
     def check_input_files(self):
         if (not os.path.exists(self.alignment)) or (not os.access(self.alignment, os.R_OK)):
@@ -175,10 +238,22 @@ class Decomposer:
             if (not os.path.exists(self.sample_mapping)) or (not os.access(self.sample_mapping, os.R_OK)):
                 raise utils.ConfigError("Sample mapping file is not accessible: '%s'" % self.sample_mapping)
 
+        # unique reads of an alignment are cached next to the alignment by default. if they were
+        # cached before, neither the alignment nor its cache needs to be read again.
+        default_unique_reads_cache = not self.unique_reads_cache and not self.skip_alignment_cache
+        if default_unique_reads_cache:
+            self.unique_reads_cache = self.alignment + UNIQUE_READS_CACHE_SUFFIX
+
+        if self.unique_reads_cache and not self.read_store:
+            self._load_unique_reads_cache(rebuild_if_stale = default_unique_reads_cache)
+
+        if not self.read_store and not self.skip_alignment_cache:
+            self.alignment_cache = get_alignment_cache(self.alignment, self.progress)
+
         samples = None
         if not self.skip_check_input_file:
             self.progress.new('Checking the input FASTA')
-            samples = utils.check_input_alignment(self.alignment, self.sample_name_separator, self.progress)
+            samples = utils.check_input_alignment(self.alignment, self.sample_name_separator, self.progress, self.alignment_cache, self.read_store)
             if not samples:
                 raise utils.ConfigError('Exiting.')
             self.progress.end()
@@ -190,14 +265,44 @@ class Decomposer:
             self.sample_mapping = sample_mapping_new_destination
 
 
+    def _load_unique_reads_cache(self, rebuild_if_stale = False):
+        """Loads unique reads from the cache. If the cache can't be used (it was generated from
+           different contents of the alignment, or it is not a unique reads cache), it is generated
+           again and stored over the old one if `rebuild_if_stale` is True (see _init_topology),
+           otherwise it is an error."""
+        self.progress.new('Unique reads cache')
+        self.progress.update('Loading "%s"' % self.unique_reads_cache)
+
+        try:
+            self.read_store = get_unique_read_store_from_cache(self.alignment, self.unique_reads_cache)
+        except UniqueReadStoreError as e:
+            if not rebuild_if_stale:
+                self.progress.end()
+                raise utils.ConfigError(e)
+
+            self.read_store = None
+
+        self.progress.end()
+
+        if rebuild_if_stale:
+            return
+
+        if os.path.exists(self.unique_reads_cache) and not self.read_store:
+            raise utils.ConfigError("Unique reads cache '%s' was not generated from the current contents of\
+                                     the alignment '%s'. Please remove it (or point --unique-reads-cache to a\
+                                     different location)." % (self.unique_reads_cache, self.alignment))
+
+
     def _init_logger(self, path = None):
-        self.logger = logging.getLogger('decomposer')
-        self.topology.logger = self.logger
-        
         if path:
             self.log_file_path = path 
         else:
             self.log_file_path = self.generate_output_destination('RUNINFO.log')
+
+        # every log file gets its own logger, so decomposers that run in the same process
+        # (i.e., settings of a parameter sweep) do not write into each other's log files.
+        self.logger = logging.getLogger('decomposer:%s' % self.log_file_path)
+        self.topology.logger = self.logger
         
         if os.path.exists(self.log_file_path):
             os.remove(self.log_file_path)
@@ -215,9 +320,41 @@ class Decomposer:
 
         self.topology.nodes_output_directory = self.nodes_directory
         
-        reads = utils.get_read_objects_from_file(self.alignment)
-        
-        self.root = self.topology.add_new_node('root', reads, root = True)
+        # unique reads are kept in a compact store (see unique_reads.UniqueReadStore), and nodes
+        # of the topology work on indices of unique reads in the store. the store is already
+        # there if it was loaded from the unique reads cache.
+        if not self.read_store:
+            if self.alignment_cache:
+                self.read_store = UniqueReadStore.from_alignment_cache(self.alignment_cache)
+            else:
+                self.read_store = UniqueReadStore.from_fasta(self.alignment,
+                                                             memory_budget = self.memory_budget or DEFAULT_MEMORY_BUDGET,
+                                                             num_threads = self.number_of_threads,
+                                                             tmp_directory = self.tmp_directory)
+
+            if not self.read_store:
+                self.progress.end()
+                raise utils.ConfigError("Not all reads have the same length.")
+
+            if self.unique_reads_cache:
+                self.progress.update('Caching unique reads...')
+                store_unique_read_store_cache(self.read_store, self.alignment, self.unique_reads_cache, self.sample_name_separator)
+
+        self.topology.read_store = self.read_store
+        self.sample_codes, self.sample_names = self.read_store.get_sample_codes(self.sample_name_separator)
+
+        if self.shared_root:
+            # the root node of a parameter sweep is already there along with its entropy.
+            root = self.shared_root
+            self.root = self.topology.add_new_node('root', root.unique_read_indices.copy(), root = True,
+                                                   read_matrix = root.read_matrix,
+                                                   frequencies = root.frequencies,
+                                                   base_counts = root.base_counts,
+                                                   skip_entropy = True)
+            for attribute in ['entropy', 'entropy_tpls', 'max_entropy', 'average_entropy']:
+                setattr(self.root, attribute, getattr(root, attribute))
+        else:
+            self.root = self.topology.add_new_node('root', numpy.arange(0, self.read_store.num_uniques), root = True)
         
         if self.root.size < self.min_actual_abundance:
             raise utils.ConfigError("The number of reads in alignment file (%d) is smaller than --min-actual-abundance (%d)" % \
@@ -254,6 +391,11 @@ class Decomposer:
 
 
     def decompose(self):
+        self._init_decomposition()
+        self._decompose()
+
+
+    def _init_decomposition(self):
         self.check_apps()
         self.check_dirs()
 
@@ -278,11 +420,15 @@ class Decomposer:
         self.run.info('info_file_path', self.info_file_path)
         self.run.info('log_file_path', self.log_file_path)
         self.run.info('root_alignment', self.alignment)
+        self.run.info('alignment_cache', self.alignment_cache.cache_path if self.alignment_cache else None)
+        self.run.info('unique_reads_cache', self.unique_reads_cache)
         self.run.info('sample_mapping', self.sample_mapping)
         self.run.info('quick', self.quick)
         self.run.info('merge_homopolymer_splits', self.merge_homopolymer_splits)
         self.run.info('skip_removing_outliers', self.skip_removing_outliers)
+        self.run.info('remove_outliers_with_blast', self.remove_outliers_with_blast)
         self.run.info('relocate_outliers', self.relocate_outliers)
+        self.run.info('relocate_outliers_with_blast', self.relocate_outliers_with_blast)
         self.run.info('store_topology_dict', self.store_topology_dict)
         self.run.info('skip_gen_figures', self.skip_gen_figures)
         self.run.info('m', self.min_entropy)
@@ -323,6 +469,8 @@ class Decomposer:
         self.run.info('tmp_directory', self.tmp_directory)
         self.run.info('figures_directory', self.figures_directory)
 
+
+    def _decompose(self):
         # business time.
         self._generate_raw_topology()
 
@@ -385,6 +533,134 @@ class Decomposer:
             self._generate_html_output()
 
 
+    def sweep(self, parameter_grid = None):
+        """Decomposes the alignment once for every (m, M, d) setting in `parameter_grid`. The
+           alignment is read and dereplicated only once, all settings share the root node and its
+           entropy, and settings that pick the same discriminants for the root node share its
+           partition. Every setting is stored in a directory of its own in the output directory,
+           and SWEEP-SUMMARY.txt reports the number of nodes and outliers of all settings."""
+        parameter_grid = parameter_grid or self.parameter_grid
+        if not parameter_grid:
+            raise utils.ConfigError("There are no (m, M, d) settings for the parameter sweep.")
+
+        self.check_apps()
+        self.check_output_directory('sweep')
+        self.tmp_directory = self.generate_output_destination('TMP', directory = True)
+        self.nodes_directory = self.tmp_directory
+
+        self.check_input_files()
+        self._init_topology()
+        self.shared_root_partitions = {}
+
+        if not self.number_of_threads:
+            self.number_of_threads = utils.Multiprocessing(None).num_thread
+
+        self.progress.new('Parameter sweep')
+        decomposers = []
+        for min_entropy, min_substantive_abundance, number_of_discriminants in parameter_grid:
+            decomposer = self._get_sweep_decomposer(min_entropy, min_substantive_abundance, number_of_discriminants)
+            if decomposer.output_directory in [d.output_directory for d in decomposers]:
+                self.progress.end()
+                raise utils.ConfigError("More than one setting of the parameter sweep would be stored in '%s'."\
+                                                                    % decomposer.output_directory)
+
+            self.progress.update('Initializing setting %d of %d' % (len(decomposers) + 1, len(parameter_grid)))
+            decomposer._init_decomposition()
+
+            # the root node of every setting is analyzed here, before settings are sent to worker
+            # processes, so partitions of the root node are computed once and shared by all.
+            decomposer._analyze_node(decomposer.root)
+            decomposers.append(decomposer)
+
+        def worker(i):
+            decomposers[i]._decompose()
+            return decomposers[i]._get_sweep_summary()
+
+        num_processes = min(self.number_of_threads, len(decomposers))
+        if self.no_threading or num_processes < 2:
+            summaries = []
+            for i in range(0, len(decomposers)):
+                self.progress.update('Decomposing setting %d of %d' % (i + 1, len(decomposers)))
+                summaries.append(worker(i))
+        else:
+            # every setting runs in a single worker process (worker processes can't have
+            # workers of their own).
+            for decomposer in decomposers:
+                decomposer.no_threading = True
+
+            with utils.Multiprocessing(worker, num_processes) as mp:
+                summaries = mp.map([(i,) for i in range(0, len(decomposers))], self.progress, 'Decomposing settings', chunk_size = 1)
+
+        self.progress.end()
+
+        outlier_reasons = []
+        for summary in summaries:
+            outlier_reasons += [r for r in summary['outliers'] if r not in outlier_reasons]
+
+        summary_dict = {}
+        for summary in summaries:
+            summary_dict[summary['setting']] = summary
+            for reason in outlier_reasons:
+                summary['final_%s' % reason] = summary['outliers'].get(reason, 0)
+
+        summary_file_path = self.generate_output_destination('SWEEP-SUMMARY.txt')
+        utils.generate_TAB_delim_file_from_dict(summary_dict, summary_file_path,
+                                                ['m', 'M', 'd', 'num_raw_nodes', 'num_final_nodes', 'num_sequences_after_qc'] +\
+                                                ['final_%s' % reason for reason in outlier_reasons] + ['final_outliers_total'],
+                                                first_column = 'setting')
+
+        if (not self.keep_tmp):
+            shutil.rmtree(self.tmp_directory)
+
+        self.run.info('num_settings', len(summaries))
+        self.run.info('sweep_summary', summary_file_path)
+
+        return summaries
+
+
+    def _get_sweep_decomposer(self, min_entropy, min_substantive_abundance, number_of_discriminants):
+        decomposer = Decomposer()
+
+        for option in SWEEP_OPTIONS:
+            setattr(decomposer, option, getattr(self, option))
+
+        decomposer.min_entropy = min_entropy
+        decomposer.min_substantive_abundance = min_substantive_abundance or 0
+        decomposer.number_of_discriminants = number_of_discriminants
+
+        # the input is checked only once for all settings
+        decomposer.skip_check_input_file = True
+        decomposer.output_directory = os.path.join(self.output_directory, decomposer.get_prefix())
+
+        decomposer.alignment_cache = self.alignment_cache
+        decomposer.read_store = self.read_store
+        decomposer.shared_root = self.root
+        decomposer.shared_root_partitions = self.shared_root_partitions
+
+        decomposer.run.verbose = False
+        decomposer.progress.verbose = False
+
+        return decomposer
+
+
+    def _get_sweep_summary(self):
+        summary = {'setting': os.path.basename(self.output_directory),
+                   'm': self.min_entropy,
+                   'M': self.min_substantive_abundance,
+                   'd': self.number_of_discriminants,
+                   'num_raw_nodes': self.num_raw_nodes,
+                   'num_final_nodes': len(self.topology.final_nodes),
+                   'num_sequences_after_qc': self.topology.get_final_count(),
+                   'outliers': {}}
+
+        for reason in self.topology.outlier_reasons:
+            summary['outliers'][reason] = self.topology.get_num_outliers(reason)
+
+        summary['final_outliers_total'] = sum(summary['outliers'].values())
+
+        return summary
+
+
     def _generate_raw_topology(self):
         self.progress.new('Raw Topology')
         # main loop
@@ -401,13 +677,21 @@ class Decomposer:
             # self.node_ids_to_analyze for the next cycle of the main loop.
             new_node_ids_to_analyze = []
 
-            for node_id in self.node_ids_to_analyze:
-  
+            # nodes at the same level are independent from each other. unless threading is
+            # disabled, they are analyzed in parallel first, and the results are applied to the
+            # topology below in the very same order the serial mode applies them, so node ids
+            # (and everything else) do not depend on the mode.
+            parallel = (not self.no_threading) and len(self.node_ids_to_analyze) > 1
+            if parallel:
+                analyses = self._analyze_nodes_in_parallel(self.node_ids_to_analyze)
+
+            for i in range(0, len(self.node_ids_to_analyze)):
+                node_id = self.node_ids_to_analyze[i]
                 node = self.topology.nodes[node_id]
                 
                 p = '[LVL %d] Analyzing %d of %d / ID: %s / SIZE: %d'\
                                                          % (self.decomposition_depth,
-                                                            self.node_ids_to_analyze.index(node_id) + 1,
+                                                            i + 1,
                                                             len(self.node_ids_to_analyze),
                                                             node.pretty_id,
                                                             node.size)
@@ -415,83 +699,87 @@ class Decomposer:
                 self.logger.info('analyzing node id: %s (%d)' % (node_id, node.size))
                 self.progress.update(p)
 
-                # if the most abundant unique read in a node is smaller than self.min_actual_abundance kill the node
-                # and store read information into self.topology.outliers
-                if node.reads[0].frequency < self.min_substantive_abundance:
-                    if node.node_id == 'root':
-                        self.progress.end()
-                        raise utils.ConfigError("Number of unique reads in the root node (%d) is less than the declared minimum (%d)." \
-                                                % (node.reads[0].frequency,
-                                                   self.min_substantive_abundance))
-
-                    else:
-                        # remove the node and store its content.
-                        self.logger.info('remove node (MSA): %s' % node_id)
-                        self.topology.remove_node(node.node_id, True, 'min_substantive_abundance_reason')
-                        continue
-
-                if node.size < self.min_actual_abundance:
-                    # remove the node and store its content.
-                    self.topology.remove_node(node.node_id, True, 'min_actual_abundance_reason')                    
-                    self.logger.info('remove node (MAA): %s' % node_id)
-                    continue
-                
-                # competing_unique_sequences_ratio refers to the ratio between the most abundant unique
-                # read count and the second most abundant unique read count in a node. smaller the number,
-                # better the level of decomposition. however it is important to consider that one organism
-                # might be overprinting, increasing the ratio over a closely related organism that trapped
-                # in the same node.
-                #
-                # 'node density' refers to the ratio of most abundant unique read count to all reads
-                # that are accumulated in the node. higher the number, lower the variation within the
-                # node.
-                node.do_competing_unique_sequences_ratio_and_density()
+                analysis = analyses[node_id] if parallel else self._analyze_node(node)
 
-                p += ' / CUSR: %.2f / D: %.2f' % (node.competing_unique_sequences_ratio, node.density)
-                self.progress.update(p)
+                new_node_ids_to_analyze += self._apply_node_analysis(node, analysis, p, skip_entropy = parallel)
 
-                if node.competing_unique_sequences_ratio < 0.0005 or node.density > 0.85:
-                    # Finalize this node.
-                    self.logger.info('finalize node (CUSR/ND): %s' % node_id)
-                    continue
+            # this is time to set new nodes for the analysis.
+            self.node_ids_to_analyze = [n for n in new_node_ids_to_analyze]
 
-                # find out about the entropy distribution in the given node:
-                node.do_entropy()
-                
-                # normalize m if the user hasn't opted out.
-                if self.normalize_m:
-                    node.set_normalized_m(self.min_entropy, self.topology.frequency_of_the_most_abundant_read)
-                    self.logger.info('normalized m (NM) for %s: %.3f ' % (node_id, node.normalized_m))
+        
+        #finally:
+        self.progress.end()
+        self.topology.update_final_nodes(decomposition_depth=self.decomposition_depth)
 
-                p += ' / ME: %.2f / AE: %.2f / NM: %s' % (max(node.entropy),
-                                                          node.average_entropy,
-                                                          ('%.3f' % node.normalized_m) if self.normalize_m else None)
-                self.progress.update(p)
-                
-                # IF the abundance of the second most abundant unique read in the node is smaller than 
-                # the self.min_substantive_abundance criteria, there is no need to further decompose
-                # this node. because anything spawns from here, will end up in the outlier bin except
-                # the most abundant unique read. of course by not decomposing any further we are losing
-                # the opportunity to 'purify' this node further, but we are not worried about it,
-                # because 'max_allowed_variation' outliers will be removed from this node later on.  
-                # UPDATE: Well, this causes some serious purity issues. For instance a node with,
-                # 
-                # >Read_1|frequency:957
-                # >Read_2|frequency:120
-                # >Read_3|frequency:57
-                # >Read_4|frequency:7
-                #
-                # is finalized due to SMA < MSA although the entropy looked like this:
-                #
-                #    http://i.imgur.com/ctFnJE2.png
-                #
-                # when M = 300. This begs for a FIXME.
-                #
-                if node.reads[1].frequency < self.min_substantive_abundance:
-                    # we are done with this node.
-                    self.logger.info('finalize node (SMA < MSA): %s' % node_id)
-                    continue
+        self.num_raw_nodes = len(self.topology.final_nodes)
+        self.run.info('num_raw_nodes', utils.pretty_print(self.num_raw_nodes))
 
+        # fin.
+
+
+    def _analyze_node(self, node):
+        """Decides what should happen to a node in the raw topology. Returns the decision
+           ('action'), node attributes that were computed along the way, and if the node is
+           to be decomposed, the partition of its reads (see entropy.get_partition). This
+           function does not change the topology, so it can run in a worker process on a node
+           that only has its read matrix and frequencies (see _analyze_nodes_in_parallel)."""
+        analysis = {'action': None, 'attributes': {}, 'partition': None}
+
+        # if the most abundant unique read in a node is smaller than self.min_actual_abundance kill the node
+        # and store read information into self.topology.outliers
+        if node.frequencies[0] < self.min_substantive_abundance:
+            analysis['action'] = 'remove_msa'
+            return analysis
+
+        if node.size < self.min_actual_abundance:
+            analysis['action'] = 'remove_maa'
+            return analysis
+
+        # competing_unique_sequences_ratio refers to the ratio between the most abundant unique
+        # read count and the second most abundant unique read count in a node. smaller the number,
+        # better the level of decomposition. however it is important to consider that one organism
+        # might be overprinting, increasing the ratio over a closely related organism that trapped
+        # in the same node.
+        #
+        # 'node density' refers to the ratio of most abundant unique read count to all reads
+        # that are accumulated in the node. higher the number, lower the variation within the
+        # node.
+        node.do_competing_unique_sequences_ratio_and_density()
+
+        if node.competing_unique_sequences_ratio < 0.0005 or node.density > 0.85:
+            # Finalize this node.
+            analysis['action'] = 'finalize_cusr'
+        else:
+            # find out about the entropy distribution in the given node (unless it is already known):
+            if node.entropy is None:
+                node.do_entropy()
+
+            # normalize m if the user hasn't opted out.
+            if self.normalize_m:
+                node.set_normalized_m(self.min_entropy, self.topology.frequency_of_the_most_abundant_read)
+
+            # IF the abundance of the second most abundant unique read in the node is smaller than 
+            # the self.min_substantive_abundance criteria, there is no need to further decompose
+            # this node. because anything spawns from here, will end up in the outlier bin except
+            # the most abundant unique read. of course by not decomposing any further we are losing
+            # the opportunity to 'purify' this node further, but we are not worried about it,
+            # because 'max_allowed_variation' outliers will be removed from this node later on.  
+            # UPDATE: Well, this causes some serious purity issues. For instance a node with,
+            # 
+            # >Read_1|frequency:957
+            # >Read_2|frequency:120
+            # >Read_3|frequency:57
+            # >Read_4|frequency:7
+            #
+            # is finalized due to SMA < MSA although the entropy looked like this:
+            #
+            #    http://i.imgur.com/ctFnJE2.png
+            #
+            # when M = 300. This begs for a FIXME.
+            #
+            if node.frequencies[1] < self.min_substantive_abundance:
+                analysis['action'] = 'finalize_sma'
+            else:
                 # discriminants for this node are being selected from the list of entropy tuples:
                 # entropy_tpls look like this:
                 #
@@ -499,8 +787,8 @@ class Decomposer:
                 #
                 # Probably a function should be called here to make sure discriminants are not high entropy
                 # locations driven by homopolymer region associated indels, or dynamicaly set the number of 
-                # discriminants for a given node. for instance, if there is one base left in a node that is
-                # to define two different organisms, this process should be able to *overwrite* the parameter
+                # discriminants for a given node. for instance, if there is one base left in a node that is
+                # to define two different organisms, this process should be able to *overwrite* the parameter
                 # self.number_of_discriminants.
                 if self.normalize_m:
                     node.discriminants = [d[0] for d in node.entropy_tpls[0:self.number_of_discriminants] if d[1] > node.normalized_m]
@@ -509,66 +797,206 @@ class Decomposer:
 
                 if not len(node.discriminants):
                     # FIXME: Finalize this node.
-                    self.logger.info('finalize node (ND): %s' % node_id)
-                    continue
+                    analysis['action'] = 'finalize_nd'
                 else:
-                    self.logger.info('using %d D (%s) to decompose: %s'\
-                                     % (len(node.discriminants),
-                                        ','.join([str(d) for d in node.discriminants]),
-                                        node_id))
-                
-                # before we go through the parent reads to find new set of nodes, we need a variable to keep
-                # track of them:
-                new_nodes_dict = {}
-
-                # go through the parent reads
-                counter = 0
-                while 1:
-                    counter += 1
-                    if counter % 1000 == 0 or counter == node.size - 1:
-                        self.progress.update(p + ' / %.1f%%' % (counter * 100.0 / node.size))
-                    
-                    if not node.reads:
-                        # all reads were processed, break while loop.
-                        break
-                    
-                    read = node.reads.pop()
-
-                    oligo = ''.join([read.seq[d] for d in node.discriminants])
-                   
-                    if oligo in new_nodes_dict:
-                        new_nodes_dict[oligo]['reads'].append(read)
-                    else:
-                        new_node_id = self.topology.get_new_node_id()
-                        new_nodes_dict[oligo] = {}
-                        new_nodes_dict[oligo]['node_id'] = new_node_id
-                        new_nodes_dict[oligo]['reads'] = [read]
-                
-                
-                # all reads in the parent node are analyzed. time to add spawned nodes into the topology.
-                oligos = list(new_nodes_dict.keys())
-                len_oligos = len(oligos)
-                for i in range(0, len_oligos):
-                    self.progress.update(p + ' / new nodes %d of %d ' % (i + 1, len_oligos))
+                    # split reads in the node by the oligos they present at discriminant locations.
+                    # every part of the partition is an array of rows in the read matrix of the node,
+                    # which are in the same order with node.unique_read_indices.
+                    analysis['action'] = 'decompose'
+                    analysis['partition'] = self._get_partition(node)
 
-                    new_node = self.topology.add_new_node(new_nodes_dict[oligos[i]]['node_id'],
-                                                          new_nodes_dict[oligos[i]]['reads'],
-                                                          parent_id = node.node_id)
+        for attribute in ['competing_unique_sequences_ratio', 'density', 'entropy', 'entropy_tpls', 'max_entropy',
+                          'average_entropy', 'normalized_m', 'discriminants']:
+            analysis['attributes'][attribute] = getattr(node, attribute)
 
-                    new_node_ids_to_analyze.append(new_node.node_id)
-                    self.logger.info('new node: %s' % new_node.node_id)
+        return analysis
 
-            # this is time to set new nodes for the analysis.
-            self.node_ids_to_analyze = [n for n in new_node_ids_to_analyze]
 
-        
-        #finally:
-        self.progress.end()
-        self.topology.update_final_nodes(decomposition_depth=self.decomposition_depth)
+    def _get_partition(self, node):
+        """Returns the partition of reads in a node by its discriminants. Partitions of the root
+           node are computed only once for all settings of a parameter sweep (see sweep)."""
+        if node.node_id != 'root' or self.shared_root_partitions is None:
+            return get_partition(get_oligo_codes(node.read_matrix, node.discriminants))
 
-        self.run.info('num_raw_nodes', utils.pretty_print(len(self.topology.final_nodes)))
+        key = tuple(node.discriminants)
+        if key not in self.shared_root_partitions:
+            partition = get_partition(get_oligo_codes(node.read_matrix, node.discriminants))
+            self.shared_root_partitions[key] = (partition, node.get_partition_base_counts(partition))
 
-        # fin.
+        return self.shared_root_partitions[key][0]
+
+
+    def _apply_node_analysis(self, node, analysis, p, skip_entropy = False):
+        """Applies the decision _analyze_node made for a node to the topology, and returns
+           the ids of new nodes that emerge from it."""
+        node_id = node.node_id
+        action = analysis['action']
+
+        if action == 'remove_msa':
+            if node.node_id == 'root':
+                self.progress.end()
+                raise utils.ConfigError("Number of unique reads in the root node (%d) is less than the declared minimum (%d)." \
+                                        % (node.frequencies[0],
+                                           self.min_substantive_abundance))
+
+            else:
+                # remove the node and store its content.
+                self.logger.info('remove node (MSA): %s' % node_id)
+                self.topology.remove_node(node.node_id, True, 'min_substantive_abundance_reason')
+                return []
+
+        if action == 'remove_maa':
+            # remove the node and store its content.
+            self.topology.remove_node(node.node_id, True, 'min_actual_abundance_reason')                    
+            self.logger.info('remove node (MAA): %s' % node_id)
+            return []
+
+        for attribute in analysis['attributes']:
+            setattr(node, attribute, analysis['attributes'][attribute])
+
+        p += ' / CUSR: %.2f / D: %.2f' % (node.competing_unique_sequences_ratio, node.density)
+        self.progress.update(p)
+
+        if action == 'finalize_cusr':
+            self.logger.info('finalize node (CUSR/ND): %s' % node_id)
+            return []
+
+        if self.normalize_m:
+            self.logger.info('normalized m (NM) for %s: %.3f ' % (node_id, node.normalized_m))
+
+        p += ' / ME: %.2f / AE: %.2f / NM: %s' % (max(node.entropy),
+                                                  node.average_entropy,
+                                                  ('%.3f' % node.normalized_m) if self.normalize_m else None)
+        self.progress.update(p)
+
+        if action == 'finalize_sma':
+            # we are done with this node.
+            self.logger.info('finalize node (SMA < MSA): %s' % node_id)
+            return []
+
+        if action == 'finalize_nd':
+            self.logger.info('finalize node (ND): %s' % node_id)
+            return []
+
+        self.logger.info('using %d D (%s) to decompose: %s'\
+                         % (len(node.discriminants),
+                            ','.join([str(d) for d in node.discriminants]),
+                            node_id))
+
+        partition = analysis['partition']
+        new_node_ids = [self.topology.get_new_node_id() for rows in partition]
+
+        # new nodes get their part of the read matrix and base counts of the parent, so
+        # their entropy is not computed from scratch. if the entropy of new nodes is going
+        # to be computed by worker processes, there is no need for base counts.
+        if skip_entropy:
+            base_counts_list = [None] * len(partition)
+        elif node.node_id == 'root' and self.shared_root_partitions is not None:
+            base_counts_list = self.shared_root_partitions[tuple(node.discriminants)][1]
+        else:
+            base_counts_list = node.get_partition_base_counts(partition)
+
+        # all reads in the parent node are analyzed. time to add spawned nodes into the topology.
+        new_node_ids_to_analyze = []
+        len_oligos = len(partition)
+        for i in range(0, len_oligos):
+            self.progress.update(p + ' / new nodes %d of %d ' % (i + 1, len_oligos))
+
+            new_node = self.topology.add_new_node(new_node_ids[i],
+                                                  node.unique_read_indices[partition[i]],
+                                                  parent_id = node.node_id,
+                                                  read_matrix = node.read_matrix[partition[i]],
+                                                  frequencies = node.frequencies[partition[i]],
+                                                  base_counts = base_counts_list[i],
+                                                  skip_entropy = skip_entropy)
+
+            new_node_ids_to_analyze.append(new_node.node_id)
+            self.logger.info('new node: %s' % new_node.node_id)
+
+        # reads of the parent node now belong to its children
+        node.unique_read_indices = node.unique_read_indices[0:0]
+        node.forget_read_matrix()
+
+        return new_node_ids_to_analyze
+
+
+    def _map_nodes_in_parallel(self, nodes, function, progress_text = None):
+        """Runs `function` for every node in `nodes` in worker processes, and returns a dictionary
+           of results by node id. Nodes are not sent to workers: read matrices of all nodes are put
+           into one block of shared memory, and every worker gets only row ranges of its nodes in
+           it. So `function` gets a node that only has its id, size, read matrix and frequencies."""
+        if not nodes:
+            return {}
+
+        offsets = numpy.cumsum([0] + [len(node.frequencies) for node in nodes])
+
+        # the largest nodes go first, so they don't end up being the last ones to finish
+        tasks = [(nodes[i].size, i, nodes[i].node_id, offsets[i], offsets[i + 1]) for i in range(0, len(nodes))]
+        tasks.sort(key = lambda t: (-t[0], t[1]))
+
+        # worker function..
+        def worker(data_chunk, shared_read_matrix, shared_frequencies):
+            read_matrix = shared_read_matrix.get()
+            frequencies = shared_frequencies.get()
+
+            results = []
+            for size, i, node_id, start, end in data_chunk:
+                node = Node(node_id, self.topology.nodes_output_directory)
+                node.size = size
+                node.read_matrix = read_matrix[start:end]
+                node.frequencies = frequencies[start:end]
+
+                results.append((node_id, function(node)))
+
+            # views of shared memory must be gone before it is detached from this process
+            node = read_matrix = frequencies = None
+            shared_read_matrix.close()
+            shared_frequencies.close()
+
+            return results
+
+        # shared memory is released even if a worker fails (Multiprocessing.map raises the
+        # error of the worker here).
+        shared_arrays = []
+        results_dict = {}
+        try:
+            shared_arrays.append(utils.SharedArray(numpy.concatenate([node.read_matrix for node in nodes])))
+            shared_arrays.append(utils.SharedArray(numpy.concatenate([node.frequencies for node in nodes])))
+            shared_read_matrix, shared_frequencies = shared_arrays
+
+            with utils.Multiprocessing(worker, self.number_of_threads) as mp:
+                data_chunks = mp.get_data_chunks(tasks, spiral = True)
+                for results in mp.map([(chunk, shared_read_matrix, shared_frequencies) for chunk in data_chunks],
+                                      self.progress, progress_text):
+                    results_dict.update(dict(results))
+        finally:
+            for shared_array in shared_arrays:
+                shared_array.close()
+
+        if len(results_dict) != len(nodes):
+            self.progress.end()
+            raise utils.ConfigError("Results for %d of %d nodes did not come back from worker processes."\
+                                                    % (len(nodes) - len(results_dict), len(nodes)))
+
+        return results_dict
+
+
+    def _analyze_nodes_in_parallel(self, node_ids):
+        """Runs _analyze_node for every node in `node_ids` in worker processes, and returns
+           a dictionary of analyses by node id."""
+        return self._map_nodes_in_parallel([self.topology.nodes[node_id] for node_id in node_ids],
+                                           self._analyze_node,
+                                           '[LVL %d] Analyzing %d nodes' % (self.decomposition_depth, len(node_ids)))
+
+
+    def _get_node_entropy(self, node):
+        """Computes entropy of a node, and returns the attributes it sets. Base counts of the
+           node are not sent back: bases are counted again in the main process only if the node
+           is decomposed."""
+        node.do_entropy()
+
+        return dict([(attribute, getattr(node, attribute)) for attribute in ['entropy', 'entropy_tpls', 'max_entropy',
+                                                                             'average_entropy']])
 
 
     def _refresh_topology(self):
@@ -588,35 +1016,16 @@ class Decomposer:
                 self.progress.update('Synchronizing dirty nodes (%d of %d)' % (dirty_nodes.index(node) + 1, len(dirty_nodes)))
                 node.refresh()
         else:
-            # worker function..
-            def worker(data_chunk, shared_counter, results_array):
-                for node in data_chunk:
-                    node.refresh()
-                    results_array.append(node)
-                    shared_counter.set(shared_counter.value + 1)
-
-            mp =  utils.Multiprocessing(worker, self.number_of_threads)
-            data_chunks = mp.get_data_chunks(dirty_nodes, spiral = True)
-            shared_counter = mp.get_shared_integer()
-            results_array = mp.get_empty_shared_array()
-            
-            for chunk in data_chunks:
-                args = (chunk, shared_counter, results_array)
-                mp.run(args)
-        
-            while 1:
-                num_processes = len([p for p in mp.processes if p.is_alive()])
-                
-                if not num_processes:
-                    # all threads are done. replace nodes with resulting nodes.
-                    for node in results_array:
-                        self.topology.nodes[node.node_id] = node
-                    break
-        
-                self.progress.update('Processing in %d threads: %d of %d' % (num_processes,
-                                                                             shared_counter.value,
-                                                                             len(dirty_nodes)))
-                time.sleep(1)
+            # reads of dirty nodes are sorted and encoded here, and only their entropy is computed in
+            # worker processes (which is where the time goes).
+            for node in dirty_nodes:
+                node.refresh(skip_entropy = True)
+
+            entropies = self._map_nodes_in_parallel(dirty_nodes, self._get_node_entropy, 'Refreshing %d dirty nodes' % len(dirty_nodes))
+
+            for node in dirty_nodes:
+                for attribute in entropies[node.node_id]:
+                    setattr(node, attribute, entropies[node.node_id][attribute])
 
         self.progress.end()
 
@@ -638,7 +1047,7 @@ class Decomposer:
                 # report the number of outliers removed during the refinement step
                 removed_outliers_total = 0
                 for reason in self.topology.outlier_reasons:
-                    count = sum([read_obj.frequency for read_obj in self.topology.outliers[reason]])
+                    count = self.topology.get_num_outliers(reason)
                     removed_outliers_total += count
                     self.run.info('removed_%s' % reason, utils.pretty_print(count))
                 self.run.info('removed_outliers_total', utils.pretty_print(removed_outliers_total))
@@ -676,46 +1085,45 @@ class Decomposer:
                 # of robustness, I didn't want to rely on this and implement this part of the algorithm as a complete
                 # state machine.
                 
-                abundant_reads_in_outlier_bin = []
+                abundant_reads_in_outlier_bin = numpy.zeros(0, dtype = numpy.int32)
                 
                 if 'maximum_variation_allowed_reason' in self.topology.outliers:    
-                    abundant_reads_in_outlier_bin = [read_object for read_object in \
-                                                        self.topology.outliers['maximum_variation_allowed_reason'] \
-                                                            if read_object.frequency > self.min_substantive_abundance]
+                    outliers = self.topology.outliers['maximum_variation_allowed_reason']
+                    abundant_reads_in_outlier_bin = outliers[self.read_store.frequencies[outliers] > self.min_substantive_abundance]
                 
                 self.progress.new('Abundant Outliers Bin; ITER %d' % (iteration))
                 number_of_abundant_reads_in_outlier_bin = len(abundant_reads_in_outlier_bin)
                 for i in range(0, number_of_abundant_reads_in_outlier_bin):
                     self.progress.update('%d of %d' % (i + 1, number_of_abundant_reads_in_outlier_bin))
 
-                    read_object = abundant_reads_in_outlier_bin[i]
-
                     new_node_id = self.topology.get_new_node_id()
-                    self.topology.add_new_node(new_node_id, [read_object], parent_id = 'root')
+                    self.topology.add_new_node(new_node_id, abundant_reads_in_outlier_bin[i:i + 1], parent_id = 'root')
                     self.topology.zombie_nodes.append(new_node_id)
-                    self.topology.outliers['maximum_variation_allowed_reason'].remove(read_object)
 
                     self.topology.final_nodes.append(new_node_id)
                     self.topology.alive_nodes.append(new_node_id)
 
                     self.logger.info('new zombie: %s' % new_node_id)
+
+                if number_of_abundant_reads_in_outlier_bin:
+                    self.topology.remove_outliers(abundant_reads_in_outlier_bin, 'maximum_variation_allowed_reason')
                 self.progress.end()
                 
             iteration += 1
 
 
     def _merge_homopolymer_splits(self, iteration):
-        # FIXME: this actually traverses the sibling nodes in the topology to merge homopoymer splits, but
-        # it doesn't make any sense? who says homopolymer splits are going to be in the same branch of the
-        # topology? they might have been split way before and ended up extremely distant places in the topology
-        # and this has to be fixed at some point (which unfortunately will fuck up the performance drastically
-        # once it is fixed, but whatever. science > my pride).
+        # homopolymer splits are not necessarily in the same branch of the topology (they might have been
+        # split way before and ended up extremely distant places in the topology), so every node is compared
+        # to all final nodes. representatives of nodes that differ from each other by one in/del and nothing
+        # else are found through an index of sequences and their single-deletion variants instead of an
+        # all-vs-all search, and only these candidates are tested for homopolymer in/dels.
        
         nz = utils.pretty_print(len(self.topology.zombie_nodes))
         self.progress.new('Merging HP splits :: ITER %d%s' % (iteration,
                                                               ' #Z: %s' % (nz if nz else '')))
 
-        self.progress.update('Running blastn')
+        self.progress.update('Searching for single in/del neighbors')
         dealing_with_zombie_nodes = False
 
         if self.topology.zombie_nodes:
@@ -724,20 +1132,8 @@ class Decomposer:
         else:
             nodes = copy.deepcopy(self.topology.final_nodes)
 
-        # ---
-        # use blastn to get the similarity dict for gaps.
-        query, target, output = utils.get_temporary_file_names_for_BLAST_search(prefix = "HPS_%d_" % iteration,\
-                                                                          directory = self.tmp_directory)
-
-        self.topology.store_node_representatives(nodes, query)
-        self.topology.store_node_representatives(self.topology.final_nodes, target)
-
-        min_percent_identity = utils.get_percent_identity_for_N_base_difference(self.topology.average_read_length) - 1
-        params = "-perc_identity %.2f" % (min_percent_identity)
-        b = self._perform_blast(query, target, output, params, job = 'HPS', no_threading = True)
-        
-        self.progress.update('Generating similarity dict from blastn results')
-        similarity_dict = b.get_results_dict(mismatches = 0, gaps = 1)
+        similarity_dict = utils.get_single_indel_neighbors(dict([(n, self.topology.nodes[n].representative_seq) for n in nodes]),
+                                                           dict([(n, self.topology.nodes[n].representative_seq) for n in self.topology.final_nodes]))
         
         node_ids = set(similarity_dict.keys())
 
@@ -847,123 +1243,96 @@ class Decomposer:
                                                                           self.maximum_variation_allowed)
         param = "-perc_identity %.2f" % (min_percent_identity)
 
-        if self.no_threading:
-            # no threading
-            for i in range(0, len(node_list)):
-                node_id = node_list[i]
-                node = self.topology.nodes[node_id]
-                
-                self.progress.update('Node ID: "%s" (%d of %d)' % (node.pretty_id, i + 1, len(self.topology.final_nodes)))
-
-                job = 'XO_%s_' % node_id
-                query, target, output = utils.get_temporary_file_names_for_BLAST_search(prefix = job,\
-                                                                                  directory = self.tmp_directory)
-                id_to_read_object_dict = {}
-                for read_obj in node.reads[1:]:
-                    id_to_read_object_dict[read_obj.md5id] = read_obj
+        if not self.remove_outliers_with_blast:
+            # there is no need to BLAST reads in every node against the representative sequence
+            # of the node: edit distances of all reads in all nodes to their representatives are
+            # computed at once from read matrices.
+            self.progress.update('Comparing reads in %d nodes to their representatives' % len(node_list))
 
-                query_obj = u.FastaOutput(query)
-                for _id in id_to_read_object_dict:
-                    query_obj.write_id(_id)
-                    query_obj.write_seq(id_to_read_object_dict[_id].seq.replace('-', ''), split = False)
-                query_obj.close()
+            nodes = [self.topology.nodes[node_id] for node_id in node_list]
+            percent_identities = get_percent_identities_to_representatives([node.get_read_matrix() for node in nodes],
+                                                                           min_percent_identity)
 
-                target_obj = u.FastaOutput(target)
-                target_obj.write_id(node.reads[0].md5id)
-                target_obj.write_seq(node.reads[0].seq.replace('-', ''), split = False)
-                target_obj.close()
+            for i in range(0, len(nodes)):
+                node = nodes[i]
 
-                b = self._perform_blast(query, target, output, params = param, job = job)
+                # the same rounding blast.LocalBLAST.get_results_dict uses
+                outlier_rows = numpy.round(percent_identities[i], 1) < round(min_percent_identity, 1)
+                outlier_rows[0] = False
 
-                # while I feel ashamed for this redundancy, you go ahead and read the description
-                # written in the worker function below on this voodoo stuff.
-                similarity_dict = b.get_results_dict(min_identity = min_percent_identity)
-                read_ids_to_keep = set(similarity_dict.keys())
-                all_read_ids = set(id_to_read_object_dict.keys())
-                outliers = all_read_ids.difference(read_ids_to_keep)
-
-                if len(outliers):
+                if outlier_rows.any():
                     node.dirty = True
                 else:
                     continue
-    
-                self.progress.append(' / screening node to remove %d outliers' % len(outliers))
 
-                for _id in outliers:
-                    outlier_read_object = id_to_read_object_dict[_id]
-                    node.reads.remove(outlier_read_object)
-                    self.topology.store_outlier(outlier_read_object, 'maximum_variation_allowed_reason')
- 
+                outlier_read_indices = node.unique_read_indices[outlier_rows]
+                node.unique_read_indices = node.unique_read_indices[~outlier_rows]
+
+                self.topology.store_outliers(outlier_read_indices, 'maximum_variation_allowed_reason')
+
                 self.logger.info('%d outliers removed from node: %s'\
-                            % (sum([id_to_read_object_dict[_id].frequency for _id in outliers]),
-                               node_id))
- 
+                            % (self.read_store.get_size(outlier_read_indices),
+                               node.node_id))
+
         else:
-            
-            def worker(node_id, shared_outlier_seqs_list, shared_dirty_nodes_list):
-                node = self.topology.nodes[node_id]
-                    
-                job = 'XO_%s_' % node_id
-                query, target, output = utils.get_temporary_file_names_for_BLAST_search(prefix = job,\
-                                                                                  directory = self.tmp_directory)
-                id_to_read_object_dict = {}
-                for read_obj in node.reads[1:]:
-                    id_to_read_object_dict[read_obj.md5id] = read_obj
-
-                query_obj = u.FastaOutput(query)
-                for _id in id_to_read_object_dict:
+            # instead of searching reads in every node against the representative of the node
+            # separately, reads in all nodes are searched against representatives of all nodes
+            # with a single blastn run (which is split into parts to run in parallel unless
+            # no_threading is set). query ids carry the node id, so only hits to the
+            # representative of the node a read belongs to are taken into account.
+            job = 'XO_'
+            query, target, output = utils.get_temporary_file_names_for_BLAST_search(prefix = job,\
+                                                                              directory = self.tmp_directory)
+            id_to_unique_read_index_dict = {}
+            query_obj = u.FastaOutput(query)
+            for node_id in node_list:
+                for i in self.topology.nodes[node_id].unique_read_indices[1:].tolist():
+                    _id = '%s_%s' % (node_id, self.read_store.get_md5id(i))
+                    id_to_unique_read_index_dict[_id] = i
                     query_obj.write_id(_id)
-                    query_obj.write_seq(id_to_read_object_dict[_id].seq.replace('-', ''), split = False)
-                query_obj.close()
+                    query_obj.write_seq(self.read_store.get_seq(i).replace('-', ''), split = False)
+            query_obj.close()
+
+            similarity_dict = {}
+            if id_to_unique_read_index_dict:
+                self.topology.store_node_representatives(node_list, target)
 
-                target_obj = u.FastaOutput(target)
-                target_obj.write_id(node.reads[0].md5id)
-                target_obj.write_seq(node.reads[0].seq.replace('-', ''), split = False)            
-                target_obj.close()
+                self.progress.update('Running blastn (query: %s, target: %s)' % (utils.pretty_print(len(id_to_unique_read_index_dict)),
+                                                                                 utils.pretty_print(len(node_list))))
 
-                b = self._perform_blast(query, target, output, params = param, job = job, no_threading = True)
+                # every representative should be reported for a read if they are similar enough, otherwise
+                # the representative of its own node may be dropped in favor of others.
+                b = self._perform_blast(query, target, output, params = param + " -max_target_seqs %d" % len(node_list), job = job)
 
                 # something semi-smart: get all the read ids that are more similar to the rep_seq
                 # than allowed max_variation; keep them, remove anything that doesn't show up here.
                 # the other option would be to search for low similarity guys, but it would have
                 # required much more computational investment. 
+                self.progress.update('Generating similarity dict from blastn results')
                 similarity_dict = b.get_results_dict(min_identity = min_percent_identity)
-                read_ids_to_keep = set(similarity_dict.keys())
-                all_read_ids = set(id_to_read_object_dict.keys())
-                outliers = all_read_ids.difference(read_ids_to_keep)
-
-                for _id in outliers:
-                    outlier_read_object = id_to_read_object_dict[_id]
-                    node.reads.remove(outlier_read_object)
-                    shared_outlier_seqs_list.append(outlier_read_object)
-                
-                if len(outliers):
-                    node.dirty = True
-                    shared_dirty_nodes_list.append(node)
-                
-                    self.logger.info('%d outliers removed from node: %s (max frequency: %d; mean frequency: %.2f)'\
-                        % (sum([id_to_read_object_dict[_id].frequency for _id in outliers]),
-                           node_id,
-                           max([id_to_read_object_dict[_id].frequency for _id in outliers]),
-                           numpy.mean([id_to_read_object_dict[_id].frequency for _id in outliers]),))
-
-            mp = utils.Multiprocessing(worker, self.number_of_threads)
-            shared_dirty_nodes_list = mp.get_empty_shared_array()
-            shared_outlier_seqs_list = mp.get_empty_shared_array()
-
-            # arrange processes
-            processes_to_run = []
-            for node in node_list:
-                processes_to_run.append((node, shared_outlier_seqs_list, shared_dirty_nodes_list),)
-
-            # start the main loop to run all processes
-            mp.run_processes(processes_to_run, self.progress)
-
-            for node in shared_dirty_nodes_list:
-                self.topology.nodes[node.node_id] = node
-            
-            for outlier_read_object in shared_outlier_seqs_list:
-                self.topology.store_outlier(outlier_read_object, 'maximum_variation_allowed_reason')
+
+            outliers_dict = {}
+            for _id in id_to_unique_read_index_dict:
+                node_id = _id.split('_', 1)[0]
+                if _id not in similarity_dict or node_id not in similarity_dict[_id]:
+                    if node_id not in outliers_dict:
+                        outliers_dict[node_id] = []
+                    outliers_dict[node_id].append(id_to_unique_read_index_dict[_id])
+
+            for node_id in node_list:
+                if node_id not in outliers_dict:
+                    continue
+
+                node = self.topology.nodes[node_id]
+                node.dirty = True
+
+                outlier_read_indices = numpy.array(outliers_dict[node_id], dtype = numpy.int32)
+                node.unique_read_indices = node.unique_read_indices[~numpy.isin(node.unique_read_indices, outlier_read_indices)]
+                self.topology.store_outliers(outlier_read_indices, 'maximum_variation_allowed_reason')
+
+                self.logger.info('%d outliers removed from node: %s'\
+                            % (self.read_store.get_size(outlier_read_indices),
+                               node_id))
 
         self.progress.end()
 
@@ -987,45 +1356,62 @@ class Decomposer:
 
     def _relocate_outliers(self, reason, refresh_final_nodes = True):
         self.progress.new('Processing %s' % utils.get_pretty_name(reason))
-        query, target, output = utils.get_temporary_file_names_for_BLAST_search(prefix = "RO_%s_" % reason,
-                                                                          directory = self.tmp_directory)
 
         outliers = self.topology.outliers[reason]
 
-        id_to_read_object_dict = {}
-        for read_obj in outliers:
-            id_to_read_object_dict[read_obj.md5id] = read_obj
+        min_percent_identity = utils.get_percent_identity_for_N_base_difference(self.topology.average_read_length,
+                                                                          self.maximum_variation_allowed)
+
+        # list of (index of the outlier unique read, target node id) tuples
+        relocations = []
+
+        if not len(outliers):
+            pass
+        elif not self.relocate_outliers_with_blast:
+            self.progress.update('Searching representatives (query: %s, target: %s)' % (utils.pretty_print(len(outliers)),
+                                                                                         utils.pretty_print(len(self.topology.final_nodes))))
+            node_ids = sorted(self.topology.final_nodes)
+            index = RepresentativeIndex(node_ids, [self.topology.nodes[node_id].representative_seq for node_id in node_ids])
+            closest, percent_identities = index.search(self.read_store.matrix[outliers],
+                                                       min_percent_identity)
+
+            for i in numpy.where(closest >= 0)[0]:
+                relocations.append((outliers[i], node_ids[closest[i]]),)
+        else:
+            query, target, output = utils.get_temporary_file_names_for_BLAST_search(prefix = "RO_%s_" % reason,
+                                                                              directory = self.tmp_directory)
 
-        query_obj = u.FastaOutput(query)
-        for _id in id_to_read_object_dict:
-            query_obj.write_id(_id)
-            query_obj.write_seq(id_to_read_object_dict[_id].seq.replace('-', ''), split = False)
-        query_obj.close()
+            id_to_unique_read_index_dict = {}
+            for i in outliers.tolist():
+                id_to_unique_read_index_dict[self.read_store.get_md5id(i)] = i
 
-        self.topology.store_node_representatives(self.topology.final_nodes, target)
+            query_obj = u.FastaOutput(query)
+            for _id in id_to_unique_read_index_dict:
+                query_obj.write_id(_id)
+                query_obj.write_seq(self.read_store.get_seq(id_to_unique_read_index_dict[_id]).replace('-', ''), split = False)
+            query_obj.close()
 
-        min_percent_identity = utils.get_percent_identity_for_N_base_difference(self.topology.average_read_length,
-                                                                          self.maximum_variation_allowed)
+            self.topology.store_node_representatives(self.topology.final_nodes, target)
 
-        self.progress.update('Running blastn (query: %s, target: %s)' % (utils.pretty_print(len(outliers)),
-                                                                         utils.pretty_print(len(self.topology.final_nodes))))
-        params = "-perc_identity %.2f -max_target_seqs 1" % (min_percent_identity)
-        b = self._perform_blast(query, target, output, params, job = 'RO_%s_' % reason)
+            self.progress.update('Running blastn (query: %s, target: %s)' % (utils.pretty_print(len(outliers)),
+                                                                             utils.pretty_print(len(self.topology.final_nodes))))
+            params = "-perc_identity %.2f -max_target_seqs 1" % (min_percent_identity)
+            b = self._perform_blast(query, target, output, params, job = 'RO_%s_' % reason)
 
-        self.progress.update('Generating similarity dict from blastn results')
-        similarity_dict = b.get_results_dict(min_identity = min_percent_identity)
+            self.progress.update('Generating similarity dict from blastn results')
+            similarity_dict = b.get_results_dict(min_identity = min_percent_identity)
 
-        num_outlier_objects = len(similarity_dict)
-        num_outliers_relocated = sum([id_to_read_object_dict[_id].frequency for _id in similarity_dict])
+            for _id in similarity_dict:
+                relocations.append((id_to_unique_read_index_dict[_id], similarity_dict[_id].pop()),)
 
-        counter = 0
-        for _id in similarity_dict:
-            counter += 1
-            self.progress.update('Relocating outliers: %d of %d' % (counter,
-                                                                    num_outlier_objects))
-            self.topology.relocate_outlier(id_to_read_object_dict[_id],
-                                           similarity_dict[_id].pop(),
-                                           reason)
+        num_outlier_objects = len(relocations)
+        num_outliers_relocated = self.read_store.get_size([i for i, node_id in relocations])
+
+        if relocations:
+            self.progress.update('Relocating %d outliers' % (num_outlier_objects))
+            self.topology.relocate_outliers([i for i, node_id in relocations],
+                                            [node_id for i, node_id in relocations],
+                                            reason)
 
         self.progress.end()
         self.run.info('relocated_%s' % reason, utils.pretty_print(num_outliers_relocated))
@@ -1082,14 +1468,12 @@ class Decomposer:
             
         for reason in self.topology.outlier_reasons:
             self.progress.update('Processing outliers (%s)' % (reason))
-            for read_object in self.topology.outliers[reason]:
-                for read_id in read_object.ids:
-                    sample = utils.get_sample_name_from_defline(read_id, self.sample_name_separator)
-                    
-                    if sample not in read_distribution_dict:
-                        read_distribution_dict[sample] = get_dict_entry_tmpl()
-                
-                    read_distribution_dict[sample][reason] += 1
+            sample_codes = self._get_sample_codes_of_reads(self.topology.outliers[reason])
+            for sample, count in utils.get_sample_counts(sample_codes, self.sample_names):
+                if sample not in read_distribution_dict:
+                    read_distribution_dict[sample] = get_dict_entry_tmpl()
+
+                read_distribution_dict[sample][reason] += count
         
         self.progress.update('Storing...')
         utils.generate_TAB_delim_file_from_dict(read_distribution_dict,
@@ -1119,15 +1503,8 @@ class Decomposer:
                 node = self.topology.get_node(node_id)
                 node.store()
 
-            mp = utils.Multiprocessing(worker, self.number_of_threads)
-            
-            # arrange processes
-            processes_to_run = []
-            for node_id in self.topology.final_nodes:
-                processes_to_run.append((node_id,),)
-
-            # start the main loop to run all processes
-            mp.run_processes(processes_to_run, self.progress)
+            with utils.Multiprocessing(worker, self.number_of_threads) as mp:
+                mp.map([(node_id,) for node_id in self.topology.final_nodes], self.progress, 'Storing final nodes')
 
         self.progress.end()
         
@@ -1139,10 +1516,11 @@ class Decomposer:
         self.progress.update('Storing reads removed due to "%s" (size: %d)'\
                                             % (reason, len(self.topology.outliers[reason])))
  
-        for read_object in self.topology.outliers[reason]:
-            for read_id in read_object.ids:
+        for i in self.topology.outliers[reason].tolist():
+            seq = self.read_store.get_seq(i)
+            for read_id in self.read_store.get_ids(i):
                 output.write_id(read_id)
-                output.write_seq(read_object.seq, split = False)
+                output.write_seq(seq, split = False)
             
         output.close()
         self.progress.end()
@@ -1154,6 +1532,11 @@ class Decomposer:
             self._store_outliers(reason, output_file_path)
 
 
+    def _get_sample_codes_of_reads(self, unique_read_indices):
+        """Returns the sample index of every read represented by unique reads in `unique_read_indices`"""
+        return self.sample_codes[self.read_store.get_read_indices_of_uniques(unique_read_indices)]
+
+
     def _generate_samples_dict(self):
         self.progress.new('Computing Samples Dict')
         
@@ -1162,18 +1545,13 @@ class Decomposer:
             self.progress.update('Analyzing Node ID: "%s" (size: %d)'\
                                                         % (node_id, node.size))
         
-            for read in node.reads:
-                for read_id in read.ids:
-                    sample = utils.get_sample_name_from_defline(read_id, self.sample_name_separator)
-            
-                    if sample not in self.samples_dict:
-                        self.samples_dict[sample] = {}
-                        self.samples.append(sample)
-    
-                    if node_id in self.samples_dict[sample]:
-                        self.samples_dict[sample][node_id] += 1
-                    else:
-                        self.samples_dict[sample][node_id] = 1
+            sample_codes = self._get_sample_codes_of_reads(node.unique_read_indices)
+            for sample, count in utils.get_sample_counts(sample_codes, self.sample_names):
+                if sample not in self.samples_dict:
+                    self.samples_dict[sample] = {}
+                    self.samples.append(sample)
+
+                self.samples_dict[sample][node_id] = count
 
         self.samples.sort()
         self.progress.end()
@@ -1230,8 +1608,12 @@ class Decomposer:
             if node.killed:
                 continue
 
+            # nodes in the dict carry their reads (with read IDs), not the unique read store.
             new_node = copy.deepcopy(node)
+            new_node.reads = node.get_unique_read_objects()
+            new_node.read_store = None
             new_node.entropy_tpls = None
+            new_node.forget_read_matrix()
             
             topology_dict[node_id] = new_node
 
@@ -1250,6 +1632,11 @@ class Decomposer:
         nodes_dict = {}
         for node_id in self.topology.alive_nodes:
             node = self.topology.nodes[node_id]
+
+            # nodes finalized by CUSR/density in worker processes do not know their entropy yet.
+            if node.entropy is None:
+                node.do_entropy()
+
             topology_text_file_obj.write('%s\t%d\t%s\t%d\t%s\n' \
                                                % (node.node_id,
                                                   node.size,
@@ -1410,7 +1797,7 @@ class Decomposer:
 
         final_outliers_total = 0
         for reason in self.topology.outlier_reasons:
-            count = sum([read_obj.frequency for read_obj in self.topology.outliers[reason]])
+            count = self.topology.get_num_outliers(reason)
             final_outliers_total += count
             self.run.info('final_%s' % reason, utils.pretty_print(count))
 
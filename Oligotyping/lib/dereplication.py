@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2010 - 2012, A. Murat Eren
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# Please read the COPYING file.
+
+"""Dereplication of FASTA files that do not fit in memory.
+
+   SequenceSource(unique = True) keeps every unique sequence and all read IDs in a
+   dictionary until the entire file is read. DereplicatedSequenceSource gives unique
+   sequences in the same order with the same iteration API, but when the file is larger
+   than what the memory budget allows, it
+
+       (1) partitions reads into buckets on the disk by the hash of their sequence, so
+           every copy of a sequence ends up in the same bucket,
+       (2) dereplicates every bucket independently (in parallel when there are threads),
+           and stores unique sequences of the bucket sorted by abundance, and
+       (3) merges these sorted runs while unique sequences are being iterated.
+
+   Only one bucket per thread is in memory at a time, and iterating unique sequences
+   keeps only the next unique sequence of every run in memory."""
+
+import os
+import zlib
+import heapq
+import pickle
+import shutil
+import hashlib
+import tempfile
+
+import Oligotyping.lib.fastalib as u
+
+
+# approximate amount of memory dereplication may use (in bytes).
+DEFAULT_MEMORY_BUDGET = 1024 * 1024 * 1024
+
+# approximate number of bytes Python objects of unique sequences and read IDs take in
+# memory for every byte of FASTA they come from.
+MEMORY_PER_INPUT_BYTE = 3
+
+# number of unique sequences that are written to (or read from) sorted runs at once.
+RUN_CHUNK_SIZE = 1000
+
+
+class DereplicationError(Exception):
+    def __init__(self, e = None):
+        Exception.__init__(self)
+        self.e = e
+        return
+    def __str__(self):
+        return 'Dereplication Error: %s' % self.e
+
+
+def dereplicate(records, allow_mixed_case = False):
+    """Takes (seq, read_id) tuples, and returns (count, hash, seq, ids) tuples for unique
+       sequences, in the order of SequenceSource(unique = True)"""
+    uniques = {}
+    for seq, read_id in records:
+        key = seq.upper() if allow_mixed_case else seq
+        if key in uniques:
+            uniques[key][1].append(read_id)
+        else:
+            uniques[key] = (seq, [read_id])
+
+    entries = [(len(ids), hashlib.sha1(key.encode('utf-8')).hexdigest(), seq, ids) for key, (seq, ids) in uniques.items()]
+    uniques = None
+
+    entries.sort(key = lambda e: (e[0], e[1]), reverse = True)
+    return entries
+
+
+def dereplicate_bucket(bucket_path, run_path, allow_mixed_case = False):
+    """Dereplicates reads in a bucket file, and stores unique sequences in a sorted run.
+       Returns the number of unique sequences."""
+    def records():
+        for line in open(bucket_path):
+            seq, read_id = line[:-1].split('\t', 1)
+            yield (seq, read_id)
+
+    entries = dereplicate(records(), allow_mixed_case)
+    os.remove(bucket_path)
+
+    run = open(run_path, 'wb')
+    for i in range(0, len(entries), RUN_CHUNK_SIZE):
+        pickle.dump(entries[i:i + RUN_CHUNK_SIZE], run, protocol = pickle.HIGHEST_PROTOCOL)
+    run.close()
+
+    return len(entries)
+
+
+def read_run(run_path):
+    run = open(run_path, 'rb')
+    while 1:
+        try:
+            entries = pickle.load(run)
+        except EOFError:
+            break
+
+        for entry in entries:
+            yield entry
+
+    run.close()
+
+
+class DereplicatedSequenceSource:
+    def __init__(self, fasta_file_path, memory_budget = DEFAULT_MEMORY_BUDGET, num_threads = 1, tmp_directory = None, allow_mixed_case = False):
+        self.fasta_file_path = fasta_file_path
+        self.memory_budget = memory_budget
+        self.num_threads = max(num_threads or 1, 1)
+        self.allow_mixed_case = allow_mixed_case
+
+        # for FastaOutput.store
+        self.unique = True
+
+        self.pos = 0
+        self.id  = None
+        self.seq = None
+        self.ids = []
+
+        self.total_seq = 0
+        self.total_unique = 0
+
+        self.entries = None
+        self.run_paths = []
+        self.tmp_directory = None
+
+        if not os.path.exists(self.fasta_file_path):
+            raise DereplicationError("FASTA file does not exist: '%s'" % self.fasta_file_path)
+
+        # every thread dereplicates one bucket at a time, and buckets are expected to
+        # take MEMORY_PER_INPUT_BYTE times their size on the disk in memory.
+        bucket_size = max(self.memory_budget // (self.num_threads * MEMORY_PER_INPUT_BYTE), 1)
+        self.num_buckets = -(-os.path.getsize(self.fasta_file_path) // bucket_size) or 1
+
+        if self.num_buckets == 1:
+            self.unique_entries = dereplicate(self.get_records(), self.allow_mixed_case)
+            self.total_unique = len(self.unique_entries)
+        else:
+            self.unique_entries = None
+            self.tmp_directory = tempfile.mkdtemp(prefix = 'dereplication-', dir = tmp_directory)
+            self.dereplicate_buckets(self.partition(bucket_size))
+
+        self.reset()
+
+
+    def get_records(self):
+        fasta = u.SequenceSource(self.fasta_file_path, allow_mixed_case = self.allow_mixed_case)
+        while next(fasta):
+            self.total_seq += 1
+            yield (fasta.seq, fasta.id)
+        fasta.close()
+
+
+    def partition(self, bucket_size):
+        """Distributes reads into bucket files. Returns paths of buckets."""
+        bucket_paths = [os.path.join(self.tmp_directory, 'bucket-%d.txt' % i) for i in range(0, self.num_buckets)]
+
+        # lines of buckets are buffered, so only a single bucket file is open at a time.
+        buffers = [[] for i in range(0, self.num_buckets)]
+        buffered_bytes = 0
+
+        def flush():
+            for i in range(0, self.num_buckets):
+                if buffers[i]:
+                    bucket = open(bucket_paths[i], 'a')
+                    bucket.write(''.join(buffers[i]))
+                    bucket.close()
+                    buffers[i] = []
+
+        for seq, read_id in self.get_records():
+            key = seq.upper() if self.allow_mixed_case else seq
+            line = '%s\t%s\n' % (seq, read_id)
+            buffers[zlib.crc32(key.encode('utf-8')) % self.num_buckets].append(line)
+
+            buffered_bytes += len(line)
+            if buffered_bytes > bucket_size:
+                flush()
+                buffered_bytes = 0
+
+        flush()
+
+        return [p for p in bucket_paths if os.path.exists(p)]
+
+
+    def dereplicate_buckets(self, bucket_paths):
+        self.run_paths = [p[:-len('.txt')] + '.run' for p in bucket_paths]
+        args_list = [(bucket_paths[i], self.run_paths[i], self.allow_mixed_case) for i in range(0, len(bucket_paths))]
+
+        if self.num_threads == 1 or len(args_list) == 1:
+            num_uniques = [dereplicate_bucket(*args) for args in args_list]
+        else:
+            # utils imports this module, so Multiprocessing is imported here
+            from Oligotyping.utils.utils import Multiprocessing
+            with Multiprocessing(dereplicate_bucket, self.num_threads) as mp:
+                num_uniques = mp.map(args_list, chunk_size = 1)
+
+        self.total_unique = sum(num_uniques)
+
+
+    def __next__(self):
+        entry = next(self.entries, None)
+
+        if entry is None:
+            return False
+
+        self.pos += 1
+        self.seq = entry[2]
+        self.ids = entry[3]
+        self.id = self.ids[0]
+
+        return True
+
+
+    def reset(self):
+        self.pos = 0
+        self.id  = None
+        self.seq = None
+        self.ids = []
+
+        if self.unique_entries is not None:
+            self.entries = iter(self.unique_entries)
+        else:
+            self.entries = heapq.merge(*[read_run(p) for p in self.run_paths], key = lambda e: (e[0], e[1]), reverse = True)
+
+
+    def close(self):
+        self.entries = None
+        self.unique_entries = None
+        if self.tmp_directory and os.path.exists(self.tmp_directory):
+            shutil.rmtree(self.tmp_directory)
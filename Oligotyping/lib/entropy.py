@@ -18,10 +18,11 @@ from scipy import log2 as log
 from numpy import sqrt
 
 import Oligotyping.lib.fastalib as u
+from Oligotyping.lib.alignment_cache import get_alignment_cache
 from Oligotyping.utils.utils import pretty_print
+from Oligotyping.utils.utils import Multiprocessing
 from Oligotyping.utils.utils import Progress
 from Oligotyping.utils.utils import Run
-from Oligotyping.utils.utils import P
 
 
 class EntropyError(Exception):
@@ -36,13 +37,20 @@ class EntropyError(Exception):
 VALID_CHARS = {'nucleotide': set(['A', 'T', 'C', 'G', '-']),
                'amino_acid': set(['A', 'R', 'N', 'D', 'C', 'E', 'Q', 'G', 'H', 'I', 'L', 'K', 'M', 'F', 'P', 'S', 'T', 'W', 'Y', 'V', '-'])}
 
+# the order in which per-character terms of entropy are summed up. this is the order
+# python 2 used to iterate over VALID_CHARS, with which the expected results in the
+# unit tests were generated. keeping it fixed makes entropy values identical to the
+# last bit from one run to another, regardless of the hash randomization.
+ALPHABETS = {'nucleotide': ['A', 'C', '-', 'T', 'G'],
+             'amino_acid': ['A', 'C', 'E', 'D', 'G', 'F', 'I', 'H', 'K', '-', 'M', 'L', 'N', 'Q', 'P', 'S', 'R', 'T', 'W', 'V', 'Y']}
+
 run = Run()
 
 
 def entropy(l, l_qual = None, expected_qual_score = 40, amino_acid_sequences = False, sqrt_norm = False):
     l = l.upper() 
     
-    valid_chars = VALID_CHARS['amino_acid'] if amino_acid_sequences else VALID_CHARS['nucleotide']
+    valid_chars = ALPHABETS['amino_acid'] if amino_acid_sequences else ALPHABETS['nucleotide']
 
     if sqrt_norm:
         l_normalized = ''
@@ -64,76 +72,306 @@ def entropy(l, l_qual = None, expected_qual_score = 40, amino_acid_sequences = F
         return -(sum(E_Cs))
 
 
-def entropy_analysis(alignment_path, output_file = None, verbose = True, uniqued = False, freq_from_defline = None, weighted = False, qual_stats_dict = None, amino_acid_sequences = False):
+# base counts are kept for every possible byte value, so characters that are not in
+# the alphabet (i.e., 'N') still count towards the length of a column, just like
+# they do in `entropy`.
+NUM_CODES = 256
+
+# number of cells of an encoded alignment that are counted at once.
+COUNT_CHUNK_SIZE = 2 ** 22
+
+
+def get_alphabet_codes(amino_acid_sequences = False):
+    valid_chars = ALPHABETS['amino_acid'] if amino_acid_sequences else ALPHABETS['nucleotide']
+    return numpy.array([ord(c) for c in valid_chars])
+
+
+def encode_sequences(sequences):
+    """Returns an N x L uint8 matrix of (upper case) ASCII codes of sequences of the same length
+       (sequences can be str or bytes objects)"""
+    if len(sequences) and isinstance(sequences[0], bytes):
+        block = b''.join(sequences).upper()
+    else:
+        block = ''.join(sequences).encode('ascii', 'replace').upper()
+    return numpy.frombuffer(block, dtype = numpy.uint8).reshape(len(sequences), -1)
+
+
+def get_oligo_codes(matrix, positions):
+    """Returns an integer for every row of an encoded alignment that identifies the oligo
+       it presents at given positions: two rows get the same code if and only if they have
+       the same characters at these positions. Up to 8 positions, codes are characters
+       packed into 64 bit integers; otherwise they are indices of distinct oligos."""
+    columns = numpy.ascontiguousarray(numpy.asarray(matrix)[:, positions], dtype = numpy.uint8)
+
+    if len(positions) <= 8:
+        codes = numpy.zeros(len(columns), dtype = numpy.uint64)
+        for i in range(0, len(positions)):
+            codes |= columns[:, i].astype(numpy.uint64) << numpy.uint64(8 * i)
+        return codes
+
+    oligos = columns.view(numpy.dtype((numpy.void, len(positions)))).ravel()
+    return numpy.unique(oligos, return_inverse = True)[1].ravel()
+
+
+def get_partition(codes):
+    """Groups rows by their codes (see get_oligo_codes), and returns an array of row
+       indices for every group. Groups, and rows in them, are ordered as they would be
+       met by going through rows from the last one to the first one."""
+    num_rows = len(codes)
+    if not num_rows:
+        return []
+
+    reversed_codes = numpy.asarray(codes)[::-1]
+    order = numpy.argsort(reversed_codes, kind = 'stable')
+    sorted_codes = reversed_codes[order]
+
+    group_starts = numpy.concatenate(([0], numpy.where(sorted_codes[1:] != sorted_codes[:-1])[0] + 1))
+    groups = numpy.split((num_rows - 1) - order, group_starts[1:])
+
+    # first rows of groups are the ones that are met first
+    groups.sort(key = lambda rows: -rows[0])
+
+    return groups
+
+
+def get_base_counts(matrix, frequencies = None, counts = None):
+    """Counts every character in every column of an encoded alignment (a N x L matrix
+       from `encode_sequences`, or AlignmentCache.matrix), and returns an L x NUM_CODES
+       count matrix. If `frequencies` are given, every read is counted as many times as
+       its frequency. If `counts` is given, new counts are added to it."""
+    num_reads, alignment_length = matrix.shape
+
+    if counts is None:
+        counts = numpy.zeros((alignment_length, NUM_CODES), dtype = numpy.int64)
+
+    column_offsets = numpy.arange(alignment_length, dtype = numpy.int64) * NUM_CODES
+    num_reads_per_chunk = max(COUNT_CHUNK_SIZE // max(alignment_length, 1), 1)
+
+    for start in range(0, num_reads, num_reads_per_chunk):
+        chunk = numpy.asarray(matrix[start:start + num_reads_per_chunk])
+        cells = (chunk + column_offsets).ravel()
+
+        if frequencies is None:
+            chunk_counts = numpy.bincount(cells, minlength = alignment_length * NUM_CODES)
+        else:
+            weights = numpy.repeat(numpy.asarray(frequencies[start:start + num_reads_per_chunk], dtype = float), alignment_length)
+            chunk_counts = numpy.rint(numpy.bincount(cells, weights = weights, minlength = alignment_length * NUM_CODES)).astype(numpy.int64)
+
+        counts += chunk_counts.reshape(alignment_length, NUM_CODES)
+
+    return counts
+
+
+def get_column_entropies(counts, qual_stats_dict = None, expected_qual_score = 40, amino_acid_sequences = False, sqrt_norm = False):
+    """Computes the entropy of every column from an L x NUM_CODES count matrix in one go,
+       the same way `entropy` does it for a single column. Columns that are made of a single
+       character, and columns with entropy smaller than 0.00001 get 0.0. If `qual_stats_dict`
+       is given, entropy values are weighted by the mean quality score of each column."""
+    counts = numpy.asarray(counts)
+    totals = counts.sum(axis = 1)
+    single_character_columns = counts.max(axis = 1) == totals
+
+    alphabet_counts = counts[:, get_alphabet_codes(amino_acid_sequences)].astype(float)
+
+    if sqrt_norm:
+        alphabet_counts = numpy.rint(numpy.sqrt(alphabet_counts))
+        totals = alphabet_counts.sum(axis = 1)
+
+    with numpy.errstate(divide = 'ignore', invalid = 'ignore'):
+        P_C = (alphabet_counts / totals[:, numpy.newaxis]) + 0.0000000000000000001
+        E_Cs = P_C * log(P_C)
+
+    # terms are added one character at a time (instead of E_Cs.sum(axis = 1), which
+    # sums pairwise) so the result is exactly what `entropy` returns.
+    sum_E_Cs = numpy.zeros(len(counts))
+    for i in range(0, E_Cs.shape[1]):
+        sum_E_Cs += E_Cs[:, i]
+
+    column_entropies = -sum_E_Cs
+
+    if qual_stats_dict:
+        for position in numpy.where(~single_character_columns)[0]:
+            l_qual = qual_stats_dict[int(position)]
+            if l_qual:
+                column_entropies[position] = -(sum_E_Cs[position] * (l_qual['mean'] / expected_qual_score))
+
+    column_entropies[single_character_columns] = 0.0
+    column_entropies[numpy.isnan(column_entropies)] = 0.0
+    column_entropies[column_entropies < 0.00001] = 0.0
+
+    return column_entropies
+
+
+class EntropyAccumulator:
+    """Keeps base counts of every column of an alignment, so entropy can be computed without
+       keeping reads in memory. Reads can be added in chunks, and accumulators that count
+       different parts of the same alignment can be merged by addition:
+
+           a = EntropyAccumulator()
+           a.add_reads(['ACGT', 'ACCT'])
+           b = EntropyAccumulator()
+           b.add_reads(['ACGA'], frequencies = [2])
+           column_entropies = (a + b).get_column_entropies()
+    """
+    def __init__(self):
+        self.alignment_length = None
+        self.num_reads = 0
+        self.counts = None
+
+
+    def __iadd__(self, other):
+        self.merge(other)
+        return self
+
+
+    def __add__(self, other):
+        accumulator = EntropyAccumulator()
+        accumulator.merge(self)
+        accumulator.merge(other)
+        return accumulator
+
+
+    def check_alignment_length(self, alignment_length):
+        if self.alignment_length is None:
+            self.alignment_length = alignment_length
+            self.counts = numpy.zeros((alignment_length, NUM_CODES), dtype = numpy.int64)
+        elif self.alignment_length != alignment_length:
+            raise EntropyError("Not all reads have the same length.")
+
+
+    def add_matrix(self, matrix, frequencies = None):
+        """Adds reads in an encoded alignment (see `get_base_counts`)"""
+        if not len(matrix):
+            return
+
+        self.check_alignment_length(matrix.shape[1])
+        get_base_counts(matrix, frequencies, self.counts)
+        self.num_reads += len(matrix)
+
+
+    def add_reads(self, sequences, frequencies = None):
+        """Adds a chunk of aligned reads (str or bytes objects)"""
+        if not len(sequences):
+            return
+
+        for alignment_length in set([len(sequence) for sequence in sequences]):
+            self.check_alignment_length(alignment_length)
+
+        self.add_matrix(encode_sequences(sequences), frequencies)
+
+
+    def merge(self, other):
+        if other.alignment_length is None:
+            return
+
+        self.check_alignment_length(other.alignment_length)
+        self.counts += other.counts
+        self.num_reads += other.num_reads
+
+
+    def get_column_entropies(self, qual_stats_dict = None, expected_qual_score = 40, amino_acid_sequences = False, sqrt_norm = False):
+        if not self.num_reads:
+            raise EntropyError("There are no reads in the alignment.")
+
+        return get_column_entropies(self.counts, qual_stats_dict, expected_qual_score, amino_acid_sequences, sqrt_norm)
+
+
+def count_bases_in_byte_range(alignment_path, start, end, get_frequency = None, progress = None):
+    """Returns an EntropyAccumulator for reads in an alignment that start within a given
+       byte range of the file (see fastalib.get_byte_ranges). If `get_frequency` is given,
+       every read is counted as many times as get_frequency(read_id)."""
+    accumulator = EntropyAccumulator()
+    seqs, frequencies = [], []
+    num_reads = 0
+
+    for read_id, seq in u.read_records_in_byte_range(alignment_path, start, end):
+        seqs.append(seq)
+        if get_frequency:
+            frequencies.append(get_frequency(read_id))
+
+        num_reads += 1
+        if progress and num_reads % 10000 == 0:
+            progress.update('Reads processed: %s' % (pretty_print(num_reads)))
+
+        # count bases of reads in chunks
+        if len(seqs) * len(seq) >= COUNT_CHUNK_SIZE:
+            accumulator.add_reads(seqs, frequencies if get_frequency else None)
+            seqs, frequencies = [], []
+
+    accumulator.add_reads(seqs, frequencies if get_frequency else None)
+
+    return accumulator
+
+
+def entropy_analysis(alignment_path, output_file = None, verbose = True, uniqued = False, freq_from_defline = None, weighted = False, qual_stats_dict = None, amino_acid_sequences = False, use_alignment_cache = False, num_threads = 1):
     if freq_from_defline == None:
         freq_from_defline = lambda x: int([t.split(':')[1] for t in x.split('|') if t.startswith('freq')][0])
 
-    lines = []
-    previous_alignment_length = None
+    def get_frequency(read_id):
+        try:
+            return freq_from_defline(read_id)
+        except IndexError:
+            raise EntropyError("Reads declared as unique, but they do not have proper deflines. See help for --uniqued.")
+
+    num_threads = max(num_threads or 1, 1)
 
     progress = Progress()
     progress.verbose = verbose
    
-    alignment = u.SequenceSource(alignment_path)
+    alignment_cache = get_alignment_cache(alignment_path, progress) if use_alignment_cache else None
 
     progress.new('Processing the Alignment')
 
-    # processing the alignment file..
-    while next(alignment):
-        # check the alignment lengths along the way:
-        if previous_alignment_length:
-            if previous_alignment_length != len(alignment.seq):
-                raise EntropyError("Not all reads have the same length.")
-
-        # print out process info
-        if alignment.pos % 10000 == 0:
-            progress.update('Reads processed: %s' % (pretty_print(alignment.pos)))
-        
-        # fill 'lines' variable
-        if not uniqued:
-            lines.append(alignment.seq)
-        else:
-            try:
-                frequency = freq_from_defline(alignment.id)
-            except IndexError:
-                raise EntropyError("Reads declared as unique, but they do not have proper deflines. See help for --uniqued.")
-                
-            for i in range(0, frequency):
-                lines.append(alignment.seq)
+    if alignment_cache:
+        # reads are already encoded. there is nothing to parse. parts are ranges of rows
+        # in the matrix.
+        parts = [(alignment_cache.num_reads * i // num_threads, alignment_cache.num_reads * (i + 1) // num_threads) \
+                                                                                  for i in range(0, num_threads)]
+
+        def count_bases(start, end, progress = None):
+            accumulator = EntropyAccumulator()
+            if progress:
+                progress.update('Counting bases in %s reads' % pretty_print(end - start))
+            frequencies = [get_frequency(read_id) for read_id in alignment_cache.get_ids(start, end)] if uniqued else None
+            accumulator.add_matrix(alignment_cache.matrix[start:end], frequencies)
+            return accumulator
+    else:
+        # parts are byte ranges of the alignment file.
+        parts = u.get_byte_ranges(alignment_path, num_threads)
+
+        def count_bases(start, end, progress = None):
+            return count_bases_in_byte_range(alignment_path, start, end, get_frequency if uniqued else None, progress)
 
-        previous_alignment_length = len(alignment.seq)
+    accumulator = EntropyAccumulator()
+    if num_threads == 1 or len(parts) == 1:
+        for start, end in parts:
+            accumulator += count_bases(start, end, progress)
+    else:
+        with Multiprocessing(count_bases, num_threads) as mp:
+            for partial_accumulator in mp.map(parts, progress, 'Counting bases in %d parts' % len(parts)):
+                accumulator += partial_accumulator
 
     progress.end()
     if verbose:
-        run.info('Number of reads', pretty_print(alignment.pos))
+        run.info('Number of reads', pretty_print(accumulator.num_reads))
 
-    alignment.close()
+    if not accumulator.num_reads:
+        raise EntropyError("There are no reads in the alignment.")
 
+    counts = accumulator.counts
 
-    # entropy analysis
-    progress.new('Entropy Analysis')
-    entropy_tpls = []
+    if weighted and not qual_stats_dict and (counts.max(axis = 1) != counts.sum(axis = 1)).any():
+        raise EntropyError("Weighted entropy is selected, but no qual stats are provided")
 
-    for position in range(0, len(lines[0])):
-        progress.update(P(int(position + 1), len(lines[0])))
-   
-        if len(set([x[position] for x in lines])) == 1:
-            entropy_tpls.append((position, 0.0),)
-        else:
-            column = "".join([x[position] for x in lines])
 
-            if weighted:
-                if not qual_stats_dict: 
-                    raise EntropyError("Weighted entropy is selected, but no qual stats are provided")
-                e = entropy(column, l_qual = qual_stats_dict[position], amino_acid_sequences = amino_acid_sequences)
-            else:
-                e = entropy(column, amino_acid_sequences = amino_acid_sequences)
+    # entropy analysis
+    progress.new('Entropy Analysis')
+    progress.update('Computing entropy for %d columns' % len(counts))
 
-            if e < 0.00001:
-                entropy_tpls.append((position, 0.0),)
-            else:
-                entropy_tpls.append((position, e),)
+    column_entropies = accumulator.get_column_entropies(qual_stats_dict = qual_stats_dict if weighted else None,
+                                                        amino_acid_sequences = amino_acid_sequences).tolist()
 
+    entropy_tpls = list(enumerate(column_entropies))
     sorted_entropy_tpls = sorted(entropy_tpls, key=operator.itemgetter(1), reverse=True)
 
     progress.end()
@@ -165,19 +403,7 @@ def entropy_analysis(alignment_path, output_file = None, verbose = True, uniqued
 def quick_entropy(l, amino_acid_sequences = False):
     if len(set([len(x) for x in l])) != 1:
         raise EntropyError("Not all vectors have the same length.")
-    
-    entropy_tpls = []
-    for position in range(0, len(l[0])):
-        if len(set([x[position] for x in l])) == 1:
-            entropy_tpls.append((position, 0.0),)
-        else:
-            column = "".join([x[position] for x in l])
-
-            e = entropy(column, amino_acid_sequences = amino_acid_sequences)
 
-            if e < 0.00001:
-                entropy_tpls.append((position, 0.0),)
-            else:
-                entropy_tpls.append((position, e),)
+    column_entropies = get_column_entropies(get_base_counts(encode_sequences(l)), amino_acid_sequences = amino_acid_sequences)
 
-    return [x[1] for x in entropy_tpls if x[1] > 0]
+    return [e for e in column_entropies.tolist() if e > 0]
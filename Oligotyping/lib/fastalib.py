@@ -10,10 +10,296 @@
 #
 # Please read the docs/COPYING file.
 
+import os
 import sys
+import mmap
 import numpy
 import hashlib
 
+
+# size of the blocks the buffered parsers read from the disk at once.
+BLOCK_SIZE = 1024 * 1024
+
+
+class RecordBlockReader:
+    """Reads '>'-delimited records from an open file in large blocks.
+
+       Instead of reading the file line by line, blocks of `block_size` characters
+       are read, everything up to the last complete record in the buffer is split
+       into records in bulk, and the incomplete tail is carried over to the next
+       block. `next()` returns a (header, body) tuple for every record, where header
+       is the defline without the leading '>', and body is the raw text that follows
+       it (line breaks included), or None when there are no more records."""
+    def __init__(self, file_pointer, block_size = BLOCK_SIZE):
+        self.file_pointer = file_pointer
+        self.block_size = block_size
+        self.reset()
+
+    def reset(self):
+        self.buffer = ''
+        self.records = []
+        self.record_index = 0
+        self.eof = False
+
+    def fill(self):
+        while not self.eof:
+            block = self.file_pointer.read(self.block_size)
+
+            if not block:
+                self.eof = True
+                chunk, self.buffer = self.buffer, ''
+                if not chunk:
+                    return False
+            else:
+                search_start = max(len(self.buffer) - 1, 0)
+                self.buffer += block
+                cut = self.buffer.rfind('\n>', search_start)
+                if cut == -1:
+                    continue
+                chunk, self.buffer = self.buffer[:cut], self.buffer[cut + 1:]
+
+            # every chunk starts with the '>' of its first defline, which is dropped
+            # here the same way the line-by-line parser drops the first character.
+            self.records = chunk[1:].split('\n>')
+            self.record_index = 0
+            return True
+
+        return False
+
+    def next(self):
+        if self.record_index >= len(self.records):
+            if not self.fill():
+                return None
+
+        record = self.records[self.record_index]
+        self.record_index += 1
+
+        header, body = record.split('\n', 1) if '\n' in record else (record, '')
+        return (header, body)
+
+    def is_last_record(self):
+        return self.eof and self.record_index >= len(self.records)
+
+
+def count_records(file_pointer, block_size = BLOCK_SIZE):
+    """Returns the number of lines that start with '>' without reading the file line by line."""
+    file_pointer.seek(0)
+
+    num_records = 0
+    previous_char = '\n'
+    while 1:
+        block = file_pointer.read(block_size)
+        if not block:
+            break
+        num_records += block.count('\n>') + (1 if previous_char == '\n' and block[0] == '>' else 0)
+        previous_char = block[-1]
+
+    file_pointer.seek(0)
+    return num_records
+
+
+def get_byte_ranges(fasta_file_path, num_ranges):
+    """Splits a FASTA file into `num_ranges` (start, end) byte ranges of about the same size.
+       Every record belongs to the range its defline starts in (see read_records_in_byte_range)."""
+    file_size = os.path.getsize(fasta_file_path)
+    num_ranges = max(min(num_ranges, file_size), 1)
+
+    boundaries = [file_size * i // num_ranges for i in range(0, num_ranges + 1)]
+    return [(boundaries[i], boundaries[i + 1]) for i in range(0, num_ranges)]
+
+
+def read_records_in_byte_range(fasta_file_path, start, end, block_size = BLOCK_SIZE):
+    """Yields (id, seq) for every record whose defline starts within [start, end) in the
+       file. Unlike SequenceSource, sequences are returned as bytes and are not converted
+       to upper case. Ranges from get_byte_ranges can be processed independently, and
+       together they give every record in the file exactly once."""
+    fasta_file = open(fasta_file_path, 'rb')
+
+    # find the beginning of the first record in the range
+    if start > 0:
+        fasta_file.seek(start - 1)
+        buffer, buffer_start = b'', start - 1
+        while 1:
+            block = fasta_file.read(block_size)
+            if not block:
+                fasta_file.close()
+                return
+            buffer += block
+            record_start = buffer.find(b'\n>')
+            if record_start != -1:
+                start = buffer_start + record_start + 1
+                break
+            buffer, buffer_start = buffer[-1:], buffer_start + len(buffer) - 1
+
+    if start >= end:
+        fasta_file.close()
+        return
+
+    fasta_file.seek(start)
+    buffer, buffer_start = b'', start
+    while 1:
+        block = fasta_file.read(block_size)
+        eof = not block
+
+        search_start = max(len(buffer) - 1, 0)
+        buffer += block
+        cut = len(buffer) if eof else buffer.rfind(b'\n>', search_start)
+        if cut <= 0:
+            if eof:
+                break
+            continue
+
+        # each record takes one byte for '>', its own length, and one byte for the new
+        # line character before the next '>'.
+        records = buffer[1:cut].split(b'\n>')
+        record_start = buffer_start
+        for i in range(0, len(records)):
+            if record_start >= end:
+                fasta_file.close()
+                return
+
+            header, body = records[i].split(b'\n', 1) if b'\n' in records[i] else (records[i], b'')
+            sequence = b''.join([l.strip() for l in body.split(b'\n')])
+
+            # a defline without a sequence at the end of the file is not a record
+            if eof and i == len(records) - 1 and not sequence:
+                break
+
+            yield (header.decode('utf-8').strip(), sequence)
+            record_start += len(records[i]) + 2
+
+        if eof:
+            break
+
+        buffer, buffer_start = buffer[cut + 1:], buffer_start + cut + 1
+
+    fasta_file.close()
+
+
+class FastaIndex:
+    """An on-disk offset index for a FASTA file.
+
+       Maps every read ID to the (byte offset, length) of its sequence in the FASTA
+       file, so a sequence can be retrieved with a seek and a read instead of a scan
+       of the entire file. The index is stored next to the FASTA file (with the
+       suffix INDEX_SUFFIX) along with the size and the modification time of the
+       FASTA file at the time it was built, and it is rebuilt whenever either of
+       those change. If the index can't be stored (i.e., the directory is not
+       writable) it is kept only in memory."""
+
+    INDEX_SUFFIX = '.idx'
+
+    def __init__(self, fasta_file_path, allow_mixed_case = False):
+        self.fasta_file_path = fasta_file_path
+        self.index_file_path = fasta_file_path + self.INDEX_SUFFIX
+        self.allow_mixed_case = allow_mixed_case
+
+        # read_id -> (offset, length). if a read ID appears more than once,
+        # the first occurrence wins (which is what a scan would return).
+        self.offsets = {}
+
+        fasta_stat = os.stat(self.fasta_file_path)
+        self.signature = '%d\t%d' % (fasta_stat.st_size, fasta_stat.st_mtime_ns)
+
+        if not self.load():
+            self.build()
+            self.store()
+
+        self.file_pointer = open(self.fasta_file_path, 'rb')
+
+    def __contains__(self, read_id):
+        return read_id in self.offsets
+
+    def __len__(self):
+        return len(self.offsets)
+
+    @property
+    def read_ids(self):
+        """Read IDs in the order they appear in the FASTA file."""
+        return self.offsets.keys()
+
+    def load(self):
+        if not os.path.exists(self.index_file_path):
+            return False
+
+        index_file = open(self.index_file_path)
+        if index_file.readline().rstrip('\n') != '#\t' + self.signature:
+            index_file.close()
+            return False
+
+        offsets = {}
+        for line in index_file:
+            read_id, offset, length = line.rstrip('\n').rsplit('\t', 2)
+            offsets[read_id] = (int(offset), int(length))
+        index_file.close()
+
+        self.offsets = offsets
+        return True
+
+    def build(self):
+        offsets = {}
+
+        fasta_file = open(self.fasta_file_path, 'rb')
+        file_size = os.fstat(fasta_file.fileno()).st_size
+        if not file_size:
+            fasta_file.close()
+            self.offsets = offsets
+            return
+
+        data = mmap.mmap(fasta_file.fileno(), 0, access = mmap.ACCESS_READ)
+
+        record_start = 0 if data[0:1] == b'>' else data.find(b'\n>') + 1
+        if record_start or data[0:1] == b'>':
+            while 1:
+                header_end = data.find(b'\n', record_start)
+                if header_end == -1:
+                    header_end = file_size
+
+                next_record = data.find(b'\n>', header_end)
+                sequence_end = next_record if next_record != -1 else file_size
+                sequence_start = min(header_end + 1, sequence_end)
+
+                read_id = data[record_start + 1:header_end].decode('utf-8').strip()
+                if read_id not in offsets:
+                    offsets[read_id] = (sequence_start, sequence_end - sequence_start)
+
+                if next_record == -1:
+                    break
+                record_start = next_record + 1
+
+        data.close()
+        fasta_file.close()
+
+        self.offsets = offsets
+
+    def store(self):
+        try:
+            index_file = open(self.index_file_path, 'w')
+        except (IOError, OSError):
+            return False
+
+        index_file.write('#\t%s\n' % self.signature)
+        for read_id in self.offsets:
+            offset, length = self.offsets[read_id]
+            index_file.write('%s\t%d\t%d\n' % (read_id, offset, length))
+        index_file.close()
+
+        return True
+
+    def get_seq(self, read_id):
+        if read_id not in self.offsets:
+            return False
+
+        offset, length = self.offsets[read_id]
+        self.file_pointer.seek(offset)
+        sequence = ''.join([l.strip() for l in self.file_pointer.read(length).decode('utf-8').split('\n')])
+
+        return sequence if self.allow_mixed_case else sequence.upper()
+
+    def close(self):
+        self.file_pointer.close()
+
+
 class FastaOutput:
     def __init__(self, output_file_path):
         self.output_file_path = output_file_path
@@ -64,17 +350,25 @@ class ReadFasta:
 
 
 class SequenceSource():
-    def __init__(self, fasta_file_path, lazy_init = True, unique = False, allow_mixed_case = False):
+    def __init__(self, fasta_file_path, lazy_init = True, unique = False, allow_mixed_case = False, buffered = True):
         self.fasta_file_path = fasta_file_path
         self.name = None
         self.lazy_init = lazy_init
         self.allow_mixed_case = allow_mixed_case
+
+        # buffered parsing is the default. the old line-by-line parser is still
+        # available through `buffered = False`.
+        self.buffered = buffered
         
         self.pos = 0
         self.id  = None
         self.seq = None
         self.ids = []
         
+        # offset index for random access, built (or loaded) on the first
+        # call to get_seq_by_read_id.
+        self.index = None
+
         self.unique = unique
         self.unique_hash_dict = {}
         self.unique_hash_list = []
@@ -82,11 +376,12 @@ class SequenceSource():
 
         self.file_pointer = open(self.fasta_file_path)
         self.file_pointer.seek(0)
+        self.block_reader = RecordBlockReader(self.file_pointer)
         
         if self.lazy_init:
             self.total_seq = None
         else:
-            self.total_seq = len([l for l in self.file_pointer.readlines() if l.startswith('>')])
+            self.total_seq = count_records(self.file_pointer)
             self.reset()
 
         if self.unique:
@@ -134,6 +429,32 @@ class SequenceSource():
             return False
 
     def next_regular(self):
+        if self.buffered:
+            return self.next_regular_buffered()
+        else:
+            return self.next_regular_line_by_line()
+
+    def next_regular_buffered(self):
+        self.seq = None
+        record = self.block_reader.next()
+
+        if record is None:
+            self.id = ''
+            return False
+
+        header, body = record
+        self.id = header.strip()
+
+        sequence = ''.join(map(str.strip, body.split('\n')))
+
+        if not sequence and self.block_reader.is_last_record():
+            return False
+
+        self.seq = sequence if self.allow_mixed_case else sequence.upper()
+        self.pos += 1
+        return True
+
+    def next_regular_line_by_line(self):
         self.seq = None
         self.id = self.file_pointer.readline()[1:].strip()
         sequence = ''
@@ -158,6 +479,12 @@ class SequenceSource():
 
 
     def get_seq_by_read_id(self, read_id):
+        if not self.unique:
+            if not self.index:
+                self.index = FastaIndex(self.fasta_file_path, allow_mixed_case = self.allow_mixed_case)
+
+            return self.index.get_seq(read_id)
+
         self.reset()
         while next(self):
             if self.id == read_id:
@@ -168,6 +495,8 @@ class SequenceSource():
 
     def close(self):
         self.file_pointer.close()
+        if self.index:
+            self.index.close()
 
     def reset(self):
         self.pos = 0
@@ -175,6 +504,7 @@ class SequenceSource():
         self.seq = None
         self.ids = []
         self.file_pointer.seek(0)
+        self.block_reader.reset()
 
     def visualize_sequence_length_distribution(self, title, dest = None, max_seq_len = None, xtickstep = None, ytickstep = None):
         import matplotlib.pyplot as plt
@@ -260,10 +590,11 @@ class SequenceSource():
  
 
 class QualSource:
-    def __init__(self, quals_file_path, lazy_init = True):
+    def __init__(self, quals_file_path, lazy_init = True, buffered = True):
         self.quals_file_path = quals_file_path
         self.name = None
         self.lazy_init = lazy_init
+        self.buffered = buffered
         
         self.pos = 0
         self.id  = None
@@ -273,15 +604,45 @@ class QualSource:
         
         self.file_pointer = open(self.quals_file_path)
         self.file_pointer.seek(0)
+        self.block_reader = RecordBlockReader(self.file_pointer)
         
         if self.lazy_init:
             self.total_quals = None
         else:
-            self.total_quals = len([l for l in self.file_pointer.readlines() if l.startswith('>')])
+            self.total_quals = count_records(self.file_pointer)
             self.reset()
 
 
     def __next__(self):
+        if self.buffered:
+            return self.next_buffered()
+        else:
+            return self.next_line_by_line()
+
+    def next_buffered(self):
+        self.quals = None
+        self.quals_int = None
+        record = self.block_reader.next()
+
+        if record is None:
+            self.id = ''
+            return False
+
+        header, body = record
+        self.id = header.strip()
+
+        qualscores = ' '.join([l.strip() for l in body.split('\n')]).strip()
+
+        if not qualscores and self.block_reader.is_last_record():
+            return False
+
+        self.quals = qualscores
+        self.quals_int = list(map(int, self.quals.split()))
+        self.pos += 1
+
+        return True
+
+    def next_line_by_line(self):
         self.id = self.file_pointer.readline()[1:].strip()
         self.quals = None
         self.quals_int = None
@@ -319,6 +680,7 @@ class QualSource:
         self.quals_int = None
         self.ids = []
         self.file_pointer.seek(0)
+        self.block_reader.reset()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2010 - 2012, A. Murat Eren
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# Please read the COPYING file.
+
+"""Oligotypes packed into integers.
+
+   Every position of an oligotype takes 3 bits (enough for A, C, G, T, - and N), and the
+   first position takes the most significant bits. Characters are numbered in the order
+   they sort, so oligo codes sort the way oligotypes do, and two oligotypes can be
+   compared, or used as dictionary keys, without building strings for them."""
+
+import numpy
+
+
+ALPHABET = '-ACGNT'
+BITS_PER_POSITION = 3
+
+
+class OligoCodecError(Exception):
+    def __init__(self, e = None):
+        Exception.__init__(self)
+        self.e = e
+        return
+    def __str__(self):
+        return 'Oligo Codec Error: %s' % self.e
+
+
+class OligoCodec:
+    def __init__(self, num_positions, characters = ''):
+        """Codec for oligotypes of `num_positions` bases. Characters other than the ones in
+           ALPHABET can be given in `characters` (more bits per position are used if they
+           don't fit into BITS_PER_POSITION)"""
+        self.num_positions = num_positions
+        self.alphabet = sorted(set(ALPHABET) | set(characters))
+        self.bits = max(BITS_PER_POSITION, (len(self.alphabet) - 1).bit_length())
+        self.symbols = dict([(self.alphabet[i], i) for i in range(0, len(self.alphabet))])
+
+
+    def encode(self, oligo):
+        """Returns the code of `oligo`, or None if it can't be an oligotype of this codec"""
+        if len(oligo) != self.num_positions:
+            return None
+
+        code = 0
+        for base in oligo:
+            if base not in self.symbols:
+                return None
+            code = (code << self.bits) | self.symbols[base]
+
+        return code
+
+
+    def decode(self, code):
+        mask = (1 << self.bits) - 1
+        return ''.join([self.alphabet[(code >> (self.bits * (self.num_positions - i - 1))) & mask] \
+                                                            for i in range(0, self.num_positions)])
+
+
+    def encode_columns(self, columns):
+        """Encodes every row of an N x num_positions matrix of ASCII codes (i.e., columns of
+           locations of interest of an encoded alignment), and returns a tuple of (sorted list
+           of distinct codes, index of the code of every row in this list)"""
+        columns = numpy.asarray(columns, dtype = numpy.uint8).reshape(-1, self.num_positions)
+
+        lookup = numpy.full(256, len(self.alphabet), dtype = numpy.uint8)
+        for base in self.alphabet:
+            if ord(base) < 256:
+                lookup[ord(base)] = self.symbols[base]
+
+        symbols = lookup[columns]
+        if (symbols == len(self.alphabet)).any():
+            raise OligoCodecError("Some oligotypes contain characters that are not in the alphabet of the codec.")
+
+        if self.num_positions * self.bits <= 64:
+            packed = numpy.zeros(len(symbols), dtype = numpy.uint64)
+            for i in range(0, self.num_positions):
+                packed = (packed << numpy.uint64(self.bits)) | symbols[:, i].astype(numpy.uint64)
+
+            codes, inverse = numpy.unique(packed, return_inverse = True)
+            return ([int(code) for code in codes], inverse.ravel())
+
+        # codes don't fit into 64 bits. distinct rows of symbols sort the way their codes do,
+        # so only distinct ones are packed into (python) integers.
+        rows = numpy.ascontiguousarray(symbols).view(numpy.dtype((numpy.void, self.num_positions))).ravel()
+        distinct_rows, inverse = numpy.unique(rows, return_inverse = True)
+
+        codes = []
+        for row in distinct_rows:
+            code = 0
+            for symbol in bytearray(row.tobytes()):
+                code = (code << self.bits) | symbol
+            codes.append(code)
+
+        return (codes, inverse.ravel())
+
+
+    def decode_columns(self, codes):
+        """Returns a len(codes) x num_positions matrix of ASCII codes of oligotypes (the opposite
+           of encode_columns)"""
+        columns = numpy.frombuffer(''.join([self.decode(code) for code in codes]).encode('latin-1'), dtype = numpy.uint8)
+        return columns.reshape(len(codes), self.num_positions)
+
+
+def get_oligo_codec(columns):
+    """Returns an OligoCodec that can encode every row of `columns` (see encode_columns)"""
+    columns = numpy.asarray(columns, dtype = numpy.uint8)
+    return OligoCodec(columns.shape[1], ''.join([chr(c) for c in numpy.unique(columns)]))
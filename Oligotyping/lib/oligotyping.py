@@ -14,18 +14,27 @@
 import os
 import sys
 import copy
+import numpy
 import shutil
 import pickle
 import logging
 import itertools
 import math
 
+from scipy import sparse
+
 import Oligotyping as o
 from Oligotyping.utils import utils
 from Oligotyping.utils import blast
 from Oligotyping.utils.random_colors import random_colors
 from Oligotyping.utils.random_colors import get_color_shade_dict_for_list_of_values
 from Oligotyping.lib import fastalib as u
+from Oligotyping.lib.alignment_cache import get_alignment_cache
+from Oligotyping.lib.checkpoint import Checkpoint
+from Oligotyping.lib.checkpoint import CheckpointError
+from Oligotyping.lib.checkpoint import CHECKPOINT_FILE_NAME
+from Oligotyping.lib.read_table import ReadTable
+from Oligotyping.lib.read_table import ReadTableError
 from Oligotyping.lib.shared import generate_default_figures
 from Oligotyping.lib.shared import generate_exclusive_figures
 from Oligotyping.visualization.frequency_curve_and_entropy import vis_freq_curve
@@ -35,6 +44,15 @@ from Oligotyping.visualization.oligotype_distribution_across_samples import olig
 from functools import reduce
 
 
+# options settings of a component sweep get from the oligotyping that runs the sweep
+SWEEP_OPTIONS = ['entropy', 'alignment', 'quals_dict', 'min_base_quality', 'limit_oligotypes_to', 'exclude_oligotypes',
+                 'min_number_of_samples', 'min_percent_abundance', 'min_actual_abundance', 'min_substantive_abundance',
+                 'project', 'sample_name_separator', 'limit_representative_sequences', 'quick', 'no_figures',
+                 'no_display', 'keep_tmp', 'blast_ref_db', 'do_blast_search', 'skip_gen_html', 'colors_list_file',
+                 'generate_sets', 'cosine_similarity_threshold', 'sample_mapping', 'skip_alignment_cache',
+                 'skip_basic_analyses', 'skip_gexf_network_file', 'no_threading', 'number_of_threads']
+
+
 class Oligotyping:
     def __init__(self, args = None):
         self.analysis = 'oligotyping'
@@ -67,10 +85,16 @@ class Oligotyping:
         self.sample_mapping = None
         self.log_file_path = None
         self.skip_check_input_file = False
+        self.skip_alignment_cache = False
         self.skip_basic_analyses = False
         self.skip_gexf_network_file = False
         self.no_threading = False
         self.number_of_threads = None
+        self.reuse_checkpoint = None
+
+        # numbers of auto components, or comma separated selected components, of every
+        # setting of a component sweep (see sweep)
+        self.component_sets = None
 
         Absolute = lambda x: os.path.join(os.getcwd(), x) if not x.startswith('/') else x 
 
@@ -103,14 +127,31 @@ class Oligotyping:
             self.generate_sets = args.generate_sets
             self.sample_mapping = args.sample_mapping
             self.skip_check_input_file = args.skip_check_input_file
+            self.skip_alignment_cache = args.skip_alignment_cache
             self.skip_basic_analyses = args.skip_basic_analyses
             self.skip_gexf_network_file = args.skip_gexf_network_file
             self.no_threading = args.no_threading
             self.number_of_threads = args.number_of_threads
+            self.reuse_checkpoint = Absolute(args.reuse_checkpoint) if args.reuse_checkpoint else None
+
+            if args.sweep_c or args.sweep_C:
+                self.component_sets = (args.sweep_c or []) + (args.sweep_C or [])
         
         self.run = utils.Run()
         self.progress = utils.Progress()
 
+        self.alignment_cache = None
+
+        # sample, oligotype and unique sequence of every read in the alignment, recorded in
+        # a single pass (see _init_read_table).
+        self.read_table = None
+        self.sample_codes = None
+        self.sample_names = []
+
+        # reads of every oligo in every sample before the noise filters, computed from the read
+        # table, or loaded from the checkpoint of an earlier run (see --reuse-checkpoint).
+        self.checkpoint = None
+
         self.samples_dict = {}
         self.sample_mapping_dict = {}
         self.excluded_read_ids_tracker = {}
@@ -123,6 +164,10 @@ class Oligotyping:
         self.samples = []
         self.abundant_oligos = []
 
+        # number of reads of every oligo (columns, in the order of self.checkpoint.oligos) in
+        # every sample (rows, in the order of self.samples). see _construct_samples_dict.
+        self.sample_oligo_counts = None
+
         self.final_oligo_counts_dict = {}
         self.final_oligo_entropy_distribution_dict = {}
         self.final_oligo_unique_distribution_dict = {}
@@ -155,9 +200,16 @@ class Oligotyping:
         if self.number_of_auto_components == None and self.selected_components == None:
             raise utils.ConfigError("Both 'auto components' (-c), and 'selected components' (-C) were declared.")
 
+        self.check_output_directory(self.get_prefix())
+
+        self.tmp_directory = self.generate_output_destination('TMP', directory = True)
+        self.figures_directory = self.generate_output_destination('FIGURES', directory = True)
+
+
+    def check_output_directory(self, postfix):
         # check output associated stuff
         if not self.output_directory:
-            self.output_directory = os.path.join(os.getcwd(), '-'.join([self.project.replace(' ', '_'), self.get_prefix()]))
+            self.output_directory = os.path.join(os.getcwd(), '-'.join([self.project.replace(' ', '_'), postfix]))
         
         if not os.path.exists(self.output_directory):
             try:
@@ -168,11 +220,8 @@ class Oligotyping:
         if not os.access(self.output_directory, os.W_OK):
             raise utils.ConfigError("You do not have write permission for the output directory: '%s'" % self.output_directory)
 
-        self.tmp_directory = self.generate_output_destination('TMP', directory = True)
-        self.figures_directory = self.generate_output_destination('FIGURES', directory = True)
-
 
-    def check_input(self):
+    def check_input_files(self):
         if (not os.path.exists(self.alignment)) or (not os.access(self.alignment, os.R_OK)):
             raise utils.ConfigError("Alignment file is not accessible: '%s'" % self.alignment)
         
@@ -190,22 +239,51 @@ class Oligotyping:
             if len(first_characters) != 1 or first_characters[0] != '#':
                 raise utils.ConfigError("Colors list file does not seem to be correctly formatted")
 
+
+    def check_input(self):
+        self.check_input_files()
+
+        if self.reuse_checkpoint:
+            self._load_checkpoint()
+
+        # settings of a component sweep get the alignment cache of the sweep (see sweep)
+        if not self.skip_alignment_cache and not self.checkpoint and not self.alignment_cache:
+            self.alignment_cache = get_alignment_cache(self.alignment, self.progress)
+
         # set the alignment lentgh (it will be necessary to check certain params)
-        alignment = u.SequenceSource(self.alignment)
-        next(alignment)
-        self.alignment_length = len(alignment.seq)
-        alignment.close()
+        self._set_alignment_length()
 
         # now we know that input files are OK, lets check input params before we go any further.
         self.check_params()
+        self._set_bases_of_interest_locs()
+
+        if self.checkpoint:
+            if self.checkpoint.matches(self.bases_of_interest_locs, self.sample_name_separator,
+                                       self.min_base_quality if self.quals_dict else None):
+                # there are no reads to generate representative sequences from
+                self.quick = True
+                self.sample_names = self.checkpoint.sample_names
+            else:
+                self.run.warning("Components, the sample name separator or --min-base-quality of this run are\
+                                  not the same as the ones of the checkpoint '%s'. The alignment will be\
+                                  read." % self.reuse_checkpoint)
+                self.checkpoint = None
+                if not self.skip_alignment_cache:
+                    self.alignment_cache = get_alignment_cache(self.alignment, self.progress)
+
+        if not self.checkpoint:
+            # settings of a component sweep get their read tables from the sweep
+            if not self.read_table:
+                self._init_read_table()
+            self.checkpoint = Checkpoint.from_read_table(self.read_table, self.alignment_length,
+                                                         self.min_base_quality if self.quals_dict else None)
 
         samples = None
-        if not self.skip_check_input_file:
-            self.progress.new('Checking the input FASTA')
-            samples = utils.check_input_alignment(self.alignment, self.sample_name_separator, self.progress)
-            if not samples:
-                raise utils.ConfigError('Exiting.')
-            self.progress.end()
+        if not self.skip_check_input_file and self.read_table:
+            samples = self._check_input_alignment()
+        elif not self.skip_check_input_file:
+            # the alignment was checked by the run that stored the checkpoint
+            samples = set(self.checkpoint.sample_names)
 
         if self.sample_mapping:
             utils.mapping_file_simple_check(self.sample_mapping, samples)
@@ -214,12 +292,49 @@ class Oligotyping:
             self.sample_mapping = sample_mapping_new_destination
 
 
+    def _set_alignment_length(self):
+        if self.checkpoint:
+            self.alignment_length = self.checkpoint.alignment_length
+        elif self.alignment_cache:
+            self.alignment_length = self.alignment_cache.alignment_length
+        else:
+            alignment = u.SequenceSource(self.alignment)
+            next(alignment)
+            self.alignment_length = len(alignment.seq)
+            alignment.close()
+
+
+    def _set_bases_of_interest_locs(self):
+        self.column_entropy = [int(x.strip().split()[0]) for x in open(self.entropy).readlines()]
+
+        if self.number_of_auto_components:
+            # locations of interest based on the entropy scores
+            self.bases_of_interest_locs = sorted([self.column_entropy[i] for i in range(0, self.number_of_auto_components)])
+        elif self.selected_components:
+            self.bases_of_interest_locs = sorted(self.selected_components)
+
+
+    def _check_input_alignment(self):
+        self.progress.new('Checking the input FASTA')
+        if not self.read_table.alignment_length:
+            raise utils.ConfigError("Not all reads have the same length.")
+        samples = utils.check_input_alignment(self.alignment, self.sample_name_separator, self.progress, self.alignment_cache, self.read_table)
+        if not samples:
+            raise utils.ConfigError('Exiting.')
+        self.progress.end()
+
+        return samples
+
+
     def check_params(self):
+        # parameters that are given as strings are parsed only once, so params can be checked
+        # more than once (see sweep).
         if self.selected_components:
-            try:
-                self.selected_components = [int(c) for c in self.selected_components.split(',')]
-            except:
-                raise utils.ConfigError("Selected components should be comma separated integer values (such as '4,8,15,25,47').")
+            if type(self.selected_components) == type(''):
+                try:
+                    self.selected_components = [int(c) for c in self.selected_components.split(',')]
+                except:
+                    raise utils.ConfigError("Selected components should be comma separated integer values (such as '4,8,15,25,47').")
         
             if max(self.selected_components) >= self.alignment_length:
                 raise utils.ConfigError("There is at least one component ('%d') that is bigger than the alignment length."\
@@ -245,7 +360,8 @@ class Oligotyping:
                 raise utils.ConfigError("Minimum base quality must be an integer between 0 and 40.")
 
         if self.limit_oligotypes_to:
-            self.limit_oligotypes_to = [o.strip().upper() for o in self.limit_oligotypes_to.split(',')]
+            if type(self.limit_oligotypes_to) == type(''):
+                self.limit_oligotypes_to = [o.strip().upper() for o in self.limit_oligotypes_to.split(',')]
             if len(self.limit_oligotypes_to) == 1:
                 raise utils.ConfigError("There must be more than one oligotype for --limit-oligotypes parameter.")
 
@@ -253,7 +369,8 @@ class Oligotyping:
                 raise utils.ConfigError("Oligotypes defined by --limit-oligotypes parameter seems to have ambiguous characters.")
 
         if self.exclude_oligotypes:
-            self.exclude_oligotypes = [o.strip().upper() for o in self.exclude_oligotypes.split(',')]
+            if type(self.exclude_oligotypes) == type(''):
+                self.exclude_oligotypes = [o.strip().upper() for o in self.exclude_oligotypes.split(',')]
             
             if len([n for n in ''.join(self.exclude_oligotypes) if n not in ['A', 'T', 'C', 'G', '-']]):
                 raise utils.ConfigError("Oligotypes defined by --exclude-oligotypes parameter seems to have ambiguous characters.")
@@ -262,12 +379,14 @@ class Oligotyping:
 
 
     def _init_logger(self, path = None):
-        self.logger = logging.getLogger('oligotyping')
-        
         if path:
             self.log_file_path = path 
         else:
             self.log_file_path = self.generate_output_destination('RUNINFO.log')
+
+        # every log file gets its own logger, so settings of a component sweep that run in
+        # the same process do not write into each other's log files.
+        self.logger = logging.getLogger('oligotyping:%s' % self.log_file_path)
         
         if os.path.exists(self.log_file_path):
             os.remove(self.log_file_path)
@@ -326,13 +445,6 @@ class Oligotyping:
 
         self.check_input()
 
-        self.progress.new('Initializing')
-        self.progress.update('Reading the input FASTA')
-        self.fasta = u.SequenceSource(self.alignment, lazy_init = False)
-        self.progress.end()
-
-        self.column_entropy = [int(x.strip().split()[0]) for x in open(self.entropy).readlines()]
-        
         if self.sample_mapping:
             self.sample_mapping_dict = utils.get_sample_mapping_dict(self.sample_mapping)
 
@@ -341,6 +453,7 @@ class Oligotyping:
         self.run.info('version', o.__version__)
         self.run.info('multi_threaded', not self.no_threading)
         self.run.info('alignment', self.alignment)
+        self.run.info('alignment_cache', self.alignment_cache.cache_path if self.alignment_cache else None)
         self.run.info('entropy', self.entropy)
         self.run.info('sample_mapping', self.sample_mapping)
         self.run.info('output_directory', self.output_directory)
@@ -348,7 +461,7 @@ class Oligotyping:
         self.run.info('info_file_path', self.info_file_path)
         self.run.info('quals_provided', True if self.quals_dict else False)
         self.run.info('cmd_line', utils.get_cmd_line(sys.argv))
-        self.run.info('total_seq', self.fasta.total_seq)
+        self.run.info('total_seq', self.checkpoint.num_reads)
         self.run.info('alignment_length', self.alignment_length)
         self.run.info('number_of_auto_components', self.number_of_auto_components or 0)
         self.run.info('number_of_selected_components', len(self.selected_components) if self.selected_components else 0)
@@ -367,17 +480,15 @@ class Oligotyping:
         if self.exclude_oligotypes:
             self.run.info('exclude_oligotypes', self.exclude_oligotypes)
         
-        if self.number_of_auto_components:
-            # locations of interest based on the entropy scores
-            self.bases_of_interest_locs = sorted([self.column_entropy[i] for i in range(0, self.number_of_auto_components)])
-            self.run.info('bases_of_interest_locs',', '.join([str(x) for x in self.bases_of_interest_locs]))
-        elif self.selected_components:
-            self.bases_of_interest_locs = sorted(self.selected_components)
+        if self.number_of_auto_components or self.selected_components:
             self.run.info('bases_of_interest_locs',', '.join([str(x) for x in self.bases_of_interest_locs]))
 
         if self.blast_ref_db:
             self.run.info('blast_ref_db', self.blast_ref_db)
 
+        if self.reuse_checkpoint:
+            self.run.info('checkpoint', self.reuse_checkpoint if not self.read_table else None)
+
         # set number of threads to be used
         if not self.number_of_threads:
             self.number_of_threads = utils.Multiprocessing(None).num_thread
@@ -385,6 +496,7 @@ class Oligotyping:
         self._construct_samples_dict()
         self._contrive_abundant_oligos()
         self._refine_samples_dict()
+        self._decode_oligos()
         self._get_unit_counts_and_percents()
         self._get_units_across_samples_dicts()
         self._generate_random_colors()
@@ -441,61 +553,223 @@ class Oligotyping:
         if not self.skip_gen_html:
             self._generate_html_output()
 
+    def sweep(self, component_sets = None):
+        """Oligotypes the alignment once for every set of components in `component_sets` (a number
+           of auto components, or selected components as a list or a comma separated string). The
+           alignment is read only once for all sets: the read table is built for the locations of
+           interest of all sets together, and read tables of sets are derived from it. Sets are
+           oligotyped in worker processes, every set is stored in a directory of its own in the
+           output directory, and SWEEP-SUMMARY.txt compares the number of oligotypes, purity
+           scores and the number of reads after the noise filters of all sets."""
+        component_sets = component_sets or self.component_sets
+        if not component_sets:
+            raise utils.ConfigError("There are no sets of components for the component sweep.")
+
+        self.check_apps()
+        self.check_output_directory('sweep')
+        self.tmp_directory = self.generate_output_destination('TMP', directory = True)
+
+        self.check_input_files()
+        if not self.skip_alignment_cache:
+            self.alignment_cache = get_alignment_cache(self.alignment, self.progress)
+        self._set_alignment_length()
+
+        # sets are checked before the alignment is read
+        oligotypings = []
+        for components in component_sets:
+            oligotyping = self._get_sweep_oligotyping(components)
+            if oligotyping.output_directory in [o.output_directory for o in oligotypings]:
+                raise utils.ConfigError("More than one set of the component sweep would be stored in '%s'."\
+                                                                    % oligotyping.output_directory)
+            oligotypings.append(oligotyping)
+
+        self.number_of_auto_components = None
+        self.selected_components = None
+        self.check_params()
+        self.bases_of_interest_locs = sorted(set([l for o in oligotypings for l in o.bases_of_interest_locs]))
+
+        self._init_read_table()
+        if not self.skip_check_input_file:
+            self._check_input_alignment()
+
+        for oligotyping in oligotypings:
+            try:
+                oligotyping.read_table = self.read_table.get_read_table_of_components(oligotyping.bases_of_interest_locs)
+            except ReadTableError as e:
+                raise utils.ConfigError(e)
+            oligotyping.sample_codes, oligotyping.sample_names = self.sample_codes, self.sample_names
+
+        if not self.number_of_threads:
+            self.number_of_threads = utils.Multiprocessing(None).num_thread
+
+        def worker(i):
+            oligotypings[i].run_all()
+            return oligotypings[i]._get_sweep_summary()
+
+        num_processes = min(self.number_of_threads, len(oligotypings))
+        self.progress.new('Component sweep')
+        if self.no_threading or num_processes < 2:
+            summaries = []
+            for i in range(0, len(oligotypings)):
+                self.progress.update('Oligotyping set %d of %d' % (i + 1, len(oligotypings)))
+                summaries.append(worker(i))
+        else:
+            # every set runs in a single worker process (worker processes can't have
+            # workers of their own).
+            for oligotyping in oligotypings:
+                oligotyping.no_threading = True
+
+            with utils.Multiprocessing(worker, num_processes) as mp:
+                summaries = mp.map([(i,) for i in range(0, len(oligotypings))], self.progress, 'Oligotyping sets', chunk_size = 1)
+        self.progress.end()
+
+        summary_dict = {}
+        for summary in summaries:
+            summary_dict[summary['setting']] = summary
+
+        summary_file_path = self.generate_output_destination('SWEEP-SUMMARY.txt')
+        utils.generate_TAB_delim_file_from_dict(summary_dict, summary_file_path,
+                                                ['components', 'num_components', 'num_oligos_before_filters', 'num_oligos',
+                                                 'num_sequences_after_qc', 'total_purity_score', 'min_purity_score'],
+                                                first_column = 'setting')
+
+        if (not self.keep_tmp):
+            shutil.rmtree(self.tmp_directory)
+
+        self.run.info('bases_of_interest_locs', ', '.join([str(x) for x in self.bases_of_interest_locs]))
+        self.run.info('num_settings', len(summaries))
+        self.run.info('sweep_summary', summary_file_path)
+
+        return summaries
+
+
+    def _get_sweep_oligotyping(self, components):
+        oligotyping = Oligotyping()
+
+        for option in SWEEP_OPTIONS:
+            setattr(oligotyping, option, getattr(self, option))
+
+        if type(components) == type(0):
+            oligotyping.number_of_auto_components = components
+        else:
+            oligotyping.number_of_auto_components = None
+            oligotyping.selected_components = components if type(components) == type('') \
+                                                         else ','.join([str(c) for c in components])
+
+        oligotyping.alignment_length = self.alignment_length
+        oligotyping.check_params()
+        oligotyping._set_bases_of_interest_locs()
+
+        # selected components are spelled out, so sets with the same number of selected
+        # components are not stored in the same directory
+        setting = oligotyping.get_prefix()
+        if oligotyping.selected_components:
+            setting = 'sc%s-%s' % ('_'.join([str(l) for l in oligotyping.bases_of_interest_locs]), setting.split('-', 1)[1])
+
+        # the input is checked only once for all sets
+        oligotyping.skip_check_input_file = True
+        oligotyping.output_directory = os.path.join(self.output_directory, setting)
+        oligotyping.alignment_cache = self.alignment_cache
+
+        oligotyping.run.verbose = False
+        oligotyping.progress.verbose = False
+
+        return oligotyping
+
+
+    def _get_sweep_summary(self):
+        summary = {'setting': os.path.basename(self.output_directory),
+                   'components': ','.join([str(l) for l in self.bases_of_interest_locs]),
+                   'num_components': len(self.bases_of_interest_locs),
+                   'num_oligos_before_filters': len(self.checkpoint.oligos),
+                   'num_oligos': len(self.abundant_oligos),
+                   'num_sequences_after_qc': self.num_sequences_after_qc}
+
+        # there are no purity scores with --quick
+        if self.final_purity_score_dict:
+            summary['total_purity_score'] = self.total_purity_score_dict
+            summary['min_purity_score'] = '%.2f' % min(self.final_purity_score_dict.values())
+
+        return summary
+
+
+    def _load_checkpoint(self):
+        self.progress.new('Checkpoint')
+        self.progress.update('Loading "%s"' % self.reuse_checkpoint)
+
+        try:
+            self.checkpoint = Checkpoint.load(self.reuse_checkpoint)
+        except CheckpointError as e:
+            self.progress.end()
+            raise utils.ConfigError(e)
+
+        self.progress.end()
+
+        if not self.checkpoint.is_from(self.alignment):
+            self.run.warning("Checkpoint '%s' was not generated from the current version of the alignment\
+                              '%s'. The alignment will be read." % (self.reuse_checkpoint, self.alignment))
+            self.checkpoint = None
+
+
+    def _init_read_table(self):
+        """Goes through the alignment once, and records the sample, the oligotype and the unique
+           sequence of every read. Everything else is computed from the read table."""
+        self.progress.new('Initializing')
+        self.progress.update('Reading the input FASTA')
+
+        try:
+            self.read_table = ReadTable(self.alignment, self.bases_of_interest_locs, self.sample_name_separator,
+                                        self.alignment_cache, self.quals_dict, self.min_base_quality, self.progress)
+        except ReadTableError as e:
+            self.progress.end()
+            raise utils.ConfigError(e)
+
+        self.sample_codes, self.sample_names = self.read_table.sample_codes, self.read_table.sample_names
+        self.progress.end()
+
+
     def _construct_samples_dict(self):
         """This is where oligotypes are being genearted based on bases of each
            alignment at the location of interest"""
 
         self.progress.new('Sample Dict Construction')
 
-        if self.quals_dict:
-            num_reads_eliminated_due_to_min_base_quality = 0
-
-        self.fasta.reset()
-        while next(self.fasta):
-            if self.fasta.pos % 1000 == 0:
-                self.progress.update('Analyzing: %s' \
-                                    % (utils.pretty_print(self.fasta.pos)))
-
-            sample = utils.get_sample_name_from_defline(self.fasta.id, self.sample_name_separator)
-            
-            if sample not in self.samples_dict:
-                self.samples_dict[sample] = {}
-                self.samples.append(sample)
-
-            if self.quals_dict:
-                # if qual_dicts is available, each base of interest will be tested
-                # against --min-base-quality parameter to make sure that it is above
-                # the expected quality score. 
-                quality_scores = self.quals_dict[self.fasta.id]
-                quality_scores_of_bases_of_interest = [quality_scores[o] for o in self.bases_of_interest_locs if not quality_scores[o] == None]
-               
-                min_base_quality = min([base_quality for base_quality in quality_scores_of_bases_of_interest if base_quality] or [0])
-
-                if min_base_quality < self.min_base_quality:
-                    # if True, discard the read
-                    # FIXME: Discarded reads should be stored somewhere else for further analysis
-                    num_reads_eliminated_due_to_min_base_quality += 1
-                    continue
-                else:
-                    oligo = ''.join(self.fasta.seq[o] for o in self.bases_of_interest_locs)
-                
-            else:
-                # if quals_dict is not available, oligotypes will be generated without
-                # checking the base qualities
-                oligo = ''.join(self.fasta.seq[o] for o in self.bases_of_interest_locs)
-        
-            if oligo in self.samples_dict[sample]:
-                self.samples_dict[sample][oligo] += 1
-            else:
-                self.samples_dict[sample][oligo] = 1
+        # reads of every sample and oligo (except the ones that failed --min-base-quality) are
+        # in the checkpoint. oligos are integer codes (see oligo_codec.py) until they are decoded
+        # for the output.
+        checkpoint = self.checkpoint
+        oligos = checkpoint.oligos
+
+        for sample in checkpoint.sample_names:
+            self.samples_dict[sample] = {}
+            self.samples.append(sample)
+
+        # (sample, oligo) pairs are in the order they are first seen, the way they were added
+        # to samples_dict one read at a time.
+        for sample_code, oligo_index, count in zip(checkpoint.pair_sample_codes.tolist(), checkpoint.pair_oligo_indices.tolist(),
+                                                   checkpoint.pair_counts.tolist()):
+            self.samples_dict[checkpoint.sample_names[sample_code]][oligos[oligo_index]] = count
        
         self.samples.sort()
+
+        # the same counts in a sparse samples x oligos matrix for the noise filters
+        sample_rows = dict([(self.samples[i], i) for i in range(0, len(self.samples))])
+        sample_code_rows = numpy.array([sample_rows[sample] for sample in checkpoint.sample_names], dtype = numpy.int64)
+        self.sample_oligo_counts = sparse.csc_matrix((checkpoint.pair_counts, (sample_code_rows[checkpoint.pair_sample_codes], checkpoint.pair_oligo_indices)),
+                                                     shape = (len(self.samples), len(oligos)), dtype = numpy.int64)
+
+        self.progress.update('Storing the checkpoint')
+        checkpoint_file_path = self.generate_output_destination(CHECKPOINT_FILE_NAME)
+        checkpoint.save(checkpoint_file_path)
+
         self.progress.end()
+        self.run.info('checkpoint_file_path', checkpoint_file_path)
         self.run.info('num_samples_in_fasta', len(self.samples_dict))
 
         if self.quals_dict:
+            num_reads_eliminated_due_to_min_base_quality = checkpoint.num_reads_eliminated_due_to_min_base_quality
             self.run.info('num_reads_eliminated_due_to_min_base_quality', num_reads_eliminated_due_to_min_base_quality)
-            if self.fasta.total_seq == num_reads_eliminated_due_to_min_base_quality:
+            if checkpoint.num_reads == num_reads_eliminated_due_to_min_base_quality:
                 raise utils.ConfigError("All reads were eliminated due to --min-base-quality (%d) rule" % self.min_base_quality)
         
 
@@ -511,56 +785,61 @@ class Oligotyping:
                     self.excluded_read_ids_tracker[reason][sample] += self.samples_dict[sample][oligo]
 
         
+    def _register_removals(self, oligo_indices, reason, times = None):
+        """Registers the removal of oligos in `oligo_indices` (columns of self.sample_oligo_counts)
+           the way calling _register_removal for every one of them (`times[i]` times for the
+           i'th one) in the same order would register them."""
+        if not len(oligo_indices):
+            return
+
+        if reason not in self.excluded_read_ids_tracker:
+            self.excluded_read_ids_tracker[reason] = {}
+        tracker = self.excluded_read_ids_tracker[reason]
+
+        if times is None:
+            times = numpy.ones(len(oligo_indices), dtype = numpy.int64)
+
+        counts = self.sample_oligo_counts[:, oligo_indices].tocoo()
+        removed = numpy.bincount(counts.row, weights = counts.data * times[counts.col], minlength = len(self.samples))
+
+        # samples are added to the tracker in the order they first appear in removed oligos
+        first_removals = numpy.full(len(self.samples), len(oligo_indices), dtype = numpy.int64)
+        numpy.minimum.at(first_removals, counts.row, counts.col)
+        rows = numpy.flatnonzero(first_removals < len(oligo_indices))
+
+        for row in rows[numpy.argsort(first_removals[rows], kind = 'stable')].tolist():
+            sample = self.samples[row]
+            tracker[sample] = tracker.get(sample, 0) + int(removed[row])
+
+
     def _contrive_abundant_oligos(self):
+        # noise filters are computed from the samples x oligos matrix of read counts. oligo
+        # codes sort the way oligotypes do, so they can be sorted instead of oligotypes.
+        oligos = self.checkpoint.oligos
+        counts = self.sample_oligo_counts
+        num_samples = numpy.diff(counts.indptr)
+        totals = numpy.asarray(counts.sum(axis = 0)).ravel()
+
         # cat oligos | uniq
         self.progress.new('Contriving Abundant Oligos')
-
-        # a performance optimization workaround in order to lessen the 
-        # number of expensive 'keys()' calls on samples_dict to be made
-        oligos_in_samples_dict = {}
-        for sample in self.samples:
-            oligos_in_samples_dict[sample] = set(self.samples_dict[sample].keys())
-        
-        oligos_set = []
-        for sample in self.samples:
-            self.progress.update('Unique Oligos: ' + utils.P(self.samples.index(sample), len(self.samples)))
-            for oligo in oligos_in_samples_dict[sample]:
-                if oligo not in oligos_set:
-                    oligos_set.append(oligo)
+        self.progress.update('Unique Oligos')
+        oligos_set = numpy.flatnonzero(num_samples)
         self.progress.end()
         self.run.info('num_unique_oligos', len(oligos_set))
        
 
         self.progress.new('Computing Oligo Abundances')
         # count oligo abundance
-        oligo_sample_abundance = []
-        for i in range(0, len(oligos_set)):
-            oligo = oligos_set[i]
-            
-            if i % 100 == 0 or i == len(oligos_set) - 1:
-                self.progress.update(utils.P(i, len(oligos_set)))
-            
-            count = 0
-            for sample in self.samples:
-                if oligo in oligos_in_samples_dict[sample]:
-                    count += 1
-            oligo_sample_abundance.append((count, oligo),)
-        oligo_sample_abundance.sort()
+        self.progress.update('Sorting')
+        oligo_sample_abundance = sorted([(num_samples[index], oligos[index], index) for index in oligos_set.tolist()])
         self.progress.end()
 
         # eliminate oligos based on the number of samples they appear
         # (any oligo required to appear in at least 'self.min_number_of_samples'
         # samples)
         self.progress.new('Applying -s parameter')
-        non_singleton_oligos = []
-        for i in range(0, len(oligo_sample_abundance)):
-            if i % 100 == 0 or i == len(oligo_sample_abundance) - 1:
-                self.progress.update(utils.P(i, len(oligo_sample_abundance)))
-            tpl = oligo_sample_abundance[i]
-            if tpl[0] >= self.min_number_of_samples:
-                non_singleton_oligos.append(tpl[1])
-            else:
-                self._register_removal(tpl[1], 'failed_s')
+        non_singleton_oligos = numpy.array([tpl[2] for tpl in oligo_sample_abundance if tpl[0] >= self.min_number_of_samples], dtype = numpy.int64)
+        self._register_removals(numpy.array([tpl[2] for tpl in oligo_sample_abundance if tpl[0] < self.min_number_of_samples], dtype = numpy.int64), 'failed_s')
 
         self.progress.end()
         self.run.info('num_oligos_after_s_elim', len(non_singleton_oligos))
@@ -568,71 +847,59 @@ class Oligotyping:
 
         # sample_sums keeps the actual number of oligos that are present in non_singleton_oligos list,
         # for each sample. computing it here once is more optimized.
-        sample_sums = {}
-        SUM = lambda sample: sum([self.samples_dict[sample][o] for o in non_singleton_oligos \
-                                                                if o in self.samples_dict[sample]])
-        for sample in self.samples:
-            sample_sums[sample] = SUM(sample)
+        non_singleton_counts = counts[:, non_singleton_oligos].tocoo()
+        sample_sums = numpy.bincount(non_singleton_counts.row, weights = non_singleton_counts.data, minlength = len(self.samples)).astype(numpy.int64)
 
         # eliminate very rare oligos (the percent abundance of every oligo should be
         # more than 'self.min_percent_abundance' percent in at least one sample)
         self.progress.new('Applying -a parameter')
-        for i in range(0, len(non_singleton_oligos)):
-            oligo = non_singleton_oligos[i]
-            if i % 100 == 0 or i == len(non_singleton_oligos) - 1:
-                self.progress.update(utils.P(i, len(non_singleton_oligos)))
-            
-            percent_abundances = []
-            for sample in self.samples:
-                if oligo in self.samples_dict[sample]:
-                    percent_abundances.append((self.samples_dict[sample][oligo] * 100.0 / sample_sums[sample],
-                                               self.samples_dict[sample][oligo],
-                                               sample_sums[sample],
-                                               sample))
-
-            percent_abundances.sort(reverse = True)
-
-            # NOTE: if a sample has less than 100 sequences, percent abundance doesn't mean much.
-            #       if user wants to eliminate oligotypes that doesn't appear in at least one sample
-            #       more than 1% abundance, a singleton of that oligotype that appears in a sample
-            #       which has 50 sequences would make that oligotype pass the filter. I think if an
-            #       oligotype passes the percent filter, sample size and actual count of the oligotype
-            #       should also be considered before considering it as an abundant oligotype:
-            for abundance_percent, abundance_count, sample_size, sample in percent_abundances:
-                PercentAbundance_OK = abundance_percent >= self.min_percent_abundance
-                DatesetSize_OK      = sample_size > 100 or abundance_count > self.min_percent_abundance
-
-                if PercentAbundance_OK and DatesetSize_OK:
-                    self.abundant_oligos.append((sum([x[1] for x in percent_abundances]), oligo))
-                    break
-                else:
-                    self._register_removal(oligo, 'failed_a')
+        self.progress.update('Computing percent abundances')
+
+        # every entry is the count of an oligo in a sample. entries of every oligo are sorted
+        # the way (percent abundance, count, sample size, sample) tuples sort in reverse.
+        entry_oligos = non_singleton_counts.col
+        entry_counts = non_singleton_counts.data
+        entry_sample_sizes = sample_sums[non_singleton_counts.row]
+        entry_percent_abundances = entry_counts * 100.0 / entry_sample_sizes
+        order = numpy.lexsort((-non_singleton_counts.row, -entry_sample_sizes, -entry_counts, -entry_percent_abundances, entry_oligos))
+
+        # NOTE: if a sample has less than 100 sequences, percent abundance doesn't mean much.
+        #       if user wants to eliminate oligotypes that doesn't appear in at least one sample
+        #       more than 1% abundance, a singleton of that oligotype that appears in a sample
+        #       which has 50 sequences would make that oligotype pass the filter. I think if an
+        #       oligotype passes the percent filter, sample size and actual count of the oligotype
+        #       should also be considered before considering it as an abundant oligotype:
+        PercentAbundance_OK = entry_percent_abundances[order] >= self.min_percent_abundance
+        DatesetSize_OK      = (entry_sample_sizes[order] > 100) | (entry_counts[order] > self.min_percent_abundance)
+
+        # an oligo is abundant if one of its entries is OK, and every entry that comes before
+        # the first OK one counts as a failure.
+        starts = numpy.searchsorted(entry_oligos[order], numpy.arange(0, len(non_singleton_oligos)))
+        ends = numpy.append(starts[1:], len(order)).astype(numpy.int64)
+        positions = numpy.where(PercentAbundance_OK & DatesetSize_OK, numpy.arange(0, len(order)), len(order))
+        first_OK = numpy.minimum.reduceat(numpy.append(positions, len(order)), starts) if len(starts) else starts
+        passed = first_OK < ends
+        failures = numpy.where(passed, first_OK, ends) - starts
+
+        self._register_removals(non_singleton_oligos[failures > 0], 'failed_a', failures[failures > 0])
+
+        abundant_oligo_indices = non_singleton_oligos[passed].tolist()
+        self.abundant_oligos = [tpl[1] for tpl in sorted([(totals[index], oligos[index]) for index in abundant_oligo_indices], reverse = True)]
+        oligo_to_index = dict([(oligos[index], index) for index in abundant_oligo_indices])
 
         self.progress.end()
         self.run.info('num_oligos_after_a_elim', len(self.abundant_oligos))
-        
-        self.abundant_oligos = [x[1] for x in sorted(self.abundant_oligos, reverse = True)]
 
 
         # eliminate very rare oligos (the ACTUAL ABUNDANCE, which is the sum of oligotype in all samples
         # should should be more than 'self.min_actual_abundance'.
         self.progress.new('Applying -A parameter')
         if self.min_actual_abundance > 0:
-            oligos_for_removal = []
-            for i in range(0, len(self.abundant_oligos)):
-                oligo = self.abundant_oligos[i]
+            oligos_for_removal = [oligo for oligo in self.abundant_oligos if self.min_actual_abundance > totals[oligo_to_index[oligo]]]
+            self._register_removals(numpy.array([oligo_to_index[oligo] for oligo in oligos_for_removal], dtype = numpy.int64), 'failed_A')
 
-                if i % 100 == 0 or i == len(self.abundant_oligos) - 1:
-                    self.progress.update(utils.P(i, len(non_singleton_oligos)))
-
-                oligo_actual_abundance = sum([self.samples_dict[sample][oligo] for sample in self.samples_dict\
-                                                        if oligo in self.samples_dict[sample]])
-                if self.min_actual_abundance > oligo_actual_abundance:
-                    oligos_for_removal.append(oligo)
-
-            for oligo in oligos_for_removal:
-                self.abundant_oligos.remove(oligo)
-                self._register_removal(oligo, 'failed_A')
+            oligos_for_removal = set(oligos_for_removal)
+            self.abundant_oligos = [oligo for oligo in self.abundant_oligos if oligo not in oligos_for_removal]
 
         self.progress.end()
         self.run.info('num_oligos_after_A_elim', len(self.abundant_oligos))
@@ -652,8 +919,8 @@ class Oligotyping:
         # they entail, it could be set to, say '5', and O#1 would have survived that filter while O#2
         # the crappy oligotype would be filtered out. 
         #
-        # Following function, _get_unique_sequence_distributions_within_abundant_oligos, returns the
-        # dictionary that can be used to do that.
+        # The checkpoint keeps the frequency of the most abundant unique sequence in every oligo,
+        # which can be used to do that.
         #
         # And here is the ugly part about implementing this: This has to be done before the generation
         # of representative sequences. Upto the section where we generate representative sequences,
@@ -668,20 +935,12 @@ class Oligotyping:
 
         self.progress.new('Applying -M parameter')
         if self.min_substantive_abundance:
-            oligos_for_removal = []
-            unique_sequence_distributions = self._get_unique_sequence_distributions_within_abundant_oligos()
-
-            num_abundant_oligos = len(self.abundant_oligos)
+            frequencies = self.checkpoint.most_abundant_unique_frequencies
+            oligos_for_removal = [oligo for oligo in self.abundant_oligos if frequencies[oligo_to_index[oligo]] < self.min_substantive_abundance]
+            self._register_removals(numpy.array([oligo_to_index[oligo] for oligo in oligos_for_removal], dtype = numpy.int64), 'failed_M')
 
-            for i in range(0, num_abundant_oligos):
-                self.progress.update(utils.P(i, num_abundant_oligos))
-                oligo = self.abundant_oligos[i]
-                if max(unique_sequence_distributions[oligo]) < self.min_substantive_abundance:
-                    oligos_for_removal.append(oligo)
-
-            for oligo in oligos_for_removal:
-                self._register_removal(oligo, 'failed_M')
-                self.abundant_oligos.remove(oligo)
+            oligos_for_removal = set(oligos_for_removal)
+            self.abundant_oligos = [oligo for oligo in self.abundant_oligos if oligo not in oligos_for_removal]
 
         self.progress.end()
         self.run.info('num_oligos_after_M_elim', len(self.abundant_oligos))
@@ -689,9 +948,10 @@ class Oligotyping:
 
         # if 'limit_oligotypes_to' is defined, eliminate all other oligotypes
         if self.limit_oligotypes_to:
-            self.abundant_oligos = [oligo for oligo in self.abundant_oligos if oligo in self.limit_oligotypes_to]
+            limit_oligotypes_to = [self.checkpoint.oligo_codec.encode(oligo) for oligo in self.limit_oligotypes_to]
+            self.abundant_oligos = [oligo for oligo in self.abundant_oligos if oligo in limit_oligotypes_to]
             
-            for oligo in [oligo for oligo in self.abundant_oligos if not oligo in self.limit_oligotypes_to]:
+            for oligo in [oligo for oligo in self.abundant_oligos if not oligo in limit_oligotypes_to]:
                 self._register_removal(oligo, 'failed_limit')
             
             self.run.info('num_oligos_after_l_elim', len(self.abundant_oligos))
@@ -701,9 +961,10 @@ class Oligotyping:
 
         # if 'exclude_oligotypes' is defined, remove them from analysis if they are present
         if self.exclude_oligotypes:
-            self.abundant_oligos = [oligo for oligo in self.abundant_oligos if not oligo in self.exclude_oligotypes]
+            exclude_oligotypes = [self.checkpoint.oligo_codec.encode(oligo) for oligo in self.exclude_oligotypes]
+            self.abundant_oligos = [oligo for oligo in self.abundant_oligos if not oligo in exclude_oligotypes]
             
-            for oligo in self.exclude_oligotypes:
+            for oligo in exclude_oligotypes:
                 self._register_removal(oligo, 'excluded')
             
             self.run.info('num_oligos_after_e_elim', len(self.abundant_oligos))
@@ -711,8 +972,7 @@ class Oligotyping:
 
         # storing final counts
         for oligo in self.abundant_oligos:
-            self.final_oligo_counts_dict[oligo] = sum([self.samples_dict[sample][oligo] for sample in self.samples_dict\
-                                                        if oligo in self.samples_dict[sample]])
+            self.final_oligo_counts_dict[oligo] = int(totals[oligo_to_index[oligo]])
 
         # in case no oligos left
         if not len(self.abundant_oligos):
@@ -735,6 +995,7 @@ class Oligotyping:
         samples_dict_copy = copy.deepcopy(self.samples_dict)
         self.progress.append('done')
 
+        abundant_oligos = set(self.abundant_oligos)
         samples_to_remove = []
         for i in range(0, len(self.samples)):
             sample = self.samples[i]
@@ -742,7 +1003,7 @@ class Oligotyping:
             self.progress.update('Analyzing samples: ' + utils.P(i + 1, len(self.samples)))
             
             for oligo in samples_dict_copy[sample]:
-                if oligo not in self.abundant_oligos:
+                if oligo not in abundant_oligos:
                     self.samples_dict[sample].pop(oligo)
             if not self.samples_dict[sample]:
                 samples_to_remove.append(sample)
@@ -763,6 +1024,17 @@ class Oligotyping:
             self.run.info('skip_basic_analyses', self.skip_basic_analyses)
         
 
+    def _decode_oligos(self):
+        # everything after the noise filters reports oligotypes with their bases, so oligo
+        # codes are decoded once here. there are only a few of them left at this point.
+        decode = self.checkpoint.oligo_codec.decode
+
+        self.abundant_oligos = [decode(oligo) for oligo in self.abundant_oligos]
+        self.final_oligo_counts_dict = dict([(decode(oligo), count) for oligo, count in self.final_oligo_counts_dict.items()])
+        for sample in self.samples_dict:
+            self.samples_dict[sample] = dict([(decode(oligo), count) for oligo, count in self.samples_dict[sample].items()])
+
+
     def _generate_FASTA_file(self): 
         # store abundant oligos
         self.progress.new('FASTA File')
@@ -1026,33 +1298,6 @@ class Oligotyping:
         self.run.info('matrix_percent_oligo_sets_file_path', percents_file_path)
 
 
-    def _get_unique_sequence_distributions_within_abundant_oligos(self):
-        # compute and return the unique sequence distribution within per oligo
-        # dictionary. see the explanation where the function is called. oligos
-        # listed in this dictionary MAY NOT be the final oligos once the noise
-        # filtering step has ended.
-
-        temp_unique_distributions = dict(list(zip(self.abundant_oligos, [{} for x in range(0, len(self.abundant_oligos))])))
-
-        self.fasta.reset()
-        while next(self.fasta):
-            if self.progress and self.fasta.pos % 1000 == 0:
-                self.progress.update('Computing sequence distributions: %.2f%%' \
-                                                % (self.fasta.pos * 100.0 / self.fasta.total_seq))
-            oligo = ''.join(self.fasta.seq[o] for o in self.bases_of_interest_locs)
-            if oligo in self.abundant_oligos:
-                try:
-                    temp_unique_distributions[oligo][self.fasta.seq] += 1
-                except KeyError:
-                    temp_unique_distributions[oligo][self.fasta.seq] = 1
-
-        for oligo in self.abundant_oligos:
-            temp_unique_distributions[oligo] = sorted(list(temp_unique_distributions[oligo].values()), reverse = True)
-
-
-        return temp_unique_distributions
-
-
     def _generate_representative_sequences(self):
         # create a fasta file with a representative full length consensus sequence for every oligotype
 
@@ -1063,101 +1308,63 @@ class Oligotyping:
 
         output_directory_for_reps = self.generate_output_destination("OLIGO-REPRESENTATIVES", directory = True)
 
-        fasta_files_dict = {}
-        unique_files_dict = {}
-        for oligo in self.abundant_oligos:
-            if oligo not in fasta_files_dict:
-                try:
-                    fasta_file_path = os.path.join(output_directory_for_reps, '%.5d_' % self.abundant_oligos.index(oligo) + oligo)
-                    fasta_files_dict[oligo] = {'file': open(fasta_file_path, 'w'),
-                                               'path': fasta_file_path}
-                    unique_files_dict[oligo] = {'file': open(fasta_file_path + '_unique', 'w'),
-                                                'path': fasta_file_path + '_unique'}
-                except IOError:
-                    print('\n\t'.join(['',
-                                       'WARNING: Oligotyping process has reached the maximum number of open files',
-                                       'limit defined by the operating system. There are "%d" oligotypes to be'\
-                                                                 % len(self.abundant_oligos),
-                                       'stored. You can learn the actual limit by typing "ulimit -n" in the.run.',
-                                       '',
-                                       'You can increase this limit temporarily by typing "ulimit -n NUMBER", and',
-                                       'restart the process. It seems using %d as NUMBER might be a good start.'\
-                                                                % (len(self.abundant_oligos) * 1.1),
-                                       '',
-                                       'Until this issue is solved, representative sequences are not going to be',
-                                       'computed.',
-                                       '']))
-
-                    # clean after yourself. close every file, delete directory, exit.
-                    [[x.close() for x in [g[o]['file'] for o in g]] for g in [fasta_files_dict, unique_files_dict]]
-                    shutil.rmtree(output_directory_for_reps)
-                    sys.exit()
-
-        self.fasta.reset()
-        while next(self.fasta):
-            if self.fasta.pos % 1000 == 0:
-                self.progress.update('Generating Individual FASTA Files: %.2f%%' \
-                                                % (self.fasta.pos * 100.0 / self.fasta.total_seq))
-            oligo = ''.join(self.fasta.seq[o] for o in self.bases_of_interest_locs)
-            if oligo in self.abundant_oligos:
-                fasta_files_dict[oligo]['file'].write('>%s\n' % (self.fasta.id))
-                fasta_files_dict[oligo]['file'].write('%s\n' % self.fasta.seq)
-        
-        self.progress.end()
-
-        self.progress.new('Representative Sequences')
-        for oligo in self.abundant_oligos:
-            fasta_files_dict[oligo]['file'].close()
+        # unique sequences of every oligotype, and the reads they represent, come from the read
+        # table. so there is no need to go through the alignment, or to unique reads of every
+        # oligotype again.
+        oligo_codes = [self.read_table.oligo_codec.encode(oligo) for oligo in self.abundant_oligos]
+        unique_sequences = self.read_table.get_unique_sequences_of_oligos(oligo_codes)
+        unique_seqs = self.read_table.unique_seqs
 
+        unique_files_dict = {}
+        for i in range(0, len(self.abundant_oligos)):
+            oligo = self.abundant_oligos[i]
+            oligo_unique_sequences = unique_sequences[oligo_codes[i]]
 
             self.progress.update('Unique reads for %s (%d of %d)' \
                                         % (oligo,
-                                           self.abundant_oligos.index(oligo) + 1,
+                                           i + 1,
                                            len(self.abundant_oligos)))
-            fasta_file_path = fasta_files_dict[oligo]['path']
-            fasta = u.SequenceSource(fasta_file_path, lazy_init = False, unique = True)
-          
-            # this dict is going to hold the information of how unique sequences within an oligotype
-            # is distributed among samples:
-            distribution_among_samples = {}
 
-            next(fasta)
-            # this is the first read in the unique reads list, which is the most abundant unique sequence
-            # for the oligotype. so we are going to store it in a dict to generate
-            # representative sequences FASTA file:
-            self.representative_sequences_per_oligotype[oligo] = fasta.seq
-            fasta.reset()
+            fasta_file_path = os.path.join(output_directory_for_reps, '%.5d_' % i + oligo)
+            unique_files_dict[oligo] = {'path': fasta_file_path + '_unique'}
 
+            # all reads of the oligotype, in the order of the alignment
+            read_indices = numpy.sort(numpy.concatenate([r for unique_code, r in oligo_unique_sequences]))
+            read_unique_codes = self.read_table.unique_codes[read_indices]
+            fasta_file = open(fasta_file_path, 'w')
+            for j in range(0, len(read_indices)):
+                fasta_file.write('>%s\n%s\n' % (self.read_table.get_read_id(read_indices[j]), unique_seqs[read_unique_codes[j]]))
+            fasta_file.close()
 
-            # FIXME: I am going to come back to this and fix it at some point. Storing 'distribution_among_samples'
-            # information in separate cPickle files per oligo is not the smartest thing to do.
+            # the first unique sequence is the most abundant unique sequence for the oligotype.
+            # so we are going to store it in a dict to generate representative sequences FASTA file:
+            self.representative_sequences_per_oligotype[oligo] = unique_seqs[oligo_unique_sequences[0][0]]
+
+            # this dict is going to hold the information of how unique sequences within an oligotype
+            # is distributed among samples:
+            distribution_among_samples = {}
+
+            # FIXME: I am going to come back to this and fix it at some point. Storing 'distribution_among_samples'
+            # information in separate cPickle files per oligo is not the smartest thing to do.
             self.final_oligo_unique_distribution_dict[oligo] = []
-            while next(fasta) and fasta.pos <= self.limit_representative_sequences:
-                unique_files_dict[oligo]['file'].write('>%s_%d|freq:%d\n'\
-                                                                     % (oligo,
-                                                                        fasta.pos,
-                                                                        len(fasta.ids)))
-                unique_files_dict[oligo]['file'].write('%s\n' % fasta.seq)
-                
+            unique_file = open(unique_files_dict[oligo]['path'], 'w')
+            for pos in range(1, min(len(oligo_unique_sequences), self.limit_representative_sequences) + 1):
+                unique_code, unique_read_indices = oligo_unique_sequences[pos - 1]
+                unique_file.write('>%s_%d|freq:%d\n' % (oligo, pos, len(unique_read_indices)))
+                unique_file.write('%s\n' % unique_seqs[unique_code])
+
                 # store only the first 20
-                if not fasta.pos > 20:
-                    self.final_oligo_unique_distribution_dict[oligo].append(len(fasta.ids))
+                if not pos > 20:
+                    self.final_oligo_unique_distribution_dict[oligo].append(len(unique_read_indices))
 
-                for sample_id in fasta.ids:
-                    sample_name = utils.get_sample_name_from_defline(sample_id, self.sample_name_separator)
+                for sample_name, count in utils.get_sample_counts(self.sample_codes[unique_read_indices], self.sample_names):
                     if sample_name not in distribution_among_samples:
                         distribution_among_samples[sample_name] = {}
-                    d = distribution_among_samples[sample_name]
-                    if fasta.pos not in d:
-                        d[fasta.pos] = 1
-                    else:
-                        d[fasta.pos] += 1
-                
-            fasta.close()
-            unique_files_dict[oligo]['file'].close()
+                    distribution_among_samples[sample_name][pos] = count
 
-            unique_fasta_path = unique_files_dict[oligo]['path']
-            distribution_among_samples_dict_path = unique_fasta_path + '_distribution.cPickle'
+            unique_file.close()
+
+            distribution_among_samples_dict_path = unique_files_dict[oligo]['path'] + '_distribution.cPickle'
             pickle.dump(distribution_among_samples, open(distribution_among_samples_dict_path, 'wb'))
 
         self.progress.end()
@@ -1175,21 +1382,14 @@ class Oligotyping:
                                                             self.abundant_oligos.index(oligo) + 1,
                                                             len(self.abundant_oligos)))
                     unique_fasta_path = unique_files_dict[oligo]['path']
-                    self._generate_entropy_figure_for_abundant_oligotype(oligo, unique_fasta_path, self.final_oligo_entropy_distribution_dict)
+                    self.final_oligo_entropy_distribution_dict[oligo] = \
+                            self._generate_entropy_figure_for_abundant_oligotype(oligo, unique_fasta_path)
             else:
-                mp = utils.Multiprocessing(self._generate_entropy_figure_for_abundant_oligotype, self.number_of_threads)
-                entropy_per_oligo_shared_dict = mp.get_empty_shared_dict()
+                with utils.Multiprocessing(self._generate_entropy_figure_for_abundant_oligotype, self.number_of_threads) as mp:
+                    processes_to_run = [(oligo, unique_files_dict[oligo]['path']) for oligo in self.abundant_oligos]
+                    entropy_values = mp.map(processes_to_run, self.progress)
 
-                # arrange processes
-                processes_to_run = []
-                for oligo in self.abundant_oligos:
-                    unique_fasta_path = unique_files_dict[oligo]['path']
-                    processes_to_run.append((oligo, unique_fasta_path, entropy_per_oligo_shared_dict),)
-    
-                # start the main loop to run all processes
-                mp.run_processes(processes_to_run, self.progress)
-                
-                self.final_oligo_entropy_distribution_dict = copy.deepcopy(entropy_per_oligo_shared_dict)
+                self.final_oligo_entropy_distribution_dict = dict(zip(self.abundant_oligos, entropy_values))
         self.progress.end()
 
 
@@ -1210,16 +1410,8 @@ class Oligotyping:
                                                                 len(self.abundant_oligos)))
                         self._perform_remote_BLAST_search_for_oligo_representative(oligo, unique_files_dict)
                 else:
-                    mp = utils.Multiprocessing(self._perform_remote_BLAST_search_for_oligo_representative, self.number_of_threads)
-        
-                    # arrange processes
-                    processes_to_run = []
-                    for oligo in self.abundant_oligos:
-                        unique_fasta_path = unique_files_dict[oligo]['path']
-                        processes_to_run.append((oligo, unique_files_dict,),)
-        
-                    # start the main loop to run all processes
-                    mp.run_processes(processes_to_run, self.progress)
+                    with utils.Multiprocessing(self._perform_remote_BLAST_search_for_oligo_representative, self.number_of_threads) as mp:
+                        mp.map([(oligo, unique_files_dict,) for oligo in self.abundant_oligos], self.progress, chunk_size = 1)
             
             self.progress.end()
 
@@ -1328,7 +1520,7 @@ class Oligotyping:
         return True
 
 
-    def _generate_entropy_figure_for_abundant_oligotype(self, oligo, unique_fasta_path, final_oligo_entropy_distribution_dict):
+    def _generate_entropy_figure_for_abundant_oligotype(self, oligo, unique_fasta_path):
         entropy_file_path = unique_fasta_path + '_entropy'
         color_per_column_path  = unique_fasta_path + '_color_per_column.cPickle'
 
@@ -1341,8 +1533,6 @@ class Oligotyping:
         for column, entropy in [x.strip().split('\t') for x in open(entropy_file_path)]:
             entropy_values_per_column[int(column)] = float(entropy)
         
-        final_oligo_entropy_distribution_dict[oligo] = entropy_values_per_column
-            
         color_shade_dict = get_color_shade_dict_for_list_of_values(entropy_values_per_column)
 
         color_per_column = [0] * self.alignment_length
@@ -1350,6 +1540,8 @@ class Oligotyping:
             color_per_column[i] = color_shade_dict[entropy_values_per_column[i]]        
 
         pickle.dump(color_per_column, open(color_per_column_path, 'wb'))
+
+        return entropy_values_per_column
     
 
     def _generate_oligos_across_samples_figure(self):
@@ -0,0 +1,284 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2010 - 2012, A. Murat Eren
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# Please read the COPYING file.
+
+"""Everything oligotyping needs to know about reads, recorded in a single pass.
+
+   Oligotyping used to go through the alignment once to count reads, once to resolve
+   sample names, once to generate oligotypes, once more for the -M filter, and once
+   more to generate representative sequences. ReadTable goes through the alignment
+   once, and keeps for every read
+
+       sample_codes : the index of its sample in sample_names,
+       oligo_indices: the index of its oligotype (bases at locations of interest) in oligos,
+       unique_codes : the index of its sequence in unique_seqs (unique_hashes keeps the
+                      sha1 digest of every unique sequence),
+       kept         : False if the read failed --min-base-quality,
+
+   so later steps are computed from these arrays instead of the alignment. Oligotypes are
+   kept as integer codes (see oligo_codec.py): oligos is the sorted list of distinct codes,
+   and oligo_codec decodes them. A read table for some of the locations of interest can be
+   derived from the one for all of them without going through the alignment again (see
+   get_read_table_of_components)."""
+
+import copy
+import array
+import hashlib
+
+import numpy
+
+from Oligotyping.lib.alignment_cache import get_alignment_source
+from Oligotyping.lib.oligo_codec import get_oligo_codec
+from Oligotyping.lib.oligo_codec import OligoCodecError
+from Oligotyping.utils.utils import get_sample_name_from_defline
+
+
+class ReadTableError(Exception):
+    def __init__(self, e = None):
+        Exception.__init__(self)
+        self.e = e
+        return
+    def __str__(self):
+        return 'Read Table Error: %s' % self.e
+
+
+class ReadTable:
+    def __init__(self, alignment_path, bases_of_interest_locs, sample_name_separator = '_', alignment_cache = None,
+                 quals_dict = None, min_base_quality = None, progress = None):
+        self.alignment_path = alignment_path
+        self.bases_of_interest_locs = bases_of_interest_locs
+        self.sample_name_separator = sample_name_separator
+        self.alignment_cache = alignment_cache
+        self.progress = progress
+
+        self.num_reads = 0
+        # None if reads are not of the same length
+        self.alignment_length = None
+
+        self.sample_codes = None
+        self.sample_names = []
+        self.oligo_codec = None
+        self.oligos = []
+        self.oligo_indices = None
+        self.unique_seqs = []
+        self.unique_hashes = []
+        self.unique_codes = None
+        self.kept = None
+        self.min_base_quality = None
+        self.num_reads_eliminated_due_to_min_base_quality = 0
+
+        # quality scores of bases of interest of every read (0 if a read has none), if there
+        # are quality scores.
+        self.base_qualities = None
+
+        # read IDs are kept only if there is no alignment cache to get them from
+        self.id_blob = None
+        self.id_offsets = None
+
+        self.scan(quals_dict, min_base_quality)
+
+
+    def scan(self, quals_dict = None, min_base_quality = None):
+        seq_to_code = {}
+        sample_name_to_code = {}
+        oligo_bytes = bytearray()
+        unique_codes = array.array('i')
+        sample_codes = array.array('i')
+        kept = bytearray()
+        base_qualities = array.array('h')
+        lengths = set([])
+
+        if not self.alignment_cache:
+            id_blob = bytearray()
+            id_offsets = array.array('q', [0])
+        elif max(self.bases_of_interest_locs) >= self.alignment_cache.alignment_length:
+            raise ReadTableError("Reads in '%s' are shorter than the locations of interest." % self.alignment_path)
+
+        alignment = get_alignment_source(self.alignment_path, self.alignment_cache)
+        while next(alignment):
+            if self.progress and alignment.pos % 1000 == 0:
+                self.progress.update('Analyzing: %d' % alignment.pos)
+
+            seq = alignment.seq
+            lengths.add(len(seq))
+
+            # oligotypes are encoded all at once at the end. with an alignment cache, they
+            # are taken from the encoded alignment.
+            if not self.alignment_cache:
+                try:
+                    oligo_bytes.extend(''.join(seq[o] for o in self.bases_of_interest_locs).encode('ascii'))
+                except IndexError:
+                    raise ReadTableError("Read '%s' is shorter than the locations of interest. Not all reads\
+                                          have the same length." % alignment.id)
+                except UnicodeEncodeError:
+                    raise ReadTableError("Read '%s' has non-ASCII characters at locations of interest." % alignment.id)
+
+            if seq not in seq_to_code:
+                seq_to_code[seq] = len(self.unique_seqs)
+                self.unique_seqs.append(seq)
+                self.unique_hashes.append(hashlib.sha1(seq.encode('utf-8')).hexdigest())
+            unique_codes.append(seq_to_code[seq])
+
+            if not self.alignment_cache:
+                sample = get_sample_name_from_defline(alignment.id, self.sample_name_separator)
+                if sample not in sample_name_to_code:
+                    sample_name_to_code[sample] = len(self.sample_names)
+                    self.sample_names.append(sample)
+                sample_codes.append(sample_name_to_code[sample])
+
+                id_blob.extend(('%s\n' % alignment.id).encode('utf-8'))
+                id_offsets.append(len(id_blob))
+
+            if quals_dict:
+                # every base of interest is tested against --min-base-quality to make sure
+                # that it is above the expected quality score.
+                quality_scores = quals_dict[alignment.id]
+                base_qualities.extend([quality_scores[o] or 0 for o in self.bases_of_interest_locs])
+                quality_scores_of_bases_of_interest = [quality_scores[o] for o in self.bases_of_interest_locs if not quality_scores[o] == None]
+                if min([q for q in quality_scores_of_bases_of_interest if q] or [0]) < min_base_quality:
+                    # FIXME: Discarded reads should be stored somewhere else for further analysis
+                    self.num_reads_eliminated_due_to_min_base_quality += 1
+                    kept.append(0)
+                    continue
+
+            kept.append(1)
+
+        alignment.close()
+
+        self.num_reads = len(unique_codes)
+        if not self.num_reads:
+            raise ReadTableError("There are no reads in '%s'." % self.alignment_path)
+
+        if len(lengths) == 1:
+            self.alignment_length = lengths.pop()
+
+        if self.alignment_cache:
+            columns = self.alignment_cache.matrix[:, self.bases_of_interest_locs]
+        else:
+            columns = numpy.frombuffer(bytes(oligo_bytes), dtype = numpy.uint8).reshape(self.num_reads, -1)
+
+        try:
+            self.oligo_codec = get_oligo_codec(columns)
+            self.oligos, oligo_indices = self.oligo_codec.encode_columns(columns)
+        except OligoCodecError as e:
+            raise ReadTableError(e)
+        self.oligo_indices = oligo_indices.astype(numpy.int32)
+
+        self.unique_codes = numpy.frombuffer(unique_codes, dtype = numpy.int32)
+        self.kept = numpy.frombuffer(bytes(kept), dtype = numpy.uint8).astype(bool)
+
+        if quals_dict:
+            self.min_base_quality = min_base_quality
+            self.base_qualities = numpy.frombuffer(base_qualities, dtype = numpy.int16).reshape(self.num_reads, -1)
+
+        if self.alignment_cache:
+            self.sample_codes, self.sample_names = self.alignment_cache.get_sample_codes(self.sample_name_separator)
+        else:
+            self.sample_codes = numpy.frombuffer(sample_codes, dtype = numpy.int32)
+            self.id_blob = bytes(id_blob)
+            self.id_offsets = numpy.frombuffer(id_offsets, dtype = numpy.int64)
+
+
+    def get_read_table_of_components(self, bases_of_interest_locs):
+        """Returns a read table for some of the locations of interest of this one. Reads, samples
+           and unique sequences are shared with this read table, oligotypes of reads are derived
+           from the ones in this read table, and --min-base-quality is applied to the bases at
+           the new locations of interest."""
+        try:
+            columns_of_locs = [list(self.bases_of_interest_locs).index(l) for l in bases_of_interest_locs]
+        except ValueError:
+            raise ReadTableError("Some of the locations of interest are not in the read table.")
+
+        read_table = copy.copy(self)
+        read_table.bases_of_interest_locs = list(bases_of_interest_locs)
+
+        # every distinct oligotype of this read table gives one oligotype of the new one
+        columns = self.oligo_codec.decode_columns(self.oligos)[:, columns_of_locs]
+        try:
+            read_table.oligo_codec = get_oligo_codec(columns)
+            read_table.oligos, oligo_indices = read_table.oligo_codec.encode_columns(columns)
+        except OligoCodecError as e:
+            raise ReadTableError(e)
+        read_table.oligo_indices = oligo_indices.astype(numpy.int32)[self.oligo_indices]
+
+        if self.base_qualities is not None:
+            # bases with no quality score are not tested, and reads with no quality score for
+            # any base of interest fail, the way they do in scan.
+            base_qualities = self.base_qualities[:, columns_of_locs].astype(numpy.int32)
+            base_qualities[base_qualities == 0] = numpy.iinfo(numpy.int32).max
+            min_base_qualities = base_qualities.min(axis = 1)
+            min_base_qualities[min_base_qualities == numpy.iinfo(numpy.int32).max] = 0
+
+            read_table.base_qualities = self.base_qualities[:, columns_of_locs]
+            read_table.kept = min_base_qualities >= self.min_base_quality
+            read_table.num_reads_eliminated_due_to_min_base_quality = int(self.num_reads - read_table.kept.sum())
+
+        return read_table
+
+
+    def get_read_id(self, read_index):
+        if self.alignment_cache:
+            return self.alignment_cache.get_id(read_index)
+
+        return self.id_blob[self.id_offsets[read_index]:self.id_offsets[read_index + 1] - 1].decode('utf-8')
+
+
+    def get_sample_codes(self, sample_name_separator = '_'):
+        """Returns a tuple of (sample index of every read, sample names), the way alignment
+           caches do (see utils.check_input_alignment)"""
+        if sample_name_separator != self.sample_name_separator:
+            raise ReadTableError("Sample names were resolved with '%s', not '%s'." % (self.sample_name_separator,
+                                                                                     sample_name_separator))
+
+        return (self.sample_codes, self.sample_names)
+
+
+    def get_frequencies_of_most_abundant_unique_sequences(self):
+        """Returns an array that keeps the frequency of the most abundant unique sequence
+           of every oligo in self.oligos (all reads are considered, including the ones that
+           failed --min-base-quality)."""
+        keys = self.oligo_indices.astype(numpy.int64) * len(self.unique_seqs) + self.unique_codes
+        keys, frequencies = numpy.unique(keys, return_counts = True)
+
+        most_abundant = numpy.zeros(len(self.oligos), dtype = numpy.int64)
+        numpy.maximum.at(most_abundant, keys // len(self.unique_seqs), frequencies)
+
+        return most_abundant
+
+
+    def get_unique_sequences_of_oligos(self, oligos):
+        """Returns a dictionary of oligo code -> list of (unique code, indices of reads) tuples for
+           every oligo code in `oligos`. Unique sequences of every oligo are in the order SequenceSource(unique =
+           True) would give them for a FASTA file of its reads (by frequency, and then by the sha1
+           digest of the sequence), and indices of reads are in the order of the alignment."""
+        oligo_to_index = dict([(self.oligos[index], index) for index in range(0, len(self.oligos))])
+        indices = [oligo_to_index[oligo] for oligo in oligos if oligo in oligo_to_index]
+
+        selected = numpy.zeros(len(self.oligos), dtype = bool)
+        selected[indices] = True
+        read_indices = numpy.flatnonzero(selected[self.oligo_indices])
+
+        # reads grouped by oligo and then by unique sequence. sorting is stable, so reads
+        # in every group are in the order of the alignment.
+        read_indices = read_indices[numpy.lexsort((self.unique_codes[read_indices], self.oligo_indices[read_indices]))]
+        keys = self.oligo_indices[read_indices].astype(numpy.int64) * len(self.unique_seqs) + self.unique_codes[read_indices]
+        starts = numpy.flatnonzero(numpy.concatenate(([True], keys[1:] != keys[:-1])))
+        ends = numpy.append(starts[1:], len(read_indices))
+
+        unique_sequences = dict([(oligo, []) for oligo in oligos])
+        for start, end in zip(starts.tolist(), ends.tolist()):
+            read_index = read_indices[start]
+            unique_sequences[self.oligos[self.oligo_indices[read_index]]].append((int(self.unique_codes[read_index]),
+                                                                                read_indices[start:end]))
+
+        for oligo in unique_sequences:
+            unique_sequences[oligo].sort(key = lambda u: (len(u[1]), self.unique_hashes[u[0]]), reverse = True)
+
+        return unique_sequences
@@ -14,11 +14,311 @@ import numpy
 import operator
 
 from Oligotyping.lib import fastalib as u
-from Oligotyping.lib.entropy import entropy
+from Oligotyping.lib.entropy import encode_sequences
+from Oligotyping.lib.entropy import get_base_counts
+from Oligotyping.lib.entropy import get_column_entropies
 from Oligotyping.utils.utils import ConfigError
+from Oligotyping.utils.utils import UniqueFASTAEntry
+
+
+# base counts of a node (an alignment length x NUM_CODES matrix, see entropy.get_base_counts)
+# are kept only if the node has at least this many unique reads. for smaller nodes counting
+# bases again is cheaper than keeping counts in memory.
+MIN_READS_TO_KEEP_BASE_COUNTS = 2048
+
+# number of cells of read matrices that are compared to representatives at once.
+COMPARISON_CHUNK_SIZE = 2 ** 22
+
+GAP = ord('-')
+
+
+def strip_gaps(matrix):
+    """Returns a copy of a read matrix in which every row starts with the sequence without
+       gaps (gaps are moved to the end of the row), and the length of every sequence without
+       gaps."""
+    not_gaps = matrix != GAP
+    order = numpy.argsort(~not_gaps, axis = 1, kind = 'stable')
+    return (numpy.take_along_axis(matrix, order, axis = 1), not_gaps.sum(axis = 1))
+
+
+def get_max_edit_distances(lengths, min_percent_identity):
+    """Returns the largest number of edits sequences of `lengths` can have and still be as
+       similar as min_percent_identity (with the rounding blast.LocalBLAST.get_results_dict
+       uses), or -1 if none."""
+    lengths = numpy.maximum(numpy.asarray(lengths, dtype = numpy.int64), 1)
+    threshold = round(min_percent_identity, 1)
+
+    max_distances = numpy.ceil(lengths * (100.0 - threshold) / 100.0).astype(numpy.int64) + 1
+    while True:
+        too_many = (max_distances >= 0) & (numpy.round((lengths - max_distances) * 100.0 / lengths, 1) < threshold)
+        if not too_many.any():
+            return max_distances
+        max_distances[too_many] -= 1
+
+
+def get_percent_identities(lengths, distances):
+    """Percent identity of two sequences that are `distances` edits apart, where `lengths` is
+       the length of the longer one. This is what BLAST reports for an alignment of the two
+       from end to end."""
+    lengths = numpy.maximum(numpy.asarray(lengths, dtype = numpy.int64), 1)
+    return (lengths - distances) * 100.0 / lengths
+
+
+def get_edit_distances(seqs_1, lengths_1, seqs_2, lengths_2, max_distances):
+    """Returns edit (Levenshtein) distances between sequences in rows of seqs_1 and seqs_2
+       (read matrices without gaps, see strip_gaps), of lengths lengths_1 and lengths_2. Only
+       alignments that stay within max_distances[i] of the diagonal are considered, so a
+       distance that is larger than max_distances[i] is reported as max_distances[i] + 1.
+       Pairs are aligned together, one row of the banded dynamic programming matrix at a
+       time."""
+    lengths_1 = numpy.asarray(lengths_1, dtype = numpy.int64)
+    lengths_2 = numpy.asarray(lengths_2, dtype = numpy.int64)
+    max_distances = numpy.maximum(numpy.asarray(max_distances, dtype = numpy.int64), 0)
+    distances = max_distances + 1
+
+    num_pairs = len(lengths_1)
+    if not num_pairs:
+        return distances
+
+    band = int(max_distances.max())
+    width = 2 * band + 1
+    num_pairs_per_chunk = max(COMPARISON_CHUNK_SIZE // ((max(seqs_1.shape[1], seqs_2.shape[1]) + width) * 4), 1)
+
+    for start in range(0, num_pairs, num_pairs_per_chunk):
+        end = min(start + num_pairs_per_chunk, num_pairs)
+        distances[start:end] = get_edit_distances_of_chunk(seqs_1[start:end], lengths_1[start:end],
+                                                           seqs_2[start:end], lengths_2[start:end],
+                                                           max_distances[start:end], band)
+
+    return distances
+
+
+def get_edit_distances_of_chunk(seqs_1, lengths_1, seqs_2, lengths_2, max_distances, band):
+    num_pairs = len(lengths_1)
+    width = 2 * band + 1
+    infinity = numpy.int32(seqs_1.shape[1] + seqs_2.shape[1] + width)
+    distances = max_distances + 1
+
+    # every cell of a row is a diagonal of the dynamic programming matrix: the cell in column
+    # c of row i compares the first i characters of seqs_1 to the first i + c - band characters
+    # of seqs_2. seqs_2 is padded with `band` columns on both sides, so characters of seqs_2
+    # that are compared to the character i of seqs_1 are in columns i to i + width.
+    padded = numpy.zeros((num_pairs, max(seqs_1.shape[1], seqs_2.shape[1]) + width + band), dtype = numpy.uint8)
+    padded[:, band:band + seqs_2.shape[1]] = seqs_2
+
+    offsets = numpy.arange(-band, band + 1)
+    row = numpy.tile(numpy.where(offsets >= 0, offsets, infinity).astype(numpy.int32), (num_pairs, 1))
+
+    # distances of pairs can be read from the row of the last character of seqs_1, unless
+    # lengths are too different to be in the band.
+    end_columns = lengths_2 - lengths_1 + band
+    in_band = (end_columns >= 0) & (end_columns < width)
+    done = ~in_band
+
+    ending = numpy.flatnonzero(in_band & (lengths_1 == 0))
+    distances[ending] = numpy.minimum(row[ending, end_columns[ending]], max_distances[ending] + 1)
+
+    for i in range(1, int(lengths_1.max()) + 1):
+        previous = row
+        row = previous + (padded[:, i - 1:i - 1 + width] != seqs_1[:, i - 1:i])
+        numpy.minimum(row[:, :-1], previous[:, 1:] + 1, out = row[:, :-1])
+        if i < band:
+            row[:, :band - i] = infinity
+        for c in range(1, width):
+            numpy.minimum(row[:, c], row[:, c - 1] + 1, out = row[:, c])
+
+        ending = numpy.flatnonzero(in_band & (lengths_1 == i))
+        if len(ending):
+            distances[ending] = numpy.minimum(row[ending, end_columns[ending]], max_distances[ending] + 1)
+            done[ending] = True
+
+        # the smallest distance in a row never decreases in the next one
+        if i % 32 == 0:
+            done |= row.min(axis = 1) > max_distances
+            if done.all():
+                break
+
+    return distances
+
+
+def get_percent_identities_to_representatives(read_matrices, min_percent_identity):
+    """Takes a list of read matrices (one for every node, with the representative sequence of
+       the node in the first row), and returns an array of percent identities of reads to the
+       representative sequence for each of them. Reads are compared to the representative
+       without gaps, so an in/del counts as a single difference no matter how columns after it
+       are aligned (see get_edit_distances and get_percent_identities). Identities are exact
+       as long as they are not below min_percent_identity.
+
+       Differences between a read and the representative column by column in the alignment
+       are an upper bound for their edit distance, and the difference of their lengths is a
+       lower bound, so most reads are not aligned at all. Differences are counted for small
+       matrices together in batches."""
+    differences = [None] * len(read_matrices)
+
+    def compare(batch):
+        matrix = numpy.concatenate([read_matrices[i][start:end] for i, start, end in batch])
+        representatives = numpy.repeat(numpy.array([read_matrices[i][0] for i, start, end in batch]),
+                                       [end - start for i, start, end in batch], axis = 0)
+
+        batch_differences = ((matrix != representatives) & ((matrix != GAP) | (representatives != GAP))).sum(axis = 1)
+
+        offset = 0
+        for i, start, end in batch:
+            differences[i][start:end] = batch_differences[offset:offset + end - start]
+            offset += end - start
+
+    batch, num_cells = [], 0
+    for i in range(0, len(read_matrices)):
+        num_reads, alignment_length = read_matrices[i].shape
+        differences[i] = numpy.zeros(num_reads, dtype = numpy.int64)
+
+        num_reads_per_chunk = max(COMPARISON_CHUNK_SIZE // max(alignment_length, 1), 1)
+        for start in range(0, num_reads, num_reads_per_chunk):
+            end = min(start + num_reads_per_chunk, num_reads)
+            batch.append((i, start, end))
+            num_cells += (end - start) * alignment_length
+
+            if num_cells >= COMPARISON_CHUNK_SIZE:
+                compare(batch)
+                batch, num_cells = [], 0
+
+    if batch:
+        compare(batch)
+
+    # edit distances start from differences, and reads for which the two bounds are not the
+    # same are aligned to the representative. distances of reads that are not as similar as
+    # min_percent_identity are not computed exactly, but they are never smaller than the
+    # ones that are.
+    distances = differences
+    longer_lengths = [None] * len(read_matrices)
+    alignments = []
+    for i in range(0, len(read_matrices)):
+        if not len(read_matrices[i]):
+            longer_lengths[i] = numpy.zeros(0, dtype = numpy.int64)
+            continue
+
+        seqs, lengths = strip_gaps(read_matrices[i])
+        longer_lengths[i] = numpy.maximum(lengths, lengths[0])
+
+        max_distances = numpy.minimum(distances[i], get_max_edit_distances(longer_lengths[i], min_percent_identity))
+        rows = numpy.flatnonzero(distances[i] > numpy.abs(lengths - lengths[0]))
+        if len(rows):
+            alignments.append((i, rows, seqs[rows], lengths[rows], numpy.repeat(seqs[:1], len(rows), axis = 0),
+                               numpy.repeat(lengths[:1], len(rows)), max_distances[rows]))
+
+    if alignments:
+        edit_distances = get_edit_distances(*[numpy.concatenate([a[j] for a in alignments]) for j in range(2, 7)])
+        offset = 0
+        for alignment in alignments:
+            i, rows = alignment[0], alignment[1]
+            distances[i][rows] = edit_distances[offset:offset + len(rows)]
+            offset += len(rows)
+
+    return [get_percent_identities(longer_lengths[i], distances[i]) for i in range(0, len(read_matrices))]
+
+
+class RepresentativeIndex:
+    """An in-memory index of aligned representative sequences of nodes to find the closest
+       node for reads. Percent identities are computed from edit distances the same way
+       get_percent_identities_to_representatives does, but a read is aligned to a
+       representative only if bounds of their distance can not tell whether it is the
+       closest one. Characters are one-hot encoded, so differences column by column between
+       every read and every representative (an upper bound) and character counts of every
+       read (which give a lower bound) are computed with matrix products (which NumPy runs on
+       multiple cores if it is linked to a multi-threaded BLAS)."""
+    def __init__(self, node_ids, representative_seqs):
+        self.node_ids = list(node_ids)
+        matrix = encode_sequences(representative_seqs)
+
+        self.alignment_length = matrix.shape[1]
+        self.alphabet = [c for c in numpy.unique(matrix) if c != GAP]
+        self.representatives = self.get_one_hot_matrix(matrix)
+        self.representative_gaps = (matrix == GAP).astype(numpy.float32)
+        self.representative_counts = self.get_counts(self.representatives)
+        self.representative_seqs, self.representative_lengths = strip_gaps(matrix)
+
+
+    def get_one_hot_matrix(self, matrix):
+        return numpy.hstack([(matrix == c) for c in self.alphabet]).astype(numpy.float32)
+
+
+    def get_counts(self, one_hot_matrix):
+        counts = one_hot_matrix.reshape(len(one_hot_matrix), len(self.alphabet), self.alignment_length).sum(axis = 2)
+        return numpy.rint(counts).astype(numpy.int64)
+
+
+    def search(self, read_matrix, min_percent_identity):
+        """Returns the index of the closest representative (in self.node_ids) for every row of
+           read_matrix, and its percent identity to the read. Index is -1 for reads that are
+           not as similar as min_percent_identity to any of the representatives (percent
+           identities of these reads are not exact). Ties are resolved in favor of the
+           representative that comes first."""
+        if read_matrix.shape[1] != self.alignment_length:
+            raise ConfigError("Reads (%d) and representatives (%d) are not of the same length" \
+                                                % (read_matrix.shape[1], self.alignment_length))
+
+        num_reads = len(read_matrix)
+        closest = numpy.zeros(num_reads, dtype = numpy.int64) - 1
+        percent_identities = numpy.zeros(num_reads)
+
+        if not num_reads or not len(self.node_ids):
+            return closest, percent_identities
+
+        read_seqs, read_lengths = strip_gaps(read_matrix)
+        num_pairs_per_alignment = max(COMPARISON_CHUNK_SIZE // max(self.alignment_length, 1), 1)
+
+        num_reads_per_chunk = max(COMPARISON_CHUNK_SIZE // max(len(self.node_ids), 1), 1)
+        for start in range(0, num_reads, num_reads_per_chunk):
+            reads = read_matrix[start:start + num_reads_per_chunk]
+            lengths = read_lengths[start:start + len(reads)]
+            one_hot_matrix = self.get_one_hot_matrix(reads)
+
+            # counts are exact in float32.
+            matches = one_hot_matrix.dot(self.representatives.T)
+            shared_gaps = (reads == GAP).astype(numpy.float32).dot(self.representative_gaps.T)
+            upper_bounds = numpy.rint(self.alignment_length - shared_gaps - matches).astype(numpy.int64)
+
+            # every edit changes counts of at most one character in each sequence, so the
+            # number of characters a read has more than a representative (or the other way
+            # around) is a lower bound. characters that are not in the alphabet of
+            # representatives are all extra.
+            counts = self.get_counts(one_hot_matrix)
+            extra = numpy.zeros(upper_bounds.shape, dtype = numpy.int64) + (lengths - counts.sum(axis = 1))[:, None]
+            for c in range(0, len(self.alphabet)):
+                extra += numpy.maximum(counts[:, c][:, None] - self.representative_counts[:, c][None, :], 0)
+            lower_bounds = numpy.maximum(extra, extra - lengths[:, None] + self.representative_lengths[None, :])
+
+            longer_lengths = numpy.maximum(lengths[:, None], self.representative_lengths[None, :])
+            max_distances = numpy.minimum(upper_bounds, get_max_edit_distances(longer_lengths, min_percent_identity))
+
+            # a representative can not be the closest one if it is not as similar to the read as
+            # min_percent_identity, or if it is less similar than another one is at least.
+            best_lower_bounds = get_percent_identities(longer_lengths, upper_bounds).max(axis = 1)
+            candidates = (lower_bounds <= max_distances) & \
+                         (get_percent_identities(longer_lengths, lower_bounds) >= best_lower_bounds[:, None])
+
+            distances = upper_bounds
+            rows, columns = numpy.nonzero(candidates & (lower_bounds < upper_bounds))
+            for i in range(0, len(rows), num_pairs_per_alignment):
+                r, c = rows[i:i + num_pairs_per_alignment], columns[i:i + num_pairs_per_alignment]
+                distances[r, c] = get_edit_distances(read_seqs[start + r], lengths[r],
+                                                     self.representative_seqs[c], self.representative_lengths[c],
+                                                     max_distances[r, c])
+
+            identities = get_percent_identities(longer_lengths, distances)
+
+            best = identities.argmax(axis = 1)
+            best_identities = identities[numpy.arange(len(reads)), best]
+
+            hits = numpy.round(best_identities, 1) >= round(min_percent_identity, 1)
+            closest[start:start + len(reads)] = numpy.where(hits, best, -1)
+            percent_identities[start:start + len(reads)] = best_identities
+
+        return closest, percent_identities
+
 
 class Topology:
-    def __init__(self, nodes_output_directory = None):
+    def __init__(self, nodes_output_directory = None, read_store = None):
         self.nodes = {}
         self.alive_nodes = []
         self.zombie_nodes = []
@@ -29,7 +329,12 @@ class Topology:
         self.standby_bin = []
 
         self.nodes_output_directory = nodes_output_directory
-        
+
+        # unique reads of the alignment (see unique_reads.UniqueReadStore). nodes and outliers
+        # keep indices of their unique reads in the store.
+        self.read_store = read_store
+
+        # reason -> sorted array of indices of unique reads that are outliers for the reason
         self.outliers = {}
         self.outlier_reasons = []
         self.next_available_node_id = None
@@ -52,14 +357,26 @@ class Topology:
         return '%.9d' % new_node_id
 
 
-    def add_new_node(self, node_id, unique_read_objects_list, root = False, parent_id = None):
+    def add_new_node(self, node_id, unique_read_indices, root = False, parent_id = None, read_matrix = None, frequencies = None, base_counts = None, skip_entropy = False):
+        """Adds a new node with unique reads `unique_read_indices` (indices in self.read_store)
+           to the topology. `read_matrix`, `frequencies` and `base_counts` of the new node can
+           be passed if they are already known (i.e., when the new node is a part of a
+           decomposed node, see Node.get_partition_base_counts), so they are not taken from
+           the store again. See Node.refresh for `skip_entropy`."""
         if not self.nodes_output_directory:
             raise ConfigError("Nodes output directory has to be declared before adding new nodes")
 
-        node = Node(node_id, self.nodes_output_directory)
+        if self.read_store is None:
+            raise ConfigError("Unique read store has to be declared before adding new nodes")
 
-        node.reads = unique_read_objects_list
-        node.size = sum([read.frequency for read in node.reads])
+        node = Node(node_id, self.nodes_output_directory, self.read_store)
+
+        node.unique_read_indices = numpy.asarray(unique_read_indices, dtype = numpy.int32)
+        if read_matrix is not None:
+            node.read_matrix = read_matrix
+            node.frequencies = frequencies
+            node.set_base_counts(base_counts)
+        node.size = self.read_store.get_size(node.unique_read_indices)
         node.pretty_id = self.get_pretty_id(node_id)
 
         if parent_id:
@@ -68,19 +385,19 @@ class Topology:
             node.level = parent.level + 1
             node.parent = parent.node_id
 
-        node.refresh()
+        node.refresh(skip_entropy = skip_entropy)
 
         if root:
             # things to initialize if this is the root node
             node.level = 0
 
-            self.frequency_of_the_most_abundant_read = max([read.frequency for read in node.reads])
-            self.alignment_length = len(node.reads[0].seq)
+            self.frequency_of_the_most_abundant_read = int(node.frequencies.max())
+            self.alignment_length = self.read_store.alignment_length
             
             # store the average read length. this is a terrible approximation,
             # but it is way better to go through all reads which are most probably
             # have the same length anyway (or minus/plus 2-3 nt at worst).
-            self.average_read_length = len(node.reads[0].seq.replace('-', ''))
+            self.average_read_length = len(node.representative_seq.replace('-', ''))
 
         self.nodes[node_id] = node
 
@@ -115,7 +432,7 @@ class Topology:
 
 
     def get_final_count(self):
-        return sum([sum([read.frequency for read in self.nodes[node_id].reads]) for node_id in self.final_nodes])
+        return sum([self.read_store.get_size(self.nodes[node_id].unique_read_indices) for node_id in self.final_nodes])
             
 
     def get_siblings(self, node_id):
@@ -149,8 +466,7 @@ class Topology:
         parent.size -= node.size
 
         if store_content_in_outliers_dict:
-            for read in node.reads:
-                self.store_outlier(read, reason)
+            self.store_outliers(node.unique_read_indices, reason)
 
         # get rid of node files.
         self.remove_node_files(node_id)
@@ -163,12 +479,22 @@ class Topology:
             self.remove_node(parent.node_id)
 
 
-    def store_outlier(self, unique_read_object, reason = 'unknown_reason'):
+    def store_outliers(self, unique_read_indices, reason = 'unknown_reason'):
         if reason not in self.outlier_reasons:
             self.outlier_reasons.append(reason)
-            self.outliers[reason] = set([])
+            self.outliers[reason] = numpy.zeros(0, dtype = numpy.int32)
             
-        self.outliers[reason].add(unique_read_object)
+        self.outliers[reason] = numpy.union1d(self.outliers[reason], unique_read_indices).astype(numpy.int32)
+
+
+    def remove_outliers(self, unique_read_indices, reason):
+        """Takes unique reads out of the outliers bin of `reason` (i.e., to relocate them)"""
+        self.outliers[reason] = numpy.setdiff1d(self.outliers[reason], unique_read_indices, assume_unique = True).astype(numpy.int32)
+
+
+    def get_num_outliers(self, reason):
+        """Returns the number of reads that are outliers for `reason`"""
+        return self.read_store.get_size(self.outliers[reason])
 
 
     def remove_node_files(self, node_id):
@@ -190,8 +516,8 @@ class Topology:
         absorber_parent = self.get_node(absorber.parent)
         absorbed_parent = self.get_node(absorbed.parent)
         
-        # append read objects of absorbed to absorber:
-        absorber.reads += absorbed.reads
+        # append unique reads of absorbed to absorber:
+        absorber.unique_read_indices = numpy.concatenate((absorber.unique_read_indices, absorbed.unique_read_indices))
         absorber.dirty = True
         
         # remove absorbed from the topology
@@ -278,25 +604,37 @@ class Topology:
         return distance_node_tuples[0][1]
 
 
-    def relocate_outlier(self, outlier_read_object, target_node_id, original_removal_reason):
+    def relocate_outliers(self, unique_read_indices, target_node_ids, original_removal_reason):
         '''
-            add an outlier read to an existing node (target_node_id).
+            add outlier reads to existing nodes (unique_read_indices[i] goes to target_node_ids[i]).
                                                                         '''
-        node = self.nodes[target_node_id]
-        
-        # update node alignment file with the outlier
-        node.reads.append(outlier_read_object)
-        node.dirty = True
-        
-        # remove outlier from outliers object
-        self.outliers[original_removal_reason].remove(outlier_read_object)
+        unique_read_indices = numpy.asarray(unique_read_indices, dtype = numpy.int32)
+        target_node_ids = numpy.asarray(target_node_ids)
+
+        for target_node_id in numpy.unique(target_node_ids).tolist():
+            node = self.nodes[target_node_id]
+
+            # update node with outliers (in the order they come)
+            node.unique_read_indices = numpy.concatenate((node.unique_read_indices,
+                                                          unique_read_indices[target_node_ids == target_node_id]))
+            node.dirty = True
+
+        # remove outliers from outliers object
+        self.remove_outliers(unique_read_indices, original_removal_reason)
         
 
 class Node:
-    def __init__(self, node_id, output_directory):
+    def __init__(self, node_id, output_directory, read_store = None):
         self.node_id            = node_id
         self.pretty_id          = None
-        self.reads              = []
+        self.read_store         = read_store
+        # indices of unique reads of the node in the read store (most abundant first)
+        self.unique_read_indices = numpy.zeros(0, dtype = numpy.int32)
+        # reads encoded into a uint8 matrix (one row per unique read, in the order
+        # of self.unique_read_indices) and their frequencies. see encode_reads.
+        self.read_matrix        = None
+        self.frequencies        = None
+        self.base_counts        = None
         self.representative_seq = None
         self.killed             = False
         self.dirty              = False
@@ -327,25 +665,93 @@ class Node:
 
 
     def set_representative(self):
-        self.reads.sort(key=lambda x: x.frequency, reverse = True)
-        self.representative_seq = self.reads[0].seq
+        # unique reads with the same frequency stay in the order they are in
+        order = numpy.argsort(-self.read_store.frequencies[self.unique_read_indices], kind = 'stable')
 
+        if (order != numpy.arange(0, len(order))).any():
+            self.unique_read_indices = self.unique_read_indices[order]
 
-    def do_entropy(self):
-        self.entropy_tpls = []
-        for position in range(0, len(self.representative_seq)):
-            column = ''.join([read.seq[position] * read.frequency for read in self.reads])
-            
-            if len(set(column)) == 1:
-                self.entropy_tpls.append((position, 0.0),)
-            else:
-                e = entropy(column)
+            # keep rows of the read matrix in the same order with unique reads
+            if self.read_matrix is not None and not self.dirty and len(self.read_matrix) == len(order):
+                self.read_matrix = self.read_matrix[order]
+                self.frequencies = self.frequencies[order]
 
-                if e < 0.00001:
-                    self.entropy_tpls.append((position, 0.0),)
-                else:
-                    self.entropy_tpls.append((position, e),)
+        self.representative_seq = self.read_store.get_seq(self.unique_read_indices[0])
+
+
+    def encode_reads(self):
+        # rows are taken from the store, sequences are never encoded again
+        self.read_matrix = self.read_store.matrix[self.unique_read_indices]
+        self.frequencies = self.read_store.frequencies[self.unique_read_indices].astype(numpy.int64)
+        self.base_counts = None
+
+
+    def get_read_matrix(self):
+        """Returns the read matrix of the node, after encoding reads again if they have changed"""
+        if self.dirty or self.read_matrix is None or len(self.read_matrix) != len(self.unique_read_indices):
+            self.encode_reads()
 
+        return self.read_matrix
+
+
+    def forget_read_matrix(self):
+        # reads of a node that is decomposed are passed to its children. there is no
+        # need to keep a copy of them around.
+        self.read_matrix = None
+        self.frequencies = None
+        self.base_counts = None
+
+
+    def set_base_counts(self, base_counts):
+        if base_counts is not None and len(self.read_matrix) >= MIN_READS_TO_KEEP_BASE_COUNTS:
+            self.base_counts = base_counts
+        else:
+            self.base_counts = None
+
+
+    def get_base_counts(self):
+        if self.base_counts is not None:
+            return self.base_counts
+
+        if self.read_matrix is None:
+            self.encode_reads()
+
+        base_counts = get_base_counts(self.read_matrix, self.frequencies)
+        self.set_base_counts(base_counts)
+
+        return base_counts
+
+
+    def get_partition_base_counts(self, partition):
+        """Returns base counts for every part of a partition of the reads in this node (a list
+           of arrays of row indices in self.read_matrix). Only rows that go into a part are
+           counted, and the largest part gets what is left from the base counts of this node
+           after the others are subtracted (if base counts of the node are already known)."""
+        base_counts_list = [None] * len(partition)
+
+        largest = max(range(0, len(partition)), key = lambda i: len(partition[i]))
+
+        for i in range(0, len(partition)):
+            if i == largest and self.base_counts is not None:
+                continue
+
+            base_counts_list[i] = get_base_counts(self.read_matrix[partition[i]], self.frequencies[partition[i]])
+
+        if base_counts_list[largest] is None:
+            base_counts_list[largest] = self.base_counts.copy()
+            for i in range(0, len(partition)):
+                if i != largest:
+                    base_counts_list[largest] -= base_counts_list[i]
+
+        return base_counts_list
+
+
+    def do_entropy(self):
+        # every unique read is counted as many times as its frequency, instead of
+        # building a column string with `frequency` copies of every base.
+        column_entropies = get_column_entropies(self.get_base_counts())
+
+        self.entropy_tpls = list(enumerate(column_entropies.tolist()))
         self.entropy = [t[1] for t in self.entropy_tpls]
         self.entropy_tpls = sorted(self.entropy_tpls, key=operator.itemgetter(1), reverse=True)
         self.max_entropy = max(self.entropy)
@@ -364,30 +770,47 @@ class Node:
 
 
     def do_competing_unique_sequences_ratio_and_density(self):
-        if len(self.reads) == 1:
+        # frequencies are in the same order with reads (most abundant first)
+        if len(self.frequencies) == 1:
             self.competing_unique_sequences_ratio = 0
         else:
-            self.competing_unique_sequences_ratio = self.reads[1].frequency * 1.0 / self.reads[0].frequency
+            self.competing_unique_sequences_ratio = int(self.frequencies[1]) * 1.0 / int(self.frequencies[0])
                     
-        self.density = self.reads[0].frequency * 1.0 / self.size
+        self.density = int(self.frequencies[0]) * 1.0 / self.size
 
 
-    def refresh(self):
+    def refresh(self, skip_entropy = False):
+        """Updates the representative sequence, size, entropy and density of the node after
+           its reads change. If `skip_entropy` is True, entropy is left to be computed later
+           (i.e., by a worker process, see Decomposer._analyze_nodes_in_parallel)."""
         self.set_representative()
-        self.size = sum([read.frequency for read in self.reads])
-        self.do_entropy()
+        if self.dirty or self.read_matrix is None or len(self.read_matrix) != len(self.unique_read_indices):
+            self.encode_reads()
+        self.size = self.read_store.get_size(self.unique_read_indices)
+        if skip_entropy:
+            self.entropy = None
+        else:
+            self.do_entropy()
         self.do_competing_unique_sequences_ratio_and_density()
         self.dirty = False
 
 
+    def get_unique_read_objects(self):
+        """Returns unique reads of the node as utils.UniqueFASTAEntry objects"""
+        return [UniqueFASTAEntry(self.read_store.get_seq(i), self.read_store.get_ids(i)) for i in self.unique_read_indices.tolist()]
+
+
     def store(self):
+        # sequences and read IDs are resolved through the store only here
         alignment = open(self.alignment_path, 'w')
-        for read in self.reads:
-            for read_id in read.ids:
-                alignment.write('>%s\n%s\n' % (read_id, read.seq))
+        for i in self.unique_read_indices.tolist():
+            seq = self.read_store.get_seq(i)
+            for read_id in self.read_store.get_ids(i):
+                alignment.write('>%s\n%s\n' % (read_id, seq))
         alignment.close()
 
         unique_alignment = open(self.unique_alignment_path, 'w')
-        for read in self.reads:
-            unique_alignment.write('>%s|frequency:%d\n%s\n' % (read.ids[0], read.frequency, read.seq))
+        for i in self.unique_read_indices.tolist():
+            read_ids = self.read_store.get_ids(i)
+            unique_alignment.write('>%s|frequency:%d\n%s\n' % (read_ids[0], len(read_ids), self.read_store.get_seq(i)))
         unique_alignment.close()
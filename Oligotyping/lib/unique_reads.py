@@ -0,0 +1,369 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2010 - 2012, A. Murat Eren
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# Please read the COPYING file.
+
+"""Unique reads of an alignment in a few flat arrays.
+
+   A list of utils.UniqueFASTAEntry objects keeps a Python string for every unique
+   sequence, a list of Python strings for read IDs, and an md5 digest for every unique
+   read. UniqueReadStore keeps the same information in
+
+       matrix             : U x L uint8 matrix of unique sequences (most abundant first),
+       frequencies        : number of reads for every unique sequence,
+       read_indices       : indices of reads in the alignment, grouped by unique sequence,
+       read_index_offsets : U + 1 offsets of these groups in read_indices,
+       id_blob            : read IDs (in the order of the alignment) separated by new lines,
+       id_offsets         : N + 1 byte offsets of read IDs in id_blob.
+
+   When the store is generated from an alignment cache, id_blob and id_offsets are the
+   memory-mapped files of the cache. A unique read is its row in the store: nodes of the
+   topology keep arrays of these indices (see topology.Node), and sequences, read IDs and
+   md5 digests (which are computed the first time they are asked for, and kept in the
+   store) are resolved through the store only when they are written out."""
+
+import os
+import array
+import hashlib
+import zipfile
+
+import numpy
+
+import Oligotyping.lib.fastalib as u
+from Oligotyping.lib.dereplication import DEFAULT_MEMORY_BUDGET
+from Oligotyping.lib.dereplication import MEMORY_PER_INPUT_BYTE
+from Oligotyping.lib.dereplication import DereplicatedSequenceSource
+from Oligotyping.utils.utils import get_sample_codes
+
+
+# suffix of the unique reads cache that is stored next to the alignment
+CACHE_SUFFIX = '.unique-reads.npz'
+
+# version of the file format of UniqueReadStore.save
+STORE_VERSION = 1
+
+
+class UniqueReadStoreError(Exception):
+    def __init__(self, e = None):
+        Exception.__init__(self)
+        self.e = e
+        return
+    def __str__(self):
+        return 'Unique Read Store Error: %s' % self.e
+
+
+class UniqueReadStore:
+    def __init__(self, matrix, frequencies, read_indices, read_index_offsets, id_blob, id_offsets, alignment_cache = None):
+        """Takes unique sequences that are already in the order of SequenceSource(unique = True).
+           See from_unique_indices to generate a store from unique sequences in any order."""
+        self.matrix = matrix
+        self.frequencies = frequencies
+        self.read_indices = read_indices
+        self.read_index_offsets = read_index_offsets
+        self.id_blob = id_blob
+        self.id_offsets = id_offsets
+        self.alignment_cache = alignment_cache
+
+        # sample_name_separator -> (sample codes, sample names)
+        self.sample_codes = {}
+
+        # md5 digests of unique sequences, see get_md5id
+        self.md5ids = None
+
+        self.num_uniques, self.alignment_length = self.matrix.shape
+        self.num_reads = len(self.read_indices)
+
+
+    def __deepcopy__(self, memo):
+        # the store is never modified, and copying a node shouldn't copy the store
+        return self
+
+
+    @classmethod
+    def from_unique_indices(cls, unique_matrix, read_unique_indices, id_blob, id_offsets, alignment_cache = None):
+        """Takes distinct sequences (in any order), the index of the sequence of every read in the
+           alignment, and read IDs. Unique sequences are ordered the way SequenceSource(unique = True)
+           orders them: by frequency, and then by the sha1 digest of the sequence."""
+        counts = numpy.bincount(read_unique_indices, minlength = len(unique_matrix))
+        hashes = [hashlib.sha1(row.tobytes()).hexdigest() for row in unique_matrix]
+        order = numpy.array(sorted(range(0, len(unique_matrix)), key = lambda i: (counts[i], hashes[i]), reverse = True), dtype = numpy.int64)
+
+        rank = numpy.zeros(len(order), dtype = numpy.int64)
+        rank[order] = numpy.arange(0, len(order))
+
+        frequencies = counts[order].astype(numpy.int32)
+        read_indices = numpy.argsort(rank[read_unique_indices], kind = 'stable')
+        if len(read_indices) < 2 ** 31:
+            read_indices = read_indices.astype(numpy.int32)
+
+        return cls(numpy.ascontiguousarray(unique_matrix[order]),
+                   frequencies,
+                   read_indices,
+                   numpy.concatenate(([0], numpy.cumsum(frequencies, dtype = numpy.int64))),
+                   id_blob,
+                   id_offsets,
+                   alignment_cache)
+
+
+    @classmethod
+    def from_alignment_cache(cls, alignment_cache):
+        matrix = numpy.ascontiguousarray(alignment_cache.matrix)
+        rows = matrix.view(numpy.dtype((numpy.void, alignment_cache.alignment_length))).ravel()
+        _, first_indices, inverse = numpy.unique(rows, return_index = True, return_inverse = True)
+
+        return cls.from_unique_indices(matrix[first_indices], inverse.ravel(), alignment_cache.ids, alignment_cache.id_offsets, alignment_cache)
+
+
+    @classmethod
+    def from_fasta(cls, fasta_file_path, memory_budget = DEFAULT_MEMORY_BUDGET, num_threads = 1, tmp_directory = None):
+        """Reads unique sequences from a FASTA file in one pass. Returns None if reads are not
+           of the same length. FASTA files that are too large for `memory_budget` are
+           dereplicated on the disk instead (see from_dereplicated_fasta)."""
+        if os.path.getsize(fasta_file_path) * MEMORY_PER_INPUT_BYTE > memory_budget:
+            return cls.from_dereplicated_fasta(fasta_file_path, memory_budget, num_threads, tmp_directory)
+
+        seq_to_unique_index = {}
+        unique_seqs = []
+        read_unique_indices = array.array('q')
+        id_blob = bytearray()
+        id_offsets = array.array('q', [0])
+
+        for start, end in u.get_byte_ranges(fasta_file_path, 1):
+            for read_id, seq in u.read_records_in_byte_range(fasta_file_path, start, end):
+                seq = seq.upper()
+                if seq not in seq_to_unique_index:
+                    seq_to_unique_index[seq] = len(unique_seqs)
+                    unique_seqs.append(seq)
+
+                read_unique_indices.append(seq_to_unique_index[seq])
+                id_blob.extend(('%s\n' % read_id).encode('utf-8'))
+                id_offsets.append(len(id_blob))
+
+        if not unique_seqs:
+            raise UniqueReadStoreError("There are no reads in '%s'." % fasta_file_path)
+
+        if len(set([len(seq) for seq in unique_seqs])) != 1:
+            return None
+
+        seq_to_unique_index = None
+        unique_matrix = numpy.frombuffer(b''.join(unique_seqs), dtype = numpy.uint8).reshape(len(unique_seqs), -1)
+
+        return cls.from_unique_indices(unique_matrix,
+                                       numpy.frombuffer(read_unique_indices, dtype = numpy.int64),
+                                       numpy.frombuffer(bytes(id_blob), dtype = numpy.uint8),
+                                       numpy.frombuffer(id_offsets, dtype = numpy.int64))
+
+
+    @classmethod
+    def from_dereplicated_fasta(cls, fasta_file_path, memory_budget = DEFAULT_MEMORY_BUDGET, num_threads = 1, tmp_directory = None):
+        """Reads unique sequences from a FASTA file through dereplication.DereplicatedSequenceSource
+           (which sorts them out in parts on the disk, in parallel if there are threads). Returns
+           None if reads are not of the same length. Read IDs are stored grouped by unique sequence
+           instead of in the order of the FASTA file."""
+        fasta = DereplicatedSequenceSource(fasta_file_path, memory_budget = memory_budget, num_threads = num_threads,
+                                           tmp_directory = tmp_directory)
+
+        rows = bytearray()
+        frequencies = array.array('i')
+        id_blob = bytearray()
+        id_offsets = array.array('q', [0])
+        alignment_length = None
+
+        try:
+            while next(fasta):
+                if alignment_length is None:
+                    alignment_length = len(fasta.seq)
+                elif len(fasta.seq) != alignment_length:
+                    return None
+
+                rows.extend(fasta.seq.encode('ascii', 'replace'))
+                frequencies.append(len(fasta.ids))
+                for read_id in fasta.ids:
+                    id_blob.extend(('%s\n' % read_id).encode('utf-8'))
+                    id_offsets.append(len(id_blob))
+        finally:
+            fasta.close()
+
+        if alignment_length is None:
+            raise UniqueReadStoreError("There are no reads in '%s'." % fasta_file_path)
+
+        frequencies = numpy.frombuffer(frequencies, dtype = numpy.int32)
+        num_reads = len(id_offsets) - 1
+
+        return cls(numpy.frombuffer(bytes(rows), dtype = numpy.uint8).reshape(len(frequencies), alignment_length),
+                   frequencies,
+                   numpy.arange(0, num_reads, dtype = numpy.int32 if num_reads < 2 ** 31 else numpy.int64),
+                   numpy.concatenate(([0], numpy.cumsum(frequencies, dtype = numpy.int64))),
+                   numpy.frombuffer(bytes(id_blob), dtype = numpy.uint8),
+                   numpy.frombuffer(id_offsets, dtype = numpy.int64))
+
+
+    def get_seq(self, index):
+        return self.matrix[index].tobytes().decode('ascii')
+
+
+    def get_md5id(self, index):
+        """Returns the md5 digest of the unique sequence `index`. Digests are computed the
+           first time they are asked for, and kept in a U x 32 bytes array."""
+        if self.md5ids is None:
+            self.md5ids = numpy.zeros(self.num_uniques, dtype = 'S32')
+
+        if not self.md5ids[index]:
+            self.md5ids[index] = hashlib.md5(self.matrix[index].tobytes()).hexdigest()
+
+        return self.md5ids[index].decode('ascii')
+
+
+    def get_read_id(self, read_index):
+        return self.id_blob[self.id_offsets[read_index]:self.id_offsets[read_index + 1] - 1].tobytes().decode('utf-8')
+
+
+    def get_read_indices(self, index):
+        """Returns indices of reads in the alignment that have the unique sequence `index`"""
+        return self.read_indices[self.read_index_offsets[index]:self.read_index_offsets[index + 1]]
+
+
+    def get_read_indices_of_uniques(self, indices):
+        """Returns indices of reads in the alignment that have any of the unique sequences in
+           `indices` (an array of unique sequence indices)"""
+        indices = numpy.asarray(indices, dtype = numpy.int64)
+        starts = self.read_index_offsets[indices]
+        lengths = self.read_index_offsets[indices + 1] - starts
+
+        # positions of reads in self.read_indices, group by group
+        positions = numpy.arange(0, int(lengths.sum())) + numpy.repeat(starts - (numpy.cumsum(lengths) - lengths), lengths)
+
+        return self.read_indices[positions]
+
+
+    def get_size(self, indices):
+        """Returns the number of reads that have any of the unique sequences in `indices`"""
+        return int(self.frequencies[indices].sum(dtype = numpy.int64))
+
+
+    def get_ids(self, index):
+        return [self.get_read_id(read_index) for read_index in self.get_read_indices(index)]
+
+
+    def get_sample_codes(self, sample_name_separator = '_'):
+        """Returns a tuple of (sample index of every read in the alignment, sample names)"""
+        if sample_name_separator not in self.sample_codes:
+            if self.alignment_cache:
+                self.sample_codes[sample_name_separator] = self.alignment_cache.get_sample_codes(sample_name_separator)
+            else:
+                read_ids = (self.get_read_id(i) for i in range(0, self.num_reads))
+                self.sample_codes[sample_name_separator] = get_sample_codes(read_ids, sample_name_separator)
+
+        return self.sample_codes[sample_name_separator]
+
+
+    def save(self, file_path, content_hash, sample_name_separator = '_'):
+        """Stores the store in a single binary file along with the content hash of the alignment
+           it comes from, and sample codes of reads for `sample_name_separator`."""
+        sample_codes, sample_names = self.get_sample_codes(sample_name_separator)
+
+        # the file is written next to its final destination first, so a partially written
+        # cache is never found by later runs.
+        tmp_file_path = file_path + '.tmp.npz'
+        numpy.savez(tmp_file_path,
+                    version = numpy.array(STORE_VERSION),
+                    content_hash = numpy.array(content_hash),
+                    matrix = self.matrix,
+                    frequencies = self.frequencies,
+                    read_indices = self.read_indices,
+                    read_index_offsets = self.read_index_offsets,
+                    id_blob = numpy.asarray(self.id_blob),
+                    id_offsets = numpy.asarray(self.id_offsets),
+                    sample_name_separator = numpy.array(sample_name_separator),
+                    sample_codes = numpy.asarray(sample_codes),
+                    sample_names = numpy.array(sample_names, dtype = str))
+        os.replace(tmp_file_path, file_path)
+
+
+    @classmethod
+    def load(cls, file_path):
+        """Loads a store saved with `save`. Returns a tuple of (store, content hash of the alignment)."""
+        try:
+            data = numpy.load(file_path)
+            if int(data['version']) != STORE_VERSION:
+                raise UniqueReadStoreError("'%s' was stored by a different version of the program." % file_path)
+
+            store = cls(data['matrix'], data['frequencies'], data['read_indices'], data['read_index_offsets'],
+                        data['id_blob'], data['id_offsets'])
+            store.sample_codes[str(data['sample_name_separator'])] = (data['sample_codes'], [str(s) for s in data['sample_names']])
+            content_hash = str(data['content_hash'])
+            data.close()
+        except (IOError, OSError, KeyError, ValueError, zipfile.BadZipFile) as e:
+            raise UniqueReadStoreError("'%s' is not a unique reads cache: %s" % (file_path, e))
+
+        return (store, content_hash)
+
+
+def get_content_hash(file_path, block_size = 4 * 1024 * 1024):
+    """Returns the sha1 digest of the contents of a file"""
+    content_hash = hashlib.sha1()
+
+    f = open(file_path, 'rb')
+    while 1:
+        block = f.read(block_size)
+        if not block:
+            break
+        content_hash.update(block)
+    f.close()
+
+    return content_hash.hexdigest()
+
+
+def get_unique_read_store_from_cache(alignment_path, cache_path):
+    """Returns the store in `cache_path` if it was generated from the current contents of the
+       alignment, or None. A cache is not validated again while the size and the modification
+       time of the alignment stay the same."""
+    if not os.path.exists(cache_path):
+        return None
+
+    store, content_hash = UniqueReadStore.load(cache_path)
+
+    signature_path = cache_path + '.signature'
+    signature = get_file_signature(alignment_path)
+    if os.path.exists(signature_path) and open(signature_path).read() == '%s\t%s' % (signature, content_hash):
+        return store
+
+    if get_content_hash(alignment_path) != content_hash:
+        return None
+
+    store_signature(signature_path, signature, content_hash)
+    return store
+
+
+def store_unique_read_store_cache(read_store, alignment_path, cache_path, sample_name_separator = '_'):
+    """Saves the store in `cache_path` keyed by the content hash of the alignment. Returns
+       False if the cache can't be stored."""
+    content_hash = get_content_hash(alignment_path)
+
+    try:
+        read_store.save(cache_path, content_hash, sample_name_separator)
+    except (IOError, OSError):
+        return False
+
+    store_signature(cache_path + '.signature', get_file_signature(alignment_path), content_hash)
+    return True
+
+
+def get_file_signature(file_path):
+    file_stat = os.stat(file_path)
+    return '%d\t%d' % (file_stat.st_size, file_stat.st_mtime_ns)
+
+
+def store_signature(signature_path, signature, content_hash):
+    try:
+        signature_file = open(signature_path, 'w')
+        signature_file.write('%s\t%s' % (signature, content_hash))
+        signature_file.close()
+    except (IOError, OSError):
+        pass
@@ -10,7 +10,6 @@
 # Please read the COPYING file.
 
 import os
-import time
 import copy
 import io
 
@@ -160,8 +159,6 @@ class LocalBLAST:
         def worker(search_cmd):
             run_command(search_cmd)
         
-        mp = Multiprocessing(worker)
-
         input_file_parts = split_fasta_file(self.input,
                                             os.path.dirname(self.input),
                                             num_reads_per_file = num_reads_per_process)
@@ -174,23 +171,13 @@ class LocalBLAST:
             output_file_part = input_file_part + '.b6'
             cmd_line_params_dict['output'] = output_file_part
             output_file_parts.append(output_file_part)
-            processes_to_run.append(self.search_cmd_tmpl % cmd_line_params_dict)
-
-        self.search_cmd = processes_to_run[0]
-
-        while 1:
-            running_processes = len([p for p in mp.processes if p.is_alive()])
-            
-            if running_processes < num_processes and processes_to_run:
-                mp.run((processes_to_run.pop(),))
+            processes_to_run.append((self.search_cmd_tmpl % cmd_line_params_dict,),)
 
-            if not running_processes and not processes_to_run:
-                # let the blastn program finish writing all output files.
-                # FIXME: this is ridiculous. find a better solution.
-                time.sleep(5)
-                break
+        self.search_cmd = processes_to_run[0][0]
 
-            time.sleep(5)
+        # run_command returns when blastn is done writing its output.
+        with Multiprocessing(worker, num_processes) as mp:
+            mp.map(processes_to_run, chunk_size = 1)
         
         if os.path.exists(self.output):
             os.remove(self.output)
@@ -18,6 +18,10 @@ pretty_names = {'output_directory': 'Output directory',
                 'info_file_path': 'Extraction info output file',
                 'log_file_path': 'Log file path',
                 'root_alignment': 'Input file',
+                'alignment_cache': 'Alignment cache',
+                'unique_reads_cache': 'Unique reads cache',
+                'checkpoint': 'Checkpoint re-used',
+                'checkpoint_file_path': 'Checkpoint',
                 'entropy': 'Input entropy file',
                 'multi_threaded': 'Multi-threaded',
                 'quick': 'Quick (and dirty) analysis requested',
@@ -85,6 +89,8 @@ pretty_names = {'output_directory': 'Output directory',
                 'final_outliers_total': 'Final total number of outliers',
                 'num_raw_nodes': 'Number of raw nodes (before the refinement)',
                 'num_final_nodes': 'Number of final nodes (after the refinement)',
+                'num_settings': 'Number of settings in the parameter sweep',
+                'sweep_summary': 'Parameter sweep summary',
                 'skip_agglomerating_nodes': 'Skip agglomerating nodes',
                 'store_topology_dict': 'Store topology dict',
                 'topology_text': 'Basic topology of MED nodes (txt)',
@@ -96,7 +102,9 @@ pretty_names = {'output_directory': 'Output directory',
                 'agglomerate_nodes': 'Nodes agglomerated based on co-occurence patterns',
                 'merge_homopolymer_splits': 'Merge homopolymer splits',
                 'skip_removing_outliers': 'Skip removing outliers',
+                'remove_outliers_with_blast': 'Remove outliers with BLAST',
                 'relocate_outliers': 'Try to relocate outliers',
+                'relocate_outliers_with_blast': 'Relocate outliers with BLAST',
                 'read_distribution_table_path': 'Read distribution among samples table',
                 'node_representatives_file_path': 'Representative sequences per node',
                 'sample_mapping': 'Mapping file',
@@ -62,6 +62,11 @@ def decomposer():
                                 be a time consuming step.')
     parser.add_argument('-S', '--skip-removing-outliers', action = 'store_true', default = False,
                         help = 'When set, outliers will not be removed from nodes.')
+    parser.add_argument('--remove-outliers-with-blast', action = 'store_true', default = False,
+                        help = 'By default, distances of reads to the representative sequence of their node are\
+                                computed from the alignment. When set, reads in every node will be searched\
+                                against the representative sequence of the node with blastn instead (which\
+                                is much slower, but does not rely on the alignment of reads).')
     parser.add_argument('-H', '--merge-homopolymer-splits', action = 'store_true', default = False,
                         help = 'When set, nodes that differ from each other by only one nucleotide that happens\
                                 to be observed as an insertion at the upstream or downstream of a homopolymer\
@@ -72,6 +77,10 @@ def decomposer():
                                 This parameter, when set, makes the pipeline go through each read identified as\
                                 an outlier and try to find the best nodes for them. Please read the documentation\
                                 for details. This step might take a long time. Default: %(default)s')
+    parser.add_argument('--relocate-outliers-with-blast', action = 'store_true', default = False,
+                        help = 'By default, outliers are relocated to the node with the most similar representative\
+                                sequence in the alignment. When set, outliers will be searched against representative\
+                                sequences with blastn instead.')
     parser.add_argument('-F', '--store-topology-dict', action = 'store_true', default = False,
                         help = 'When set, topology dict with read ids will be generated. This may take a very large\
                                 disk space and computation time for large data sets')
@@ -85,6 +94,10 @@ def decomposer():
                         help = 'Number of threads to use. It is a good idea to keep this number smaller than the number\
                                 of CPU cores available. If not set, this number will be set to 90%% of available cores,\
                                 or (available cores - 1) if 10%% of the cores is a number smaller than 1')    
+    parser.add_argument('--memory-budget', type=int, default = None, metavar = "MEGABYTES",
+                        help = 'Approximate amount of memory (in megabytes) dereplication of the alignment may use.\
+                                Unique reads of larger alignments are sorted out on the disk in parts that fit into\
+                                this budget. Default is 1024')
     parser.add_argument('-E', '--sample-mapping', metavar = 'FILEPATH', default = None,
                         help = 'TAB delimited categorical mapping of samples to be used for post-analysis\
                                 visualizations. Refer to the tutorial for the file format')
@@ -95,12 +108,36 @@ def decomposer():
                         help = 'When set, decomposer will not attempt to generate figures post analysis')
     parser.add_argument('--skip-check-input-file', action = 'store_true', default = False,
                         help = 'When set, input FASTA will not be checked for potential errors')
+    parser.add_argument('--skip-alignment-cache', action = 'store_true', default = False,
+                        help = 'When set, the alignment will be read from the FASTA file instead of a binary\
+                                copy of it that is stored next to the FASTA file (with a \'.cache\' suffix)\
+                                at the first run, and re-used by later runs on the same alignment. Unique\
+                                reads of the alignment will not be cached either, unless --unique-reads-cache\
+                                is set')
+    parser.add_argument('--unique-reads-cache', metavar = 'FILEPATH', default = None,
+                        help = 'Unique reads of the alignment (unique sequences, their frequencies, and sample\
+                                names of reads) are stored in a binary file next to the alignment (with a\
+                                \'.unique-reads.npz\' suffix) at the first run, and re-used by later runs on\
+                                an alignment with the same contents (it is generated again if the alignment\
+                                changes). You can use this parameter to point to an existing cache of the same\
+                                alignment stored elsewhere (or to store the cache at a different location). A\
+                                cache given with this parameter that does not match the alignment is an error.')
     parser.add_argument('--skip-gexf-files', action = 'store_true', default = False,
                         help = 'When set, GEXF files for network and topology will not be generated')
     parser.add_argument('--quick', action = 'store_true', default = False,
                         help = 'When set, the pipeline will do only the essential steps, skipping anything\
                                 auxiliary, even if other parameters require otherwise. Please do not use it other than\
                                 benchmarking or testing purposes')
+    parser.add_argument('--sweep-m', type=float, nargs='+', default=None, metavar = 'FLOAT',
+                        help = 'Decompose the alignment once for every combination of --sweep-m, --sweep-M and\
+                                --sweep-d values (a parameter that is not swept takes its value from -m, -M or\
+                                -d). The alignment is read and the root node is analyzed only once for all\
+                                settings. Results of every setting are stored in a directory of its own in the\
+                                output directory, along with a summary of all settings (SWEEP-SUMMARY.txt).')
+    parser.add_argument('--sweep-M', type=int, nargs='+', default=None, metavar = 'INTEGER',
+                        help = '--min-substantive-abundance values for the parameter sweep (see --sweep-m)')
+    parser.add_argument('--sweep-d', type=int, nargs='+', default=None, metavar = 'INTEGER',
+                        help = '--number-of-discriminants values for the parameter sweep (see --sweep-m)')
     parser.add_argument('--version', action = 'store_true', default = False,
                         help = 'Print version and exit.')    
 
@@ -221,6 +258,18 @@ def oligotyping():
                         help = 'When a project name is set, given name will be used in figures whenever possible.')
     parser.add_argument('--skip-check-input-file', action = 'store_true', default = False,
                         help = 'When set, input FASTA will not be checked for potential errors')
+    parser.add_argument('--skip-alignment-cache', action = 'store_true', default = False,
+                        help = 'When set, the alignment will be read from the FASTA file instead of a binary\
+                                copy of it that is stored next to the FASTA file (with a \'.cache\' suffix)\
+                                at the first run, and re-used by later runs on the same alignment')
+    parser.add_argument('--reuse-checkpoint', metavar = 'FILEPATH', default = None,
+                        help = 'Every run stores the number of reads of every oligotype in every sample before\
+                                the noise filters in a binary checkpoint (CHECKPOINT.npz in the output directory).\
+                                When the checkpoint of an earlier run on the same alignment is given with this\
+                                parameter, and components (-c or -C) are the same, noise filters are applied to\
+                                it without reading the alignment, and steps that need reads (such as\
+                                representative sequences) are skipped as if --quick was set. Otherwise the\
+                                alignment is read as usual.')
     parser.add_argument('--skip-basic-analyses', action = 'store_true', default = False,
                         help = 'When set, basic analyses, such as basic NMDS plots and clustering, will be\
                                 skipped')
@@ -233,6 +282,16 @@ def oligotyping():
                         help = 'Number of threads to use. It is a good idea to keep this number smaller than the number\
                                 of CPU cores available. If not set, this number will be set to 90%% of available cores,\
                                 or (available cores - 1) if 10%% of the cores is a number smaller than 1')    
+    parser.add_argument('--sweep-c', type=int, nargs='+', default=None, metavar = 'INTEGER',
+                        help = 'Oligotype the alignment once for every number of auto components given with\
+                                --sweep-c, and every set of selected components given with --sweep-C. The\
+                                alignment is read only once for all sets of components, and noise filters are\
+                                applied to every set in parallel. Results of every set are stored in a\
+                                directory of its own in the output directory, along with a comparison of all\
+                                sets (SWEEP-SUMMARY.txt).')
+    parser.add_argument('--sweep-C', type=str, nargs='+', default=None, metavar = 'COMPONENTS',
+                        help = 'Comma separated selected components for the component sweep, one set per\
+                                value (such as \'4,8,15 4,8,15,25\'), see --sweep-c')
     parser.add_argument('--version', action = 'store_true', default = False,
                         help = 'Print version and exit.')    
 
@@ -271,6 +330,14 @@ def entropy():
     parser.add_argument('--amino-acid-sequences', action = 'store_true', default = False,
                         help = 'If sequences are composed of amino acids, instead of\
                                 nucleotides.')
+    parser.add_argument('--skip-alignment-cache', action = 'store_true', default = False,
+                        help = 'When set, the alignment will be read from the FASTA file instead of a binary\
+                                copy of it that is stored next to the FASTA file (with a \'.cache\' suffix)\
+                                at the first run, and re-used by later runs on the same alignment')
+    parser.add_argument('-N', '--num-threads', type=int, default = 1, metavar = "INTEGER",
+                        help = 'Number of threads to use. When larger than 1, the alignment is split into\
+                                that many parts that are counted in parallel. Memory usage does not depend\
+                                on the number of reads in the alignment either way. Default: %(default)d')
     parser.add_argument('--quick', action = 'store_true', default = False,
                         help = 'When set, entropy values will be shown as fast as\
                                 possible (some visualization steps will be skipped).')
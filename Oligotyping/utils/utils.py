@@ -11,6 +11,7 @@
 
 import os
 import sys
+import array
 import time
 import math
 import fcntl
@@ -20,14 +21,19 @@ import hashlib
 import random
 import string
 import termios 
+import queue
 import pickle
 import textwrap
+import traceback
 import tempfile
 import subprocess
 import numpy as np
 import multiprocessing
+import multiprocessing.shared_memory
 
 from Oligotyping.lib import fastalib as u
+from Oligotyping.lib.dereplication import DereplicatedSequenceSource
+from Oligotyping.lib.dereplication import DEFAULT_MEMORY_BUDGET
 from Oligotyping.utils.constants import pretty_names
 from Oligotyping.utils.aligner import nw_align
 
@@ -179,6 +185,45 @@ def get_num_nt_diff_between_two_aligned_sequences(seq1, seq2):
     return len(["diff" for i in range(0, len(seq1)) if seq1[i] != seq2[i]])
 
 
+def get_single_deletion_variants(sequence):
+    """Returns the set of sequences that can be obtained by deleting one character from the
+       sequence (deleting any character of a homopolymer run gives the same sequence)"""
+    return set([sequence[:i] + sequence[i + 1:] for i in range(0, len(sequence)) if i == 0 or sequence[i] != sequence[i - 1]])
+
+
+def get_single_indel_neighbors(query_seqs_dict, target_seqs_dict):
+    """Takes two dictionaries of id -> sequence, and returns a dictionary that maps query ids
+       to sets of target ids whose sequences differ from the query sequence by exactly one
+       insertion or deletion (and nothing else) once gaps are removed. Instead of comparing
+       all pairs, target sequences and their single-deletion variants are hashed, so every
+       query costs one lookup per homopolymer run in it."""
+    targets_by_seq = {}
+    targets_by_deletion_variant = {}
+    for target_id in target_seqs_dict:
+        seq = target_seqs_dict[target_id].replace('-', '')
+        targets_by_seq.setdefault(seq, set()).add(target_id)
+        for variant in get_single_deletion_variants(seq):
+            targets_by_deletion_variant.setdefault(variant, set()).add(target_id)
+
+    neighbors_dict = {}
+    for query_id in query_seqs_dict:
+        seq = query_seqs_dict[query_id].replace('-', '')
+
+        # targets that are one character shorter, and the ones that are one character longer
+        neighbors = set()
+        for variant in get_single_deletion_variants(seq):
+            if variant in targets_by_seq:
+                neighbors.update(targets_by_seq[variant])
+        if seq in targets_by_deletion_variant:
+            neighbors.update(targets_by_deletion_variant[seq])
+
+        neighbors.discard(query_id)
+        if neighbors:
+            neighbors_dict[query_id] = neighbors
+
+    return neighbors_dict
+
+
 def homopolymer_indel_exists(seq1, seq2):
     seq1, seq2 = trim_uninformative_gaps_from_sequences(seq1, seq2)
     
@@ -287,21 +332,22 @@ def mask_defline_whitespaces_in_FASTA(fasta_file_path, defline_white_space_mask
 
 def unique_and_store_alignment(alignment_path, output_path):
     output = u.FastaOutput(output_path)
-    alignment = u.SequenceSource(alignment_path, unique = True)
-        
-    next(alignment)
-    most_abundant_unique_read = alignment.seq
-    alignment.reset()
- 
-    read_ids = []
-    unique_read_counts = []
-    while next(alignment):
-        read_ids += alignment.ids
-        unique_read_counts.append(len(alignment.ids))
-        output.store(alignment, split = False)
-            
-    output.close()
-    alignment.close()
+    alignment = DereplicatedSequenceSource(alignment_path)
+
+    try:
+        next(alignment)
+        most_abundant_unique_read = alignment.seq
+        alignment.reset()
+
+        read_ids = []
+        unique_read_counts = []
+        while next(alignment):
+            read_ids += alignment.ids
+            unique_read_counts.append(len(alignment.ids))
+            output.store(alignment, split = False)
+    finally:
+        output.close()
+        alignment.close()
         
     return (read_ids, unique_read_counts, most_abundant_unique_read)
 
@@ -334,10 +380,13 @@ def generate_ENVIRONMENT_file(samples, samples_dict, environment_file_path):
 def get_unique_sequences_from_FASTA(alignment, limit = 10):
     unique_sequences = []
 
-    fasta = u.SequenceSource(alignment, unique = True, lazy_init = False)
+    fasta = DereplicatedSequenceSource(alignment)
 
-    while next(fasta) and fasta.pos < limit:
-        unique_sequences.append((fasta.seq, len(fasta.ids), len(fasta.ids) / float(fasta.total_seq)))
+    try:
+        while next(fasta) and fasta.pos < limit:
+            unique_sequences.append((fasta.seq, len(fasta.ids), len(fasta.ids) / float(fasta.total_seq)))
+    finally:
+        fasta.close()
 
     return unique_sequences
 
@@ -580,7 +629,7 @@ def get_qual_stats_dict(quals_dict, output_file_path = None, verbose = True):
         qual_stats_dict[pos]['count'] = len(quals_for_pos)
     
     if output_file_path:
-        pickle.dump(quals_dict, open(output_file_path, 'w'))
+        pickle.dump(qual_stats_dict, open(output_file_path, 'wb'))
 
     progress.end()
     return qual_stats_dict
@@ -625,7 +674,7 @@ def get_quals_dict(quals_file, alignment_file, output_file_path = None, verbose
     progress.end()
 
     if output_file_path:
-        pickle.dump(quals_aligned_dict, open(output_file_path, 'w'))
+        pickle.dump(quals_aligned_dict, open(output_file_path, 'wb'))
 
     return quals_aligned_dict
 
@@ -658,7 +707,7 @@ def process_command_line_args_for_quality_files(args, _return = 'qual_stats_dict
             return qual_stats_dict
 
     elif args.qual_scores_dict:
-        quals_dict = pickle.load(open(args.qual_scores_dict))
+        quals_dict = pickle.load(open(args.qual_scores_dict, 'rb'))
 
         if _return == 'quals_dict':
             return quals_dict
@@ -670,7 +719,7 @@ def process_command_line_args_for_quality_files(args, _return = 'qual_stats_dict
             return qual_stats_dict
 
     elif args.qual_stats_dict:
-        qual_stats_dict = pickle.load(open(args.qual_stats_dict))
+        qual_stats_dict = pickle.load(open(args.qual_stats_dict, 'rb'))
         
         if _return == 'qual_stats_dict':
             return qual_stats_dict
@@ -911,31 +960,75 @@ def get_sample_name_from_defline(defline, sample_name_separator = '_'):
         return sample_name_separator.join(defline.split(sample_name_separator)[0:-1])
 
 
-def check_input_alignment(alignment_path, sample_name_separator, progress_func = None):
-    alignment = u.SequenceSource(alignment_path)
+def get_sample_codes(read_ids, sample_name_separator = '_', sample_names = None):
+    """Resolves sample names of read IDs once. Returns a tuple of (sample index of every read,
+       sample names in the order they are first seen). If a list of `sample_names` is given,
+       it is extended with new sample names, and indices of known samples are kept."""
+    if sample_names is None:
+        sample_names = []
+
+    sample_name_to_code = dict([(sample, code) for code, sample in enumerate(sample_names)])
+    sample_codes = array.array('i')
+
+    for read_id in read_ids:
+        sample = get_sample_name_from_defline(read_id, sample_name_separator)
+        if sample not in sample_name_to_code:
+            sample_name_to_code[sample] = len(sample_names)
+            sample_names.append(sample)
+        sample_codes.append(sample_name_to_code[sample])
+
+    return (np.array(sample_codes, dtype = np.int32), sample_names)
+
+
+def get_sample_counts(sample_codes, sample_names):
+    """Counts reads per sample from their sample codes. Returns (sample name, count) tuples for
+       samples with reads, in the order samples are first seen in `sample_codes`."""
+    sample_codes = np.asarray(sample_codes)
+    if not len(sample_codes):
+        return []
+
+    counts = np.bincount(sample_codes, minlength = len(sample_names))
+    codes, first_indices = np.unique(sample_codes, return_index = True)
+
+    return [(sample_names[code], int(counts[code])) for code in codes[np.argsort(first_indices)]]
+
+
+def check_input_alignment(alignment_path, sample_name_separator, progress_func = None, alignment_cache = None, read_store = None):
     samples = set([])
     previous_alignment_length = None
 
-    while next(alignment):
-        if progress_func and alignment.pos % 5000 == 0:
-            progress_func.update('Reading input; %s, %s samples found'\
-                                        % (pretty_print(alignment.pos),
-                                           pretty_print(len(samples))))
-
-        sample = get_sample_name_from_defline(alignment.id, sample_name_separator)
-        if sample not in samples:
-            samples.add(sample)
-    
-        # check the alignment lengths along the way:
-        if previous_alignment_length:
-            if previous_alignment_length != len(alignment.seq):
-                raise ConfigError("Not all reads have the same length.")
+    if alignment_cache or read_store:
+        # reads in a cached alignment (or in a store of unique reads) are known to be of
+        # the same length, and sample names of reads are already in there.
+        cached_reads = alignment_cache or read_store
+        samples = set(cached_reads.get_sample_codes(sample_name_separator)[1])
+        num_reads = cached_reads.num_reads
+    else:
+        alignment = u.SequenceSource(alignment_path)
+
+        while next(alignment):
+            if progress_func and alignment.pos % 5000 == 0:
+                progress_func.update('Reading input; %s, %s samples found'\
+                                            % (pretty_print(alignment.pos),
+                                               pretty_print(len(samples))))
 
-        previous_alignment_length = len(alignment.seq)
+            sample = get_sample_name_from_defline(alignment.id, sample_name_separator)
+            if sample not in samples:
+                samples.add(sample)
+        
+            # check the alignment lengths along the way:
+            if previous_alignment_length:
+                if previous_alignment_length != len(alignment.seq):
+                    raise ConfigError("Not all reads have the same length.")
+
+            previous_alignment_length = len(alignment.seq)
+
+        num_reads = alignment.pos
+        alignment.close()
 
     # if the number of samples we find in the alignment is more than half of the number of
     # reads in the alignment, we might be in trouble.
-    if len(samples) * 2 > alignment.pos:
+    if len(samples) * 2 > num_reads:
         sys.stderr.write("\n\n")
         sys.stderr.write("Number of samples in the alignment is more than half of the number of reads.\n")
         sys.stderr.write("This usually indicates that the sample name recovery from the defline is not\n")
@@ -956,7 +1049,6 @@ def check_input_alignment(alignment_path, sample_name_separator, progress_func =
         sys.stderr.write("to the tutorial for the proper formatting of FASTA deflines.")
         sys.stderr.write("\n\n")
             
-        alignment.close()
         return None
     if len(samples) == 1:
         sys.stderr.write("\n\n")
@@ -972,10 +1064,8 @@ def check_input_alignment(alignment_path, sample_name_separator, progress_func =
         sys.stderr.write("to the tutorial for the proper formatting of FASTA deflines.")
         sys.stderr.write("\n\n")
             
-        alignment.close()
         return None
     else:
-        alignment.close()
         return samples
 
 
@@ -1257,14 +1347,22 @@ class Run:
         if self.info_file_obj:
             self.info_file_obj.close()
 
-def get_read_objects_from_file(input_file_path):
-    input_fasta = u.SequenceSource(input_file_path, unique = True)
+def get_read_objects_from_file(input_file_path, alignment_cache = None, memory_budget = None, num_threads = 1, tmp_directory = None):
+    if alignment_cache:
+        return alignment_cache.get_unique_read_objects()
+
+    input_fasta = DereplicatedSequenceSource(input_file_path,
+                                             memory_budget = memory_budget or DEFAULT_MEMORY_BUDGET,
+                                             num_threads = num_threads,
+                                             tmp_directory = tmp_directory)
     read_objects = []
-    
-    while next(input_fasta):
-        read_objects.append(UniqueFASTAEntry(input_fasta.seq, input_fasta.ids))
 
-    input_fasta.close()
+    try:
+        while next(input_fasta):
+            read_objects.append(UniqueFASTAEntry(input_fasta.seq, input_fasta.ids))
+    finally:
+        input_fasta.close()
+
     return read_objects
 
 
@@ -1294,17 +1392,66 @@ def split_fasta_file(input_file_path, dest_dir, prefix = 'part', num_reads_per_f
     return parts
 
 
+class WorkerError(Exception):
+    def __init__(self, e = None):
+        Exception.__init__(self)
+        self.e = e
+        return
+    def __str__(self):
+        return 'Worker Error: %s' % self.e
+
+
+def run_worker_loop(target_function, task_queue, results_queue):
+    """Main loop of Multiprocessing worker processes: runs target_function for every task in
+       chunks that come from task_queue until it gets None, and sends results of every chunk
+       (or the exception that interrupted it) back through results_queue. Messages are pickled
+       here, so an object that can't be pickled becomes an error instead of a lost message."""
+    while 1:
+        chunk = task_queue.get()
+        if chunk is None:
+            break
+
+        chunk_index, args_list = pickle.loads(chunk)
+        try:
+            message = pickle.dumps((chunk_index, True, [target_function(*args) for args in args_list]))
+        except Exception as e:
+            try:
+                message = pickle.dumps((chunk_index, False, (e, traceback.format_exc())))
+            except Exception:
+                message = pickle.dumps((chunk_index, False, (WorkerError(repr(e)), traceback.format_exc())))
+
+        results_queue.put(message)
+
+
 class Multiprocessing:
-    def __init__(self, target_function, num_thread = None):
+    """A pool of persistent worker processes that run target_function. Workers are started
+       once (when map is called for the first time) and reused until close() is called, and
+       tasks are sent to them in chunks through a bounded queue. Worker processes are forked,
+       so target_function can be a nested function; arguments and results are pickled."""
+    def __init__(self, target_function, num_thread = None, max_queued_chunks = None):
         self.cpu_count = multiprocessing.cpu_count()
-        self.num_thread = num_thread or (self.cpu_count - (int(round(self.cpu_count / 10.0)) or 1))
+        self.num_thread = num_thread or max(self.cpu_count - (int(round(self.cpu_count / 10.0)) or 1), 1)
         self.target_function = target_function
+        self.max_queued_chunks = max_queued_chunks or self.num_thread * 2
         self.processes = []
-        self.manager = multiprocessing.Manager()
+        self.context = multiprocessing.get_context('fork')
+        self.task_queue = None
+        self.results_queue = None
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        if exc_type:
+            self.terminate()
+        else:
+            self.close()
 
 
     def get_data_chunks(self, data_array, spiral = False):
-        data_chunk_size = (len(data_array) / self.num_thread) or 1
+        data_chunk_size = (len(data_array) // self.num_thread) or 1
         data_chunks = []
         
         if len(data_array) <= self.num_thread:
@@ -1324,52 +1471,149 @@ class Multiprocessing:
 
         return data_chunks
 
-                
-    def run(self, args, name = None):
-        t = multiprocessing.Process(name = name,
-                                    target = self.target_function,
-                                    args = args)
-        self.processes.append(t)
-        t.start()
 
+    def start(self):
+        if self.processes:
+            return
 
-    def get_empty_shared_array(self):
-        return self.manager.list()
+        self.task_queue = self.context.Queue(self.max_queued_chunks)
+        self.results_queue = self.context.Queue()
 
+        for i in range(0, self.num_thread):
+            p = self.context.Process(target = run_worker_loop,
+                                     args = (self.target_function, self.task_queue, self.results_queue))
+            p.daemon = True
+            p.start()
+            self.processes.append(p)
 
-    def get_empty_shared_dict(self):
-        return self.manager.dict()
 
-    
-    def get_shared_integer(self):
-        return self.manager.Value('i', 0)
+    def close(self):
+        """Stops worker processes after they are done with what is in the queue"""
+        for p in self.processes:
+            self.task_queue.put(None)
 
+        for p in self.processes:
+            p.join()
 
-    def run_processes(self, processes_to_run, progress_obj = None):
-        tot_num_processes = len(processes_to_run)
-        sent_to_run = 0
-        while 1:
-            NumRunningProceses = lambda: len([p for p in self.processes if p.is_alive()])
-            
-            if NumRunningProceses() < self.num_thread and processes_to_run:
-                for i in range(0, self.num_thread - NumRunningProceses()):
-                    if len(processes_to_run):
-                        sent_to_run += 1
-                        self.run(processes_to_run.pop())
-
-            if not NumRunningProceses() and not processes_to_run:
-                # let the blastn program finish writing all output files.
-                # FIXME: this is ridiculous. find a better solution.
-                time.sleep(1)
-                break
+        self.processes = []
+
+
+    def terminate(self):
+        for p in self.processes:
+            p.terminate()
+            p.join()
+
+        self.processes = []
+
+
+    def map(self, args_list, progress_obj = None, progress_text = None, callback = None, chunk_size = None):
+        """Runs target_function for every tuple of arguments in args_list, and returns the list
+           of results in the same order. Tasks are sent to workers `chunk_size` at a time (by
+           default, tasks are split into about four chunks per worker).
+           `callback(index, result)` is called in this process as every result comes back, and
+           the progress object is updated after every chunk. An exception raised by the target
+           function in a worker is raised here (and workers are terminated)."""
+        self.start()
+
+        if not chunk_size:
+            chunk_size = max(len(args_list) // (self.num_thread * 4), 1)
+
+        chunks = [(i, args_list[i:i + chunk_size]) for i in range(0, len(args_list), chunk_size)]
+        results = [None] * len(args_list)
+
+        num_tasks_done = 0
+        num_chunks_sent = 0
+        num_chunks_done = 0
+        while num_chunks_done < len(chunks):
+            # there are never more than max_queued_chunks chunks in the queue or in process,
+            # so putting a new one in the queue never blocks.
+            while num_chunks_sent < len(chunks) and num_chunks_sent - num_chunks_done < self.max_queued_chunks:
+                self.task_queue.put(pickle.dumps(chunks[num_chunks_sent]))
+                num_chunks_sent += 1
+
+            try:
+                message = self.results_queue.get(timeout = 1)
+            except queue.Empty:
+                if not all([p.is_alive() for p in self.processes]):
+                    self.terminate()
+                    raise WorkerError("A worker process died unexpectedly.")
+                continue
+
+            chunk_index, success, chunk_results = pickle.loads(message)
+            num_chunks_done += 1
+
+            if not success:
+                e, worker_traceback = chunk_results
+                self.terminate()
+                raise e from WorkerError(worker_traceback)
+
+            for i in range(0, len(chunk_results)):
+                results[chunk_index + i] = chunk_results[i]
+                num_tasks_done += 1
+
+                if callback:
+                    callback(chunk_index + i, chunk_results[i])
 
             if progress_obj:
-                progress_obj.update('%d of %d done in %d threads (currently running processes: %d)'\
-                                                         % (sent_to_run - NumRunningProceses(),
-                                                            tot_num_processes,
-                                                            self.num_thread,
-                                                            NumRunningProceses()))
-            time.sleep(1)
+                progress_obj.update('%s%d of %d done in %d threads' % (('%s: ' % progress_text) if progress_text else '',
+                                                                       num_tasks_done,
+                                                                       len(args_list),
+                                                                       self.num_thread))
+
+        return results
+
+
+class SharedArray:
+    """A NumPy array in shared memory, so worker processes can read it without the array
+       being pickled and copied. A SharedArray object is pickled by the name of its memory
+       block, and it is attached to the same block when it is unpickled in another process.
+       The process that created the array is responsible for calling close() when it is
+       no longer needed."""
+    def __init__(self, array):
+        array = np.ascontiguousarray(array)
+
+        self.shape = array.shape
+        self.dtype = array.dtype.str
+        self.shm = multiprocessing.shared_memory.SharedMemory(create = True, size = max(array.nbytes, 1))
+        self.name = self.shm.name
+        self.creator_pid = os.getpid()
+        self.owner = True
+
+        self.get()[...] = array
+
+
+    def __getstate__(self):
+        return {'name': self.name, 'shape': self.shape, 'dtype': self.dtype, 'creator_pid': self.creator_pid}
+
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.owner = False
+
+        try:
+            self.shm = multiprocessing.shared_memory.SharedMemory(name = self.name, track = False)
+        except TypeError:
+            # python < 3.13 registers every block a process attaches to with the resource
+            # tracker. the creator of the block and its child processes share a tracker, where
+            # the block is already registered (and unlink() of the creator unregisters it). any
+            # other process has a tracker of its own, which would remove the block when the
+            # process exits, so the block is unregistered from it.
+            self.shm = multiprocessing.shared_memory.SharedMemory(name = self.name)
+
+            parent_process = multiprocessing.parent_process()
+            if self.creator_pid not in [os.getpid(), parent_process.pid if parent_process else None]:
+                from multiprocessing import resource_tracker
+                resource_tracker.unregister(self.shm._name, 'shared_memory')
+
+
+    def get(self):
+        return np.ndarray(self.shape, dtype = self.dtype, buffer = self.shm.buf)
+
+
+    def close(self):
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
 
 
 class UniqueFASTAEntry:
@@ -0,0 +1,67 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import unittest
+
+import Oligotyping.lib.fastalib as u
+import Oligotyping.utils.utils as utils
+from Oligotyping.lib.alignment_cache import AlignmentCache
+from Oligotyping.lib.alignment_cache import CachedSequenceSource
+from Oligotyping.lib.alignment_cache import get_alignment_cache
+
+my_path = os.path.dirname(os.path.realpath(__file__))
+
+class Tests(unittest.TestCase):
+    def setUp(self):
+        self.output_directory_path = os.path.join(my_path, 'test-alignment-cache')
+        if not os.path.exists(self.output_directory_path):
+            os.makedirs(self.output_directory_path)
+
+        self.alignment = os.path.join(self.output_directory_path, 'alignment.fa')
+        if not os.path.exists(self.alignment):
+            shutil.copy(os.path.join(my_path, 'files/clone43-v6v4.fa'), self.alignment)
+
+    def tearDown(self):
+        pass
+
+    def test_01_BuildCache(self):
+        cache = AlignmentCache(self.alignment)
+        self.assertTrue(os.path.exists(cache.cache_path))
+        self.assertTrue(cache.matrix.shape == (cache.num_reads, cache.alignment_length))
+
+    def test_02_CachedSequenceSource(self):
+        fasta = u.SequenceSource(self.alignment)
+        cached_fasta = CachedSequenceSource(AlignmentCache(self.alignment))
+
+        while next(fasta):
+            self.assertTrue(next(cached_fasta))
+            self.assertTrue((fasta.id, fasta.seq, fasta.pos) == (cached_fasta.id, cached_fasta.seq, cached_fasta.pos))
+
+        self.assertFalse(next(cached_fasta))
+        self.assertTrue(cached_fasta.total_seq == fasta.pos)
+
+    def test_03_SampleCodes(self):
+        cache = AlignmentCache(self.alignment)
+        sample_codes, sample_names = cache.get_sample_codes('_')
+
+        for i in range(0, cache.num_reads):
+            self.assertTrue(sample_names[sample_codes[i]] == utils.get_sample_name_from_defline(cache.get_id(i), '_'))
+
+    def test_04_UniqueReadObjects(self):
+        expected = [(r.seq, r.ids) for r in utils.get_read_objects_from_file(self.alignment)]
+        reads = AlignmentCache(self.alignment).get_unique_read_objects()
+        self.assertTrue([(r.seq, r.ids) for r in reads] == expected)
+
+    def test_05_InvalidateCache(self):
+        open(self.alignment, 'a').write('>Sample_new\n%s\n' % ('A' * AlignmentCache(self.alignment).alignment_length))
+        cache = AlignmentCache(self.alignment)
+        self.assertTrue(cache.get_id(cache.num_reads - 1) == 'Sample_new')
+
+        # reads of different lengths can't be cached
+        open(self.alignment, 'a').write('>Sample_short\nACGT\n')
+        self.assertTrue(get_alignment_cache(self.alignment) is None)
+
+    def test_99_CleanUp(self):
+        shutil.rmtree(self.output_directory_path)
@@ -27,6 +27,7 @@ class Tests(unittest.TestCase):
         self.output_directory_path = os.path.join(my_path, 'test-decomposition')
         self.decomposer = Decomposer()
         self.decomposer.alignment = os.path.join(my_path, 'files/clone43-v6v4.fa')
+        self.decomposer.skip_alignment_cache = True
         self.decomposer.min_entropy = 0.2
         self.decomposer.min_actual_abundance = 1
         self.decomposer.min_substantive_abundance = 1
@@ -0,0 +1,78 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import unittest
+
+from Oligotyping.lib.decomposer import Decomposer
+
+my_path = os.path.dirname(os.path.realpath(__file__))
+
+def get_decomposer(output_directory_path):
+    decomposer = Decomposer()
+    decomposer.alignment = os.path.join(my_path, 'files/reads-noisy.fa')
+    decomposer.min_entropy = 0.3
+    decomposer.min_actual_abundance = 0
+    decomposer.min_substantive_abundance = 2
+    decomposer.number_of_discriminants = 1
+    decomposer.skip_check_input_file = True
+    decomposer.progress.verbose = False
+    decomposer.run.verbose = False
+    decomposer.skip_removing_outliers = False
+    decomposer.skip_agglomerating_nodes = True
+    decomposer.skip_gen_figures = True
+    decomposer.skip_gen_html = True
+    decomposer.skip_alignment_cache = True
+    decomposer.output_directory = output_directory_path
+    return decomposer
+
+def get_md5ids(decomposer, unique_read_indices):
+    return set([decomposer.read_store.get_md5id(i) for i in unique_read_indices])
+
+def get_final_nodes(decomposer):
+    return dict([(node_id, get_md5ids(decomposer, decomposer.topology.nodes[node_id].unique_read_indices))\
+                                                for node_id in decomposer.topology.final_nodes])
+
+def get_outliers(decomposer, reason):
+    if reason not in decomposer.topology.outliers:
+        return set([])
+
+    return get_md5ids(decomposer, decomposer.topology.outliers[reason])
+
+class Tests(unittest.TestCase):
+    def setUp(self):
+        self.output_directory_path = os.path.join(my_path, 'test-decomposition-outliers')
+
+    def tearDown(self):
+        pass
+
+    def test_01_RemoveOutliers(self):
+        # reads should be found too distant from the representatives of their nodes
+        # the same way with or without blastn.
+        outliers = {}
+        for remove_outliers_with_blast in [False, True]:
+            decomposer = get_decomposer(os.path.join(self.output_directory_path, 'remove-%s' % remove_outliers_with_blast))
+            decomposer.remove_outliers_with_blast = remove_outliers_with_blast
+            decomposer.decompose()
+            outliers[remove_outliers_with_blast] = get_outliers(decomposer, 'maximum_variation_allowed_reason')
+
+        self.assertTrue(len(outliers[False]))
+        self.assertTrue(outliers[False] == outliers[True])
+
+    def test_02_RelocateOutliers(self):
+        # outliers should be relocated to the same nodes with or without blastn.
+        final_nodes, outliers = {}, {}
+        for relocate_outliers_with_blast in [False, True]:
+            decomposer = get_decomposer(os.path.join(self.output_directory_path, 'relocate-%s' % relocate_outliers_with_blast))
+            decomposer.relocate_outliers = True
+            decomposer.relocate_outliers_with_blast = relocate_outliers_with_blast
+            decomposer.decompose()
+            final_nodes[relocate_outliers_with_blast] = get_final_nodes(decomposer)
+            outliers[relocate_outliers_with_blast] = get_outliers(decomposer, 'maximum_variation_allowed_reason')
+
+        self.assertTrue(final_nodes[False] == final_nodes[True])
+        self.assertTrue(outliers[False] == outliers[True])
+
+    def test_99_CleanUp(self):
+        shutil.rmtree(self.output_directory_path)
@@ -0,0 +1,68 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import unittest
+
+from Oligotyping.lib.decomposer import Decomposer
+
+my_path = os.path.dirname(os.path.realpath(__file__))
+
+def files_are_the_same(file1, file2):
+    lines1 = open(file1).readlines()
+    lines2 = open(file2).readlines()
+
+    if len(lines1) != len(lines2):
+        return False
+
+    for i in range(0, len(lines1)):
+        if lines1[i] != lines2[i]:
+            return False
+
+    return True
+
+def get_decomposer(output_directory_path):
+    decomposer = Decomposer()
+    decomposer.alignment = os.path.join(my_path, 'files/reads-noisy.fa')
+    decomposer.skip_alignment_cache = True
+    decomposer.min_actual_abundance = 0
+    decomposer.skip_check_input_file = True
+    decomposer.progress.verbose = False
+    decomposer.run.verbose = False
+    decomposer.skip_removing_outliers = False
+    decomposer.skip_gen_figures = True
+    decomposer.output_directory = output_directory_path
+    return decomposer
+
+class Tests(unittest.TestCase):
+    def setUp(self):
+        self.output_directory_path = os.path.join(my_path, 'test-decomposition-sweep')
+        self.parameter_grid = [(0.3, 2, 1), (0.3, 2, 2), (0.5, 4, 1)]
+
+    def tearDown(self):
+        pass
+
+    def test_01_Sweep(self):
+        for no_threading in [False, True]:
+            sweep_directory_path = os.path.join(self.output_directory_path, 'sweep-%s' % no_threading)
+            decomposer = get_decomposer(sweep_directory_path)
+            decomposer.no_threading = no_threading
+            summaries = decomposer.sweep(self.parameter_grid)
+
+            self.assertTrue(os.path.exists(os.path.join(sweep_directory_path, 'SWEEP-SUMMARY.txt')))
+            self.assertTrue(len(summaries) == len(self.parameter_grid))
+
+            for i in range(0, len(self.parameter_grid)):
+                m, M, d = self.parameter_grid[i]
+                decomposer = get_decomposer(os.path.join(self.output_directory_path, 'single-%d' % i))
+                decomposer.min_entropy, decomposer.min_substantive_abundance, decomposer.number_of_discriminants = m, M, d
+                decomposer.decompose()
+
+                self.assertTrue(summaries[i]['num_final_nodes'] == len(decomposer.topology.final_nodes))
+                for file_name in ['ENVIRONMENT.txt', 'MATRIX-COUNT.txt', 'NODE-REPRESENTATIVES.fasta']:
+                    self.assertTrue(files_are_the_same(os.path.join(decomposer.output_directory, file_name),
+                                                       os.path.join(sweep_directory_path, summaries[i]['setting'], file_name)))
+
+    def test_99_CleanUp(self):
+        shutil.rmtree(self.output_directory_path)
@@ -5,7 +5,11 @@ import os
 import shutil
 import unittest
 
+from multiprocessing.shared_memory import SharedMemory
+
 from Oligotyping.lib.decomposer import Decomposer
+from Oligotyping.lib.unique_reads import UniqueReadStore
+from Oligotyping.utils import utils
 
 my_path = os.path.dirname(os.path.realpath(__file__))
 
@@ -27,6 +31,7 @@ class Tests(unittest.TestCase):
         self.output_directory_path = os.path.join(my_path, 'test-decomposition-threaded')
         self.decomposer = Decomposer()
         self.decomposer.alignment = os.path.join(my_path, 'files/reads-noisy.fa')
+        self.decomposer.skip_alignment_cache = True
         self.decomposer.min_entropy = 0.3
         self.decomposer.min_actual_abundance = 0
         self.decomposer.min_substantive_abundance = 2
@@ -55,5 +60,37 @@ class Tests(unittest.TestCase):
         self.assertTrue(files_are_the_same(os.path.join(my_path, 'files/reads-noisy-matrix-percent.txt'),
                                            os.path.join(self.output_directory_path, 'MATRIX-PERCENT.txt')))
 
+    def test_04_WorkerError(self):
+        alignment_path = os.path.join(self.output_directory_path, 'worker-error.fa')
+        alignment = open(alignment_path, 'w')
+        for seq, frequency in [('ACGT', 3), ('ACGA', 2), ('TCGA', 1)]:
+            for i in range(0, frequency):
+                alignment.write('>read_%s_%d\n%s\n' % (seq, i, seq))
+        alignment.close()
+
+        self.decomposer.topology.nodes_output_directory = self.output_directory_path
+        self.decomposer.topology.read_store = UniqueReadStore.from_fasta(alignment_path)
+        nodes = [self.decomposer.topology.add_new_node('n%d' % i, range(i, 3)) for i in range(0, 3)]
+
+        shared_arrays = []
+        init = utils.SharedArray.__init__
+        def recording_init(shared_array, array):
+            init(shared_array, array)
+            shared_arrays.append(shared_array)
+
+        def function(node):
+            raise ValueError(node.node_id)
+
+        # shared memory of nodes is released when a worker fails
+        utils.SharedArray.__init__ = recording_init
+        try:
+            self.assertRaises(ValueError, self.decomposer._map_nodes_in_parallel, nodes, function)
+        finally:
+            utils.SharedArray.__init__ = init
+
+        self.assertTrue(len(shared_arrays) == 2)
+        for shared_array in shared_arrays:
+            self.assertRaises(FileNotFoundError, SharedMemory, name = shared_array.name)
+
     def test_99_CleanUp(self):
         shutil.rmtree(self.output_directory_path)
@@ -0,0 +1,73 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import unittest
+
+import Oligotyping.lib.fastalib as u
+import Oligotyping.utils.utils as utils
+from Oligotyping.lib.dereplication import DereplicatedSequenceSource
+
+my_path = os.path.dirname(os.path.realpath(__file__))
+
+def read_all(source, attributes):
+    entries = []
+    while next(source):
+        entries.append(tuple([getattr(source, a) for a in attributes] + [source.pos]))
+    return entries
+
+class Tests(unittest.TestCase):
+    def setUp(self):
+        self.output_directory_path = os.path.join(my_path, 'test-dereplication')
+        if not os.path.exists(self.output_directory_path):
+            os.makedirs(self.output_directory_path)
+        self.alignment = os.path.join(my_path, 'files/unaligned-25K-illumina-test.fa')
+        self.multiline_fasta = os.path.join(my_path, 'files/mock/mock-env-aligned.fasta')
+
+    def tearDown(self):
+        pass
+
+    def test_01_InMemory(self):
+        for fasta_file_path in [self.alignment, self.multiline_fasta]:
+            fasta = u.SequenceSource(fasta_file_path, unique = True, lazy_init = False)
+            expected = read_all(fasta, ['id', 'seq', 'ids'])
+
+            dereplicated = DereplicatedSequenceSource(fasta_file_path)
+            self.assertTrue(dereplicated.num_buckets == 1)
+            self.assertTrue((dereplicated.total_seq, dereplicated.total_unique) == (fasta.total_seq, fasta.total_unique))
+            self.assertTrue(read_all(dereplicated, ['id', 'seq', 'ids']) == expected)
+            dereplicated.close()
+
+    def test_02_OutOfCore(self):
+        expected = read_all(u.SequenceSource(self.alignment, unique = True), ['id', 'seq', 'ids'])
+
+        for num_threads in [1, 2]:
+            dereplicated = DereplicatedSequenceSource(self.alignment, memory_budget = 500000, num_threads = num_threads,
+                                                      tmp_directory = self.output_directory_path)
+            self.assertTrue(dereplicated.num_buckets > 1)
+            self.assertTrue(dereplicated.total_unique == len(expected))
+            self.assertTrue(read_all(dereplicated, ['id', 'seq', 'ids']) == expected)
+
+            dereplicated.reset()
+            self.assertTrue(next(dereplicated))
+            self.assertTrue((dereplicated.id, dereplicated.seq, dereplicated.ids) == expected[0][0:3])
+
+            dereplicated.close()
+            self.assertFalse(os.path.exists(dereplicated.tmp_directory))
+
+    def test_03_ReadObjects(self):
+        expected = [(r.seq, r.ids) for r in utils.get_read_objects_from_file(self.alignment)]
+
+        # temporary files of the dereplication should not be left behind.
+        read_objects = utils.get_read_objects_from_file(self.alignment, memory_budget = 500000, num_threads = 2,
+                                                        tmp_directory = self.output_directory_path)
+        self.assertTrue([(r.seq, r.ids) for r in read_objects] == expected)
+        self.assertFalse([f for f in os.listdir(self.output_directory_path) if f.startswith('dereplication-')])
+
+    def test_99_CleanUp(self):
+        shutil.rmtree(self.output_directory_path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -8,6 +8,15 @@ import unittest
 
 from Oligotyping.lib.entropy import entropy_analysis
 from Oligotyping.lib.entropy import quick_entropy
+from Oligotyping.lib.entropy import entropy
+from Oligotyping.lib.entropy import encode_sequences
+from Oligotyping.lib.entropy import get_base_counts
+from Oligotyping.lib.entropy import get_column_entropies
+from Oligotyping.lib.entropy import count_bases_in_byte_range
+from Oligotyping.lib.entropy import EntropyAccumulator
+from Oligotyping.lib.entropy import get_oligo_codes
+from Oligotyping.lib.entropy import get_partition
+from Oligotyping.lib.fastalib import get_byte_ranges
 
 my_path = os.path.realpath(os.path.abspath(os.path.split(inspect.getfile(inspect.currentframe()))[0]))
 
@@ -51,5 +60,40 @@ class Tests(unittest.TestCase):
         n = len(quick_entropy(['ATCGATCGATCG', 'AACGATCGATGG']))
         self.assertTrue(n == 2)
         
+    def test_04_ColumnEntropies(self):
+        reads = ['ACGT-NACGA', 'ACCT-NAGGA', 'TCGA-AACGA', 'ACGTTNACGC']
+        frequencies = [3, 1, 7, 2]
+        column_entropies = get_column_entropies(get_base_counts(encode_sequences(reads), frequencies))
+
+        for position in range(0, len(reads[0])):
+            column = ''.join([read[position] * frequency for read, frequency in zip(reads, frequencies)])
+            e = 0.0 if len(set(column)) == 1 else entropy(column)
+            self.assertTrue(column_entropies[position] == (e if e >= 0.00001 else 0.0))
+
+    def test_05_EntropyAccumulator(self):
+        accumulator = EntropyAccumulator()
+        for start, end in get_byte_ranges(self.alignment, 7):
+            accumulator += count_bases_in_byte_range(self.alignment, start, end)
+        self.assertTrue(accumulator.num_reads == 25000)
+
+        column_entropies = entropy_analysis(self.alignment, verbose = False)
+        self.assertTrue(accumulator.get_column_entropies().tolist() == column_entropies)
+
+        output_file = os.path.join(self.output_directory_path, 'entropy.txt')
+        entropy_analysis(self.alignment, output_file = output_file, verbose = False, num_threads = 3)
+        self.assertTrue(files_are_the_same(self.expected_result, output_file))
+
+    def test_06_Partition(self):
+        reads = ['ACGT-NACGA', 'ACCT-NAGGA', 'TCGA-AACGA', 'ACGTTNACGC', 'ACCTTAAGGA']
+        for discriminants in [[2], [0, 2], [0, 1, 2, 3, 4, 5, 6, 7, 8, 9]]:
+            # reads are visited from the last one to the first one, like the decomposer does
+            expected_partition = {}
+            for row in range(len(reads) - 1, -1, -1):
+                oligo = ''.join([reads[row][d] for d in discriminants])
+                expected_partition.setdefault(oligo, []).append(row)
+
+            partition = get_partition(get_oligo_codes(encode_sequences(reads), discriminants))
+            self.assertTrue([rows.tolist() for rows in partition] == list(expected_partition.values()))
+
     def test_99_CleanUp(self):
         shutil.rmtree(self.output_directory_path)
@@ -0,0 +1,70 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import unittest
+
+import Oligotyping.lib.fastalib as u
+
+my_path = os.path.dirname(os.path.realpath(__file__))
+
+def read_all(source, attributes):
+    entries = []
+    while next(source):
+        entries.append(tuple([getattr(source, a) for a in attributes] + [source.pos]))
+    source.close()
+    return entries
+
+class Tests(unittest.TestCase):
+    def setUp(self):
+        self.output_directory_path = os.path.join(my_path, 'test-fastalib')
+        if not os.path.exists(self.output_directory_path):
+            os.makedirs(self.output_directory_path)
+        self.alignment = os.path.join(my_path, 'files/unaligned-25K-illumina-test.fa')
+        self.multiline_fasta = os.path.join(my_path, 'files/mock/mock-env-aligned.fasta')
+        self.quals = os.path.join(my_path, 'files/500-V6V4-Pelagibacter.qual')
+
+    def tearDown(self):
+        pass
+
+    def test_01_BufferedSequenceSource(self):
+        for fasta_file_path in [self.alignment, self.multiline_fasta]:
+            expected = read_all(u.SequenceSource(fasta_file_path, buffered = False), ['id', 'seq'])
+
+            fasta = u.SequenceSource(fasta_file_path, lazy_init = False)
+            fasta.block_reader.block_size = 1000
+            self.assertTrue(fasta.total_seq == len(expected))
+            self.assertTrue(read_all(fasta, ['id', 'seq']) == expected)
+
+    def test_02_BufferedSequenceSourceUnique(self):
+        expected = read_all(u.SequenceSource(self.alignment, unique = True, buffered = False), ['id', 'seq', 'ids'])
+        self.assertTrue(read_all(u.SequenceSource(self.alignment, unique = True), ['id', 'seq', 'ids']) == expected)
+
+    def test_03_BufferedQualSource(self):
+        expected = read_all(u.QualSource(self.quals, buffered = False), ['id', 'quals', 'quals_int'])
+        quals = u.QualSource(self.quals)
+        quals.block_reader.block_size = 1000
+        self.assertTrue(read_all(quals, ['id', 'quals', 'quals_int']) == expected)
+
+    def test_04_FastaIndex(self):
+        alignment = os.path.join(self.output_directory_path, 'alignment.fa')
+        shutil.copy(self.multiline_fasta, alignment)
+
+        expected = read_all(u.SequenceSource(alignment, buffered = False), ['id', 'seq'])
+
+        fasta = u.SequenceSource(alignment)
+        for read_id, seq, pos in expected[::-1]:
+            self.assertTrue(fasta.get_seq_by_read_id(read_id) == seq)
+        self.assertTrue(fasta.get_seq_by_read_id('not_a_read_id') is False)
+        fasta.close()
+
+        # the index is stored, and re-used as long as the FASTA file is not changed
+        self.assertTrue(os.path.exists(alignment + u.FastaIndex.INDEX_SUFFIX))
+        self.assertTrue(u.FastaIndex(alignment).load())
+
+        open(alignment, 'a').write('>new_read\nACGT\n')
+        self.assertTrue(u.FastaIndex(alignment).get_seq('new_read') == 'ACGT')
+
+    def test_99_CleanUp(self):
+        shutil.rmtree(self.output_directory_path)
@@ -0,0 +1,53 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import random
+import unittest
+
+import numpy
+
+from Oligotyping.lib.oligo_codec import OligoCodec
+from Oligotyping.lib.oligo_codec import get_oligo_codec
+
+
+class Tests(unittest.TestCase):
+    def setUp(self):
+        random.seed(0)
+
+    def tearDown(self):
+        pass
+
+    def get_oligos(self, num_positions, alphabet = 'ACGT-N', num_oligos = 500):
+        return [''.join([random.choice(alphabet) for i in range(0, num_positions)]) for j in range(0, num_oligos)]
+
+    def get_columns(self, oligos):
+        return numpy.frombuffer(''.join(oligos).encode('ascii'), dtype = numpy.uint8).reshape(len(oligos), -1)
+
+    def test_01_EncodeDecode(self):
+        for num_positions in [1, 5, 21, 30]:
+            codec = OligoCodec(num_positions)
+            oligos = self.get_oligos(num_positions)
+            codes = [codec.encode(oligo) for oligo in oligos]
+
+            self.assertTrue([codec.decode(code) for code in codes] == oligos)
+            # codes sort the way oligotypes do
+            self.assertTrue([codec.decode(code) for code in sorted(codes)] == sorted(oligos))
+
+        codec = OligoCodec(3)
+        self.assertTrue(codec.bits == 3)
+        self.assertTrue(codec.encode('AC') is None)
+        self.assertTrue(codec.encode('ACR') is None)
+
+    def test_02_EncodeColumns(self):
+        for num_positions, alphabet in [(4, 'ACGT-N'), (21, 'ACGT-N'), (22, 'ACGT-N'), (4, 'ACGTRYacgt-')]:
+            oligos = self.get_oligos(num_positions, alphabet)
+            codec = get_oligo_codec(self.get_columns(oligos))
+            codes, indices = codec.encode_columns(self.get_columns(oligos))
+
+            self.assertTrue(codes == sorted(set(codes)))
+            self.assertTrue([codec.decode(codes[i]) for i in indices] == oligos)
+            self.assertTrue([codes[i] for i in indices] == [codec.encode(oligo) for oligo in oligos])
+
+
+if __name__ == '__main__':
+    unittest.main()
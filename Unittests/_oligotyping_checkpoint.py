@@ -0,0 +1,89 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import unittest
+
+from Oligotyping.lib.oligotyping import Oligotyping
+from Oligotyping.lib.checkpoint import CHECKPOINT_FILE_NAME
+
+my_path = os.path.dirname(os.path.realpath(__file__))
+
+def files_are_the_same(file1, file2):
+    lines1 = open(file1).readlines()
+    lines2 = open(file2).readlines()
+
+    if len(lines1) != len(lines2):
+        return False
+
+    for i in range(0, len(lines1)):
+        if lines1[i] != lines2[i]:
+            return False
+
+    return True
+
+def get_oligotyping(output_directory_path, min_number_of_samples = 1, min_percent_abundance = 0.0,
+                    min_actual_abundance = 0, min_substantive_abundance = 0):
+    oligotyping = Oligotyping()
+    oligotyping.alignment = os.path.join(my_path, 'files/unaligned-25K-illumina-test.fa')
+    oligotyping.skip_alignment_cache = True
+    oligotyping.entropy = os.path.join(my_path, 'files/unaligned-25K-illumina-test-entropy.txt')
+    oligotyping.number_of_auto_components = 4
+    oligotyping.min_number_of_samples = min_number_of_samples
+    oligotyping.min_percent_abundance = min_percent_abundance
+    oligotyping.min_actual_abundance = min_actual_abundance
+    oligotyping.min_substantive_abundance = min_substantive_abundance
+    oligotyping.quick = True
+    oligotyping.no_figures = True
+    oligotyping.skip_gen_html = True
+    oligotyping.output_directory = output_directory_path
+    oligotyping.progress.verbose = False
+    oligotyping.run.verbose = False
+    return oligotyping
+
+class Tests(unittest.TestCase):
+    def setUp(self):
+        self.output_directory_path = os.path.join(my_path, 'test-oligotyping-checkpoint')
+        self.checkpoint = os.path.join(self.output_directory_path, 'first', CHECKPOINT_FILE_NAME)
+
+    def tearDown(self):
+        pass
+
+    def test_01_Checkpoint(self):
+        oligotyping = get_oligotyping(os.path.join(self.output_directory_path, 'first'))
+        oligotyping.run_all()
+        self.assertTrue(os.path.exists(self.checkpoint))
+
+    def test_02_ReuseCheckpoint(self):
+        for i, filters in enumerate([(2, 0.5, 10, 5), (3, 1.0, 50, 20), (1, 0.0, 0, 0)]):
+            oligotyping = get_oligotyping(os.path.join(self.output_directory_path, 'full-%d' % i), *filters)
+            oligotyping.run_all()
+
+            reusing_oligotyping = get_oligotyping(os.path.join(self.output_directory_path, 'reuse-%d' % i), *filters)
+            reusing_oligotyping.reuse_checkpoint = self.checkpoint
+            reusing_oligotyping.run_all()
+
+            self.assertTrue(reusing_oligotyping.read_table is None)
+            self.assertTrue(reusing_oligotyping.abundant_oligos == oligotyping.abundant_oligos)
+            self.assertTrue(reusing_oligotyping.excluded_read_ids_tracker == oligotyping.excluded_read_ids_tracker)
+            for file_name in ['ENVIRONMENT.txt', 'MATRIX-COUNT.txt', 'MATRIX-PERCENT.txt', 'READ-DISTRIBUTION.txt']:
+                self.assertTrue(files_are_the_same(os.path.join(oligotyping.output_directory, file_name),
+                                                   os.path.join(reusing_oligotyping.output_directory, file_name)))
+
+    def test_03_ReuseCheckpointWithDifferentComponents(self):
+        oligotyping = get_oligotyping(os.path.join(self.output_directory_path, 'components'))
+        oligotyping.number_of_auto_components = 5
+        oligotyping.reuse_checkpoint = self.checkpoint
+        oligotyping.run_all()
+
+        # the alignment is read when components are not the same
+        self.assertTrue(oligotyping.read_table is not None)
+        self.assertTrue(len(oligotyping.abundant_oligos[0]) == 5)
+
+    def test_99_CleanUp(self):
+        shutil.rmtree(self.output_directory_path)
+
+
+if __name__ == '__main__':
+    unittest.main()
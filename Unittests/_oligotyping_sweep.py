@@ -0,0 +1,74 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import unittest
+
+from Oligotyping.lib.oligotyping import Oligotyping
+
+my_path = os.path.dirname(os.path.realpath(__file__))
+
+def files_are_the_same(file1, file2):
+    lines1 = open(file1).readlines()
+    lines2 = open(file2).readlines()
+
+    if len(lines1) != len(lines2):
+        return False
+
+    for i in range(0, len(lines1)):
+        if lines1[i] != lines2[i]:
+            return False
+
+    return True
+
+def get_oligotyping(output_directory_path):
+    oligotyping = Oligotyping()
+    oligotyping.alignment = os.path.join(my_path, 'files/unaligned-25K-illumina-test.fa')
+    oligotyping.skip_alignment_cache = True
+    oligotyping.entropy = os.path.join(my_path, 'files/unaligned-25K-illumina-test-entropy.txt')
+    oligotyping.min_actual_abundance = 10
+    oligotyping.no_figures = True
+    oligotyping.skip_gen_html = True
+    oligotyping.output_directory = output_directory_path
+    oligotyping.progress.verbose = False
+    oligotyping.run.verbose = False
+    return oligotyping
+
+class Tests(unittest.TestCase):
+    def setUp(self):
+        self.output_directory_path = os.path.join(my_path, 'test-oligotyping-sweep')
+        self.component_sets = [2, 4, '3,8,15', [25, 8, 3]]
+
+    def tearDown(self):
+        pass
+
+    def test_01_Sweep(self):
+        for no_threading in [False, True]:
+            sweep_directory_path = os.path.join(self.output_directory_path, 'sweep-%s' % no_threading)
+            oligotyping = get_oligotyping(sweep_directory_path)
+            oligotyping.no_threading = no_threading
+            summaries = oligotyping.sweep(self.component_sets)
+
+            self.assertTrue(os.path.exists(os.path.join(sweep_directory_path, 'SWEEP-SUMMARY.txt')))
+            self.assertTrue(len(summaries) == len(self.component_sets))
+
+            for i in range(0, len(self.component_sets)):
+                oligotyping = get_oligotyping(os.path.join(self.output_directory_path, 'single-%d' % i))
+                if type(self.component_sets[i]) == type(0):
+                    oligotyping.number_of_auto_components = self.component_sets[i]
+                else:
+                    oligotyping.number_of_auto_components = None
+                    oligotyping.selected_components = ','.join([str(c) for c in self.component_sets[i]]) \
+                                                        if type(self.component_sets[i]) == type([]) else self.component_sets[i]
+                oligotyping.run_all()
+
+                self.assertTrue(summaries[i]['num_oligos'] == len(oligotyping.abundant_oligos))
+                self.assertTrue(summaries[i]['num_sequences_after_qc'] == oligotyping.num_sequences_after_qc)
+                self.assertTrue(summaries[i]['total_purity_score'] == oligotyping.total_purity_score_dict)
+                for file_name in ['ENVIRONMENT.txt', 'MATRIX-COUNT.txt', 'OLIGO-REPRESENTATIVES.fasta']:
+                    self.assertTrue(files_are_the_same(os.path.join(oligotyping.output_directory, file_name),
+                                                       os.path.join(sweep_directory_path, summaries[i]['setting'], file_name)))
+
+    def test_99_CleanUp(self):
+        shutil.rmtree(self.output_directory_path)
@@ -0,0 +1,93 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import unittest
+
+import Oligotyping.lib.fastalib as u
+import Oligotyping.utils.utils as utils
+from Oligotyping.lib.alignment_cache import AlignmentCache
+from Oligotyping.lib.read_table import ReadTable
+
+my_path = os.path.dirname(os.path.realpath(__file__))
+
+class Tests(unittest.TestCase):
+    def setUp(self):
+        self.output_directory_path = os.path.join(my_path, 'test-read-table')
+        if not os.path.exists(self.output_directory_path):
+            os.makedirs(self.output_directory_path)
+
+        self.alignment = os.path.join(self.output_directory_path, 'alignment.fa')
+        if not os.path.exists(self.alignment):
+            shutil.copy(os.path.join(my_path, 'files/clone43-v6v4.fa'), self.alignment)
+
+        self.bases_of_interest_locs = [292, 293, 296]
+
+    def tearDown(self):
+        pass
+
+    def test_01_ReadTable(self):
+        for alignment_cache in [None, AlignmentCache(self.alignment)]:
+            read_table = ReadTable(self.alignment, self.bases_of_interest_locs, alignment_cache = alignment_cache)
+
+            fasta = u.SequenceSource(self.alignment)
+            while next(fasta):
+                i = fasta.pos - 1
+                self.assertTrue(read_table.get_read_id(i) == fasta.id)
+                self.assertTrue(read_table.unique_seqs[read_table.unique_codes[i]] == fasta.seq)
+                oligo = read_table.oligo_codec.decode(read_table.oligos[read_table.oligo_indices[i]])
+                self.assertTrue(oligo == ''.join([fasta.seq[o] for o in self.bases_of_interest_locs]))
+                self.assertTrue(read_table.sample_names[read_table.sample_codes[i]] == utils.get_sample_name_from_defline(fasta.id))
+
+            self.assertTrue(read_table.num_reads == fasta.pos)
+            self.assertTrue(read_table.alignment_length == len(read_table.unique_seqs[0]))
+            self.assertTrue(read_table.kept.all())
+
+    def test_02_UniqueSequencesOfOligos(self):
+        read_table = ReadTable(self.alignment, self.bases_of_interest_locs)
+        unique_sequences = read_table.get_unique_sequences_of_oligos(read_table.oligos)
+
+        for oligo_code in read_table.oligos:
+            oligo = read_table.oligo_codec.decode(oligo_code)
+            oligo_fasta_path = os.path.join(self.output_directory_path, oligo)
+            oligo_fasta = u.FastaOutput(oligo_fasta_path)
+            fasta = u.SequenceSource(self.alignment)
+            while next(fasta):
+                if ''.join([fasta.seq[o] for o in self.bases_of_interest_locs]) == oligo:
+                    oligo_fasta.write_id(fasta.id)
+                    oligo_fasta.write_seq(fasta.seq, split = False)
+            oligo_fasta.close()
+
+            expected = []
+            unique_fasta = u.SequenceSource(oligo_fasta_path, unique = True)
+            while next(unique_fasta):
+                expected.append((unique_fasta.seq, unique_fasta.ids))
+
+            self.assertTrue([(read_table.unique_seqs[unique_code], [read_table.get_read_id(i) for i in read_indices]) \
+                                            for unique_code, read_indices in unique_sequences[oligo_code]] == expected)
+
+    def test_03_MostAbundantUniqueSequences(self):
+        read_table = ReadTable(self.alignment, self.bases_of_interest_locs)
+        unique_sequences = read_table.get_unique_sequences_of_oligos(read_table.oligos)
+        frequencies = read_table.get_frequencies_of_most_abundant_unique_sequences()
+
+        for index in range(0, len(read_table.oligos)):
+            oligo_code = read_table.oligos[index]
+            self.assertTrue(frequencies[index] == max([len(read_indices) for unique_code, read_indices in unique_sequences[oligo_code]]))
+
+    def test_04_ReadTableOfComponents(self):
+        read_table = ReadTable(self.alignment, [10, 292, 293, 296, 300])
+        read_table_of_components = read_table.get_read_table_of_components(self.bases_of_interest_locs)
+        expected = ReadTable(self.alignment, self.bases_of_interest_locs)
+
+        self.assertTrue(read_table_of_components.oligos == expected.oligos)
+        self.assertTrue((read_table_of_components.oligo_indices == expected.oligo_indices).all())
+        self.assertTrue((read_table_of_components.unique_codes == expected.unique_codes).all())
+
+    def test_99_CleanUp(self):
+        shutil.rmtree(self.output_directory_path)
+
+
+if __name__ == '__main__':
+    unittest.main()
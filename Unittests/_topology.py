@@ -0,0 +1,132 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import inspect
+import numpy
+import unittest
+
+from Oligotyping.lib import topology
+from Oligotyping.lib.topology import Topology
+from Oligotyping.lib.topology import RepresentativeIndex
+from Oligotyping.lib.topology import get_percent_identities_to_representatives
+from Oligotyping.lib.entropy import entropy
+from Oligotyping.lib.entropy import encode_sequences
+from Oligotyping.lib.entropy import get_base_counts
+from Oligotyping.lib.unique_reads import UniqueReadStore
+
+my_path = os.path.realpath(os.path.abspath(os.path.split(inspect.getfile(inspect.currentframe()))[0]))
+
+class Tests(unittest.TestCase):
+    def setUp(self):
+        self.output_directory_path = os.path.join(my_path, 'test-topology')
+        if not os.path.exists(self.output_directory_path):
+            os.makedirs(self.output_directory_path)
+
+        alignment_path = os.path.join(self.output_directory_path, 'reads.fa')
+        alignment = open(alignment_path, 'w')
+        for seq, frequency in [('ACGT-NACGA', 30), ('ACCT-NAGGA', 1), ('TCGA-AACGA', 7), ('ACGTTNACGC', 2)]:
+            for i in range(0, frequency):
+                alignment.write('>read_%s_%d\n%s\n' % (seq, i, seq))
+        alignment.close()
+
+        self.read_store = UniqueReadStore.from_fasta(alignment_path)
+        self.topology = Topology(self.output_directory_path, self.read_store)
+        self.unique_read_indices = numpy.arange(0, self.read_store.num_uniques)
+
+    def tearDown(self):
+        pass
+
+    def test_01_NodeEntropy(self):
+        node = self.topology.add_new_node('root', self.unique_read_indices, root = True)
+        self.assertTrue(node.read_matrix.shape == (4, 10))
+        self.assertTrue(node.size == 40)
+
+        seqs = [self.read_store.get_seq(i) for i in self.unique_read_indices]
+        for position in range(0, len(seqs[0])):
+            column = ''.join([seqs[i][position] * int(self.read_store.frequencies[i]) for i in self.unique_read_indices])
+            e = 0.0 if len(set(column)) == 1 else entropy(column)
+            self.assertTrue(node.entropy[position] == (e if e >= 0.00001 else 0.0))
+
+    def test_02_PartitionBaseCounts(self):
+        node = self.topology.add_new_node('root', self.unique_read_indices, root = True)
+        node.base_counts = get_base_counts(node.read_matrix, node.frequencies)
+
+        partition = [numpy.array([0, 2]), numpy.array([1]), numpy.array([3])]
+        base_counts_list = node.get_partition_base_counts(partition)
+
+        for rows, base_counts in zip(partition, base_counts_list):
+            self.assertTrue((base_counts == get_base_counts(node.read_matrix[rows], node.frequencies[rows])).all())
+
+    def test_03_PercentIdentities(self):
+        node = self.topology.add_new_node('root', self.unique_read_indices, root = True)
+
+        # reads are sorted by frequency. identities come from edit distances between
+        # sequences with gaps removed, relative to the longer one.
+        expected = [100.0, 100 * 6 / 9.0, 100 * 8 / 10.0, 100 * 7 / 9.0]
+        percent_identities = get_percent_identities_to_representatives([node.get_read_matrix()], 0.0)[0]
+        self.assertTrue(numpy.allclose(percent_identities, expected))
+
+        # results should not depend on how matrices are split into chunks
+        chunk_size = topology.COMPARISON_CHUNK_SIZE
+        topology.COMPARISON_CHUNK_SIZE = 10
+        try:
+            chunked = get_percent_identities_to_representatives([node.read_matrix, node.read_matrix[1:]], 0.0)
+        finally:
+            topology.COMPARISON_CHUNK_SIZE = chunk_size
+
+        self.assertTrue(numpy.allclose(chunked[0], expected))
+        self.assertTrue(numpy.allclose(chunked[1], [100.0, 100 * 5 / 10.0, 100 * 4 / 9.0]))
+
+        # an indel that shifts every following column is two edits away, not eleven. reads
+        # that are too distant only need to fall below the minimum identity.
+        read_matrix = encode_sequences(['ACGTACGTACG-', '-CGTACGTACGT', 'TTTTTTTTTTTT'])
+        percent_identities = get_percent_identities_to_representatives([read_matrix], 80.0)[0]
+        self.assertTrue(numpy.allclose(percent_identities[:2], [100.0, 100 * 9 / 11.0]))
+        self.assertTrue(percent_identities[2] < 80.0)
+
+    def test_04_RepresentativeIndex(self):
+        index = RepresentativeIndex(['n1', 'n2'], ['ACGT-NACGA', 'TCGA-AACGA'])
+        reads = encode_sequences(['ACGT-NACGA', 'TCGT-AACGA', 'ACCT-NAGGA', 'TTTTTTTTTT'])
+
+        closest, percent_identities = index.search(reads, 70.0)
+        self.assertTrue(closest.tolist() == [0, 1, 0, -1])
+        self.assertTrue(numpy.allclose(percent_identities[:3], [100.0, 100 * 8 / 9.0, 100 * 7 / 9.0]))
+
+        closest, percent_identities = index.search(reads, 80.0)
+        self.assertTrue(closest.tolist() == [0, 1, -1, -1])
+
+        # a read that is shifted by an indel is closer to the first representative (one edit)
+        # than to the second one (two edits), even though more columns of the alignment match
+        # the second one.
+        index = RepresentativeIndex(['n1', 'n2'], ['ACGTACGTAC', 'AACGTACGTT'])
+        closest, percent_identities = index.search(encode_sequences(['-ACGTACGTA']), 80.0)
+        self.assertTrue(closest.tolist() == [0])
+        self.assertTrue(numpy.allclose(percent_identities, [90.0]))
+
+    def test_05_NodeReads(self):
+        # nodes keep indices of their unique reads in the store, most abundant first
+        node = self.topology.add_new_node('root', [3, 0, 2], root = True)
+        self.assertTrue(node.unique_read_indices.dtype == numpy.int32)
+        self.assertTrue(node.unique_read_indices.tolist() == [0, 2, 3])
+        self.assertTrue(node.representative_seq == 'ACGT-NACGA')
+        self.assertTrue(node.size == 30 + 2 + 1)
+
+        self.topology.store_outliers(numpy.array([1], dtype = numpy.int32), 'reason')
+        self.assertTrue(self.topology.get_num_outliers('reason') == 7)
+        self.topology.relocate_outliers([1], ['root'], 'reason')
+        self.assertTrue(len(self.topology.outliers['reason']) == 0)
+
+        node.refresh()
+        self.assertTrue(node.unique_read_indices.tolist() == [0, 1, 2, 3])
+        self.assertTrue(node.size == 40)
+
+        # sequences and read IDs are resolved through the store when the node is stored
+        node.store()
+        unique_alignment = [line.strip() for line in open(node.unique_alignment_path)]
+        self.assertTrue(unique_alignment[0:2] == ['>read_ACGT-NACGA_0|frequency:30', 'ACGT-NACGA'])
+        self.assertTrue(len([line for line in open(node.alignment_path) if line.startswith('>')]) == 40)
+
+    def test_99_CleanUp(self):
+        shutil.rmtree(self.output_directory_path)
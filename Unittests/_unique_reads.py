@@ -0,0 +1,154 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import os
+import copy
+import numpy
+import shutil
+import unittest
+
+import Oligotyping.lib.fastalib as u
+import Oligotyping.utils.utils as utils
+from Oligotyping.lib.alignment_cache import AlignmentCache
+from Oligotyping.lib.unique_reads import UniqueReadStore
+from Oligotyping.lib.unique_reads import CACHE_SUFFIX
+from Oligotyping.lib.unique_reads import get_unique_read_store_from_cache
+from Oligotyping.lib.unique_reads import store_unique_read_store_cache
+from Oligotyping.lib.decomposer import Decomposer
+
+my_path = os.path.dirname(os.path.realpath(__file__))
+
+def get_all_ids(store):
+    return [store.get_ids(i) for i in range(0, store.num_uniques)]
+
+def get_decomposer(alignment, output_directory_path):
+    decomposer = Decomposer()
+    decomposer.alignment = alignment
+    decomposer.min_entropy = 0.2
+    decomposer.min_actual_abundance = 1
+    decomposer.min_substantive_abundance = 1
+    decomposer.number_of_discriminants = 3
+    decomposer.skip_check_input_file = True
+    decomposer.skip_removing_outliers = True
+    decomposer.skip_agglomerating_nodes = True
+    decomposer.progress.verbose = False
+    decomposer.run.verbose = False
+    decomposer.skip_gen_figures = True
+    decomposer.output_directory = output_directory_path
+    return decomposer
+
+class Tests(unittest.TestCase):
+    def setUp(self):
+        self.output_directory_path = os.path.join(my_path, 'test-unique-reads')
+        if not os.path.exists(self.output_directory_path):
+            os.makedirs(self.output_directory_path)
+
+        self.alignment = os.path.join(self.output_directory_path, 'alignment.fa')
+        if not os.path.exists(self.alignment):
+            shutil.copy(os.path.join(my_path, 'files/clone43-v6v4.fa'), self.alignment)
+
+    def tearDown(self):
+        pass
+
+    def test_01_StoreFromFASTA(self):
+        store = UniqueReadStore.from_fasta(self.alignment)
+        unique_fasta = u.SequenceSource(self.alignment, unique = True)
+
+        for i in range(0, store.num_uniques):
+            self.assertTrue(next(unique_fasta))
+            self.assertTrue((store.get_seq(i), store.get_ids(i), store.frequencies[i]) == (unique_fasta.seq, unique_fasta.ids, len(unique_fasta.ids)))
+
+        self.assertFalse(next(unique_fasta))
+        self.assertTrue(store.num_reads == sum(store.frequencies))
+
+        # alignments that do not fit into the memory budget are dereplicated on the disk
+        tmp_directory = os.path.join(self.output_directory_path, 'tmp')
+        os.makedirs(tmp_directory)
+        out_of_core_store = UniqueReadStore.from_fasta(self.alignment, memory_budget = 10000, num_threads = 2,
+                                                       tmp_directory = tmp_directory)
+        self.assertTrue((store.matrix == out_of_core_store.matrix).all())
+        self.assertTrue(get_all_ids(store) == get_all_ids(out_of_core_store))
+        self.assertFalse(os.listdir(tmp_directory))
+
+    def test_02_StoreFromAlignmentCache(self):
+        store = UniqueReadStore.from_fasta(self.alignment)
+        cached_store = UniqueReadStore.from_alignment_cache(AlignmentCache(self.alignment))
+
+        self.assertTrue((store.matrix == cached_store.matrix).all())
+        self.assertTrue((store.read_indices == cached_store.read_indices).all())
+        self.assertTrue(get_all_ids(store) == get_all_ids(cached_store))
+
+        sample_codes, sample_names = store.get_sample_codes('_')
+        cached_sample_codes, cached_sample_names = cached_store.get_sample_codes('_')
+        self.assertTrue([sample_names[c] for c in sample_codes] == [cached_sample_names[c] for c in cached_sample_codes])
+
+    def test_03_UniqueReads(self):
+        store = UniqueReadStore.from_fasta(self.alignment)
+
+        # the store is shared by copies of nodes
+        self.assertTrue(copy.deepcopy(store) is store)
+
+        # digests are kept in the store once they are computed
+        md5id = store.get_md5id(0)
+        self.assertTrue(md5id == utils.UniqueFASTAEntry(store.get_seq(0), store.get_ids(0)).md5id)
+        self.assertTrue(store.md5ids[0].decode('ascii') == md5id)
+        self.assertFalse(store.md5ids[1])
+
+        indices = numpy.array([3, 0, 5], dtype = numpy.int32)
+        read_ids = [store.get_read_id(i) for i in store.get_read_indices_of_uniques(indices)]
+        self.assertTrue(read_ids == store.get_ids(3) + store.get_ids(0) + store.get_ids(5))
+        self.assertTrue(store.get_size(indices) == len(read_ids))
+
+    def test_04_UniqueReadsCache(self):
+        store = UniqueReadStore.from_fasta(self.alignment)
+        cache_path = os.path.join(self.output_directory_path, 'alignment.fa' + CACHE_SUFFIX)
+
+        self.assertTrue(get_unique_read_store_from_cache(self.alignment, cache_path) is None)
+        self.assertTrue(store_unique_read_store_cache(store, self.alignment, cache_path, '_'))
+
+        cached_store = get_unique_read_store_from_cache(self.alignment, cache_path)
+        self.assertTrue((store.matrix == cached_store.matrix).all())
+        self.assertTrue((store.frequencies == cached_store.frequencies).all())
+        self.assertTrue(get_all_ids(store) == get_all_ids(cached_store))
+        self.assertTrue(cached_store.get_sample_codes('_')[1] == store.get_sample_codes('_')[1])
+
+        # a copy of the alignment with the same contents can use the same cache
+        alignment_copy = os.path.join(self.output_directory_path, 'alignment-copy.fa')
+        shutil.copy(self.alignment, alignment_copy)
+        os.remove(cache_path + '.signature')
+        self.assertTrue(get_unique_read_store_from_cache(alignment_copy, cache_path) is not None)
+
+        open(alignment_copy, 'a').write('>Sample_new_1\n%s\n' % store.get_seq(0))
+        self.assertTrue(get_unique_read_store_from_cache(alignment_copy, cache_path) is None)
+
+    def test_05_EditedAlignment(self):
+        alignment = os.path.join(self.output_directory_path, 'edited-alignment.fa')
+        shutil.copy(self.alignment, alignment)
+        cache_path = alignment + CACHE_SUFFIX
+
+        decomposer = get_decomposer(alignment, os.path.join(self.output_directory_path, 'decomposition'))
+        decomposer.decompose()
+        num_reads = decomposer.read_store.num_reads
+
+        explicit_cache_path = os.path.join(self.output_directory_path, 'explicit' + CACHE_SUFFIX)
+        shutil.copy(cache_path, explicit_cache_path)
+
+        open(alignment, 'a').write('>Sample_new_1\n%s\n' % decomposer.read_store.get_seq(0))
+
+        # the default cache is generated again for the edited alignment
+        decomposer = get_decomposer(alignment, os.path.join(self.output_directory_path, 'decomposition'))
+        decomposer.decompose()
+        self.assertTrue(decomposer.read_store.num_reads == num_reads + 1)
+        self.assertTrue(get_unique_read_store_from_cache(alignment, cache_path).num_reads == num_reads + 1)
+
+        # a cache that is asked for explicitly is not
+        decomposer = get_decomposer(alignment, os.path.join(self.output_directory_path, 'decomposition'))
+        decomposer.unique_reads_cache = explicit_cache_path
+        self.assertRaises(utils.ConfigError, decomposer.decompose)
+
+    def test_99_CleanUp(self):
+        shutil.rmtree(self.output_directory_path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,8 +2,12 @@
 # -*- coding: utf-8 -*-
 
 import os
+import sys
+import numpy
+import pickle
 import shutil
 import unittest
+import subprocess
 
 import collections
 Compare = lambda x, y: collections.Counter(x) == collections.Counter(y)
@@ -28,3 +32,73 @@ class Tests(unittest.TestCase):
         
         chunks_spiral = m.get_data_chunks([1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11], spiral = True)
         self.assertTrue(chunks_spiral == [[1, 4, 7, 10], [2, 5, 8, 11], [3, 6, 9]])
+
+    def test_02_WorkerPool(self):
+        def worker(x, y):
+            if x < 0:
+                raise Oligotyping.utils.utils.ConfigError('negative: %d' % x)
+            return x * y
+
+        completed = []
+        with Oligotyping.utils.utils.Multiprocessing(worker, 3) as m:
+            results = m.map([(x, 2) for x in range(0, 25)], callback = lambda i, result: completed.append(i))
+
+            # workers are persistent, so the same ones run the next batch of tasks
+            pids = set([p.pid for p in m.processes])
+            self.assertTrue(m.map([(1, 3), (2, 3)], chunk_size = 1) == [3, 6])
+            self.assertTrue(pids == set([p.pid for p in m.processes]))
+
+        self.assertTrue(results == [x * 2 for x in range(0, 25)])
+        self.assertTrue(sorted(completed) == list(range(0, 25)))
+
+        m = Oligotyping.utils.utils.Multiprocessing(worker, 2)
+        with self.assertRaises(Oligotyping.utils.utils.ConfigError) as e:
+            m.map([(1, 1), (-1, 1)], chunk_size = 1)
+        self.assertTrue(e.exception.e == 'negative: -1')
+        self.assertTrue(m.processes == [])
+
+    def test_03_SharedArray(self):
+        array = numpy.arange(12, dtype = numpy.int64).reshape(3, 4)
+        shared_array = Oligotyping.utils.utils.SharedArray(array)
+
+        # the copy attaches to the same block of memory
+        attached_array = pickle.loads(pickle.dumps(shared_array))
+        self.assertTrue((attached_array.get() == array).all())
+
+        shared_array.get()[1, 1] = 42
+        self.assertTrue(attached_array.get()[1, 1] == 42)
+
+        attached_array.close()
+
+        # a process that is not a child of the creator attaches to the block as well, and the
+        # block should still be there after it exits.
+        script = 'import sys, pickle; a = pickle.loads(sys.stdin.buffer.read()); print(a.get()[1, 1]); a.close()'
+        output = subprocess.run([sys.executable, '-c', script], input = pickle.dumps(shared_array),
+                                stdout = subprocess.PIPE, stderr = subprocess.PIPE,
+                                env = dict(os.environ, PYTHONPATH = os.pathsep.join(sys.path)))
+        self.assertTrue(output.stdout.strip() == b'42')
+        self.assertTrue(output.stderr == b'')
+        self.assertTrue((shared_array.get()[1] == [4, 42, 6, 7]).all())
+
+        shared_array.close()
+
+    def test_04_SingleIndelNeighbors(self):
+        query_seqs = {'q1': 'ACGTTTA-C', 'q2': 'ACGTTAC', 'q3': 'GGGG'}
+        target_seqs = {'q1': 'ACGTTTAC', 't1': 'ACGTTAC--', 't2': 'ACGTTTTAC', 't3': 'ACGTTTACC', 't4': 'TCGTTTAC', 't5': 'ACGTTTA'}
+
+        neighbors = Oligotyping.utils.utils.get_single_indel_neighbors(query_seqs, target_seqs)
+        self.assertTrue(neighbors == {'q1': set(['t1', 't2', 't3', 't5']), 'q2': set(['q1'])})
+
+    def test_05_SampleCodes(self):
+        read_ids = ['Sample_B_1', 'Sample_A_1', 'Sample_B_2', 'Sample_C_1', 'Sample_A_2', 'Sample_B_3']
+
+        sample_codes, sample_names = Oligotyping.utils.utils.get_sample_codes(read_ids, '_')
+        self.assertTrue(sample_names == ['Sample_B', 'Sample_A', 'Sample_C'])
+        self.assertTrue(list(sample_codes) == [0, 1, 0, 2, 1, 0])
+
+        sample_codes, sample_names = Oligotyping.utils.utils.get_sample_codes(['Sample_D_1', 'Sample_A_3'], '_', sample_names)
+        self.assertTrue(sample_names == ['Sample_B', 'Sample_A', 'Sample_C', 'Sample_D'])
+        self.assertTrue(list(sample_codes) == [3, 1])
+
+        sample_counts = Oligotyping.utils.utils.get_sample_counts(numpy.array([2, 1, 1, 2, 1]), sample_names)
+        self.assertTrue(sample_counts == [('Sample_C', 2), ('Sample_A', 3)])
@@ -3,13 +3,16 @@
 
 import os
 import sys
+import pickle
 import shutil
 import inspect
+import argparse
 import unittest
 
 from Oligotyping.lib.entropy import entropy_analysis
 from Oligotyping.utils.utils import get_quals_dict
 from Oligotyping.utils.utils import get_qual_stats_dict
+from Oligotyping.utils.utils import process_command_line_args_for_quality_files
 
 my_path = os.path.realpath(os.path.abspath(os.path.split(inspect.getfile(inspect.currentframe()))[0]))
 
@@ -46,6 +49,20 @@ class Tests(unittest.TestCase):
         entropy_analysis(self.alignment, output_file = output_file, verbose = False, weighted = True, qual_stats_dict = QSD)
         self.assertTrue(files_are_the_same(self.expected_result, output_file))
 
+    def test_02_QualityDictFiles(self):
+        quals_dict_path = os.path.join(self.output_directory_path, 'QUALS_DICT')
+        qual_stats_dict_path = os.path.join(self.output_directory_path, 'QUAL_STATS_DICT')
+        QD = get_quals_dict(self.qual_scores_file, self.alignment, output_file_path = quals_dict_path, verbose = False)
+        QSD = get_qual_stats_dict(QD, output_file_path = qual_stats_dict_path, verbose = False)
+
+        self.assertTrue(pickle.load(open(quals_dict_path, 'rb')) == QD)
+        self.assertTrue(pickle.load(open(qual_stats_dict_path, 'rb')) == QSD)
+
+        # stored dicts can be given back from the command line
+        args = argparse.Namespace(alignment = self.alignment, qual_scores_file = None,
+                                  qual_scores_dict = None, qual_stats_dict = qual_stats_dict_path)
+        self.assertTrue(process_command_line_args_for_quality_files(args, verbose = False) == QSD)
+
     def test_99_CleanUp(self):
         shutil.rmtree(self.output_directory_path)
         pass
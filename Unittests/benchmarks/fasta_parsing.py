@@ -0,0 +1,82 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Compares the reads/sec of the buffered and the line-by-line parsers of
+# fastalib.SequenceSource and fastalib.QualSource on alignments from
+# Unittests/files, scaled up by concatenating them multiple times.
+
+import os
+import sys
+import time
+import shutil
+import inspect
+import argparse
+import tempfile
+
+my_path = os.path.realpath(os.path.abspath(os.path.split(inspect.getfile(inspect.currentframe()))[0]))
+sys.path.insert(0, os.path.join(my_path, '..', '..'))
+
+import Oligotyping.lib.fastalib as u
+
+files_path = os.path.join(my_path, '..', 'files')
+
+FASTA_FILES = ['unaligned-25K-illumina-test.fa', 'clone43-v6v4.fa', 'mock/mock-env-aligned.fasta']
+QUAL_FILES = ['500-V6V4-Pelagibacter.qual']
+
+
+def scale_up(source_path, dest_path, scale):
+    content = open(source_path).read()
+    if not content.endswith('\n'):
+        content += '\n'
+
+    dest = open(dest_path, 'w')
+    for i in range(0, scale):
+        dest.write(content)
+    dest.close()
+
+
+def time_source(source, num_rounds = 3):
+    best = None
+    for i in range(0, num_rounds):
+        source.reset()
+        start = time.time()
+        while next(source):
+            pass
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    num_reads = source.pos
+    source.close()
+    return num_reads, best
+
+
+def main(scale, num_rounds):
+    tmp_dir = tempfile.mkdtemp()
+
+    print('%-35s %-14s %10s %14s %14s' % ('file', 'parser', 'reads', 'seconds', 'reads/sec'))
+    try:
+        for file_name, source_class in [(f, u.SequenceSource) for f in FASTA_FILES] +\
+                                       [(f, u.QualSource) for f in QUAL_FILES]:
+            scaled_path = os.path.join(tmp_dir, os.path.basename(file_name))
+            scale_up(os.path.join(files_path, file_name), scaled_path, scale)
+
+            results = {}
+            for parser, buffered in [('line-by-line', False), ('buffered', True)]:
+                num_reads, elapsed = time_source(source_class(scaled_path, buffered = buffered), num_rounds)
+                results[parser] = num_reads / elapsed
+                print('%-35s %-14s %10d %14.3f %14.0f' % (file_name, parser, num_reads, elapsed, results[parser]))
+
+            print('%-35s %-14s %10s %14s %13.2fx' % ('', 'speedup', '', '', results['buffered'] / results['line-by-line']))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark FASTA/QUAL parsers in fastalib')
+    parser.add_argument('-s', '--scale', type = int, default = 20, metavar = 'INTEGER',
+                        help = 'Number of times each test file is concatenated to itself (default: %(default)d)')
+    parser.add_argument('-r', '--num-rounds', type = int, default = 3, metavar = 'INTEGER',
+                        help = 'Number of timed passes per parser; the best one is reported (default: %(default)d)')
+    args = parser.parse_args()
+
+    main(args.scale, args.num_rounds)
@@ -4,21 +4,43 @@
 import unittest
 
 # unittest declerations
+import _fastalib
+import _alignment_cache
+import _unique_reads
+import _dereplication
+import _read_table
+import _oligo_codec
 import _entropy
 import _weightedEntropy
+import _topology
 import _oligotyping
+import _oligotyping_checkpoint
+import _oligotyping_sweep
 import _decomposition
 import _decomposition_threaded
+import _decomposition_sweep
+import _decomposition_outliers
 import _utils
 import _blast
 
 def __suite():
     suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(_fastalib.Tests))
+    suite.addTest(unittest.makeSuite(_alignment_cache.Tests))
+    suite.addTest(unittest.makeSuite(_unique_reads.Tests))
+    suite.addTest(unittest.makeSuite(_dereplication.Tests))
+    suite.addTest(unittest.makeSuite(_read_table.Tests))
+    suite.addTest(unittest.makeSuite(_oligo_codec.Tests))
     suite.addTest(unittest.makeSuite(_entropy.Tests))
     suite.addTest(unittest.makeSuite(_weightedEntropy.Tests))
+    suite.addTest(unittest.makeSuite(_topology.Tests))
     suite.addTest(unittest.makeSuite(_oligotyping.Tests))
+    suite.addTest(unittest.makeSuite(_oligotyping_checkpoint.Tests))
+    suite.addTest(unittest.makeSuite(_oligotyping_sweep.Tests))
     suite.addTest(unittest.makeSuite(_decomposition.Tests))
     suite.addTest(unittest.makeSuite(_decomposition_threaded.Tests))
+    suite.addTest(unittest.makeSuite(_decomposition_sweep.Tests))
+    suite.addTest(unittest.makeSuite(_decomposition_outliers.Tests))
     suite.addTest(unittest.makeSuite(_utils.Tests))
     suite.addTest(unittest.makeSuite(_blast.Tests))
 